@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Measures how many control ticks per second the control law computes, for a
+# single drone and batched over many states, compared to the scalar code that
+# used to live in ControllerThread.calc_control_signals.
+#
+# Usage:
+#   python -m benchmarks.bench_control_law
+
+import argparse
+import time
+
+import numpy as np
+
+from src.control_law import ControlGains, ControlState, control_step
+
+
+def scalar_step(pos, vel, pos_ref, integral, yawrate, dt):
+    ex, ey, ez = pos_ref - pos
+    vx, vy, vz = vel
+    integral[0] += ex * dt
+    integral[1] += ey * dt
+    integral[2] += ez * dt
+
+    phi_ref    =      15 * ex - 15 * vx + 0 * integral[0]
+    theta_ref  =   - (15 * ey - 15 * vy + 0 * integral[1])
+    psi_ref    =                  1 * yawrate
+    thrust_ref = 100000 * (0.25 * ez - 0.15 * vz + 0.075 * integral[2] + 0.0327 * 9.82)
+
+    return ( np.clip(theta_ref, -30.0, 30.0), np.clip(phi_ref, -30.0, 30.0)
+           , np.clip(psi_ref, -200.0, 200.0), np.clip(thrust_ref, 0, 65535)
+           )
+
+
+def rate(step, seconds):
+    ticks = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for _ in range(100):
+            step()
+        ticks += 100
+    return ticks / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the control law')
+    parser.add_argument('--seconds', type = float, default = 1.0)
+    parser.add_argument('--batches', type = int, nargs = '+', default = [1000, 100000])
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    pos, vel, pos_ref = rng.randn(3, 3)
+    integral = np.zeros(3)
+    print("scalar code:        {:12,.0f} ticks/s".format(rate(lambda: scalar_step(pos, vel, pos_ref, integral, 0.0, 0.02), args.seconds)))
+
+    gains = ControlGains()
+    state = ControlState()
+    state.pos[:], state.vel[:], state.pos_ref[:] = pos, vel, pos_ref
+    print("control_step:       {:12,.0f} ticks/s".format(rate(lambda: control_step(gains, state, 0.02), args.seconds)))
+
+    for size in args.batches:
+        state = ControlState(size)
+        state.pos[:], state.vel[:], state.pos_ref[:] = rng.randn(3, size, 3)
+        ticks = rate(lambda: control_step(gains, state, 0.02), args.seconds)
+        print("batch of {:7d}:   {:12,.0f} states/s".format(size, ticks * size))
+
+
+if __name__ == '__main__':
+    main()
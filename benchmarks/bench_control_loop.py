@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Checks whether the control loop holds its rate: runs a loop with a workload
+# similar to one control tick, paced once by sleeping for the rest of the
+# period (as the controller used to) and once by the PeriodicScheduler, and
+# reports the achieved rate, drift, period jitter, and missed deadlines.
+#
+# Usage:
+#   python -m benchmarks.bench_control_loop --rate 100 --duration 10
+
+import argparse
+import time
+
+import numpy as np
+
+from src.periodic import PeriodicScheduler
+
+
+def work(seconds):
+    # stands in for estimation, control law, logging and sending the setpoint
+    end = time.perf_counter() + seconds
+    R   = np.eye(3)
+    while time.perf_counter() < end:
+        R = R @ R
+
+
+def relative_sleep(period, duration, load):
+    wakeups = []
+    start   = time.monotonic()
+    while time.monotonic() - start < duration:
+        time_start = time.time()
+        work(load)
+        delta_time = period - (time.time() - time_start)
+        if delta_time > 0:
+            time.sleep(delta_time)
+        wakeups.append(time.monotonic())
+    return np.array(wakeups), start
+
+
+def scheduled(period, duration, load):
+    wakeups = []
+    clock   = PeriodicScheduler(period)
+    clock.start()
+    start   = time.monotonic()
+    while time.monotonic() - start < duration:
+        work(load)
+        clock.wait()
+        wakeups.append(time.monotonic())
+    return np.array(wakeups), start, clock
+
+
+def report(name, period, wakeups, start, missed):
+    periods = np.diff(wakeups) * 1e3
+    ticks   = len(wakeups)
+    # how far the last tick is from where it should be after that many periods
+    drift   = (wakeups[-1] - start - ticks * period) * 1e3
+    print("{:15s} rate {:7.2f} Hz, drift {:+8.2f}ms, period p50 {:.3f}ms p99 {:.3f}ms max {:.3f}ms, missed {:d}"
+          .format(name, ticks / (wakeups[-1] - start), drift,
+                  np.percentile(periods, 50), np.percentile(periods, 99), periods.max(), missed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the pacing of the control loop')
+    parser.add_argument('--rate', type = float, default = 100)
+    parser.add_argument('--duration', type = float, default = 10)
+    parser.add_argument('--load', type = float, default = 0.3, help = 'Fraction of the period spent working')
+    args = parser.parse_args()
+
+    period = 1.0 / args.rate
+    load   = args.load * period
+
+    wakeups, start = relative_sleep(period, args.duration, load)
+    missed = int(np.sum(np.diff(wakeups) > 1.5 * period))
+    report("sleep", period, wakeups, start, missed)
+
+    wakeups, start, clock = scheduled(period, args.duration, load)
+    report("scheduler", period, wakeups, start, clock.stats()["missed"])
+    stats = clock.stats()
+    print("scheduler jitter p50 {:.3f}ms p99 {:.3f}ms".format(stats["jitter"]["p50"], stats["jitter"]["p99"]))
+
+
+if __name__ == '__main__':
+    main()
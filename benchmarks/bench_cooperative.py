@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# Compares planning the paths of several drones independently with planning
+# them cooperatively on a shared reservation table. Drones get random start
+# and target positions in the room; reports how often two drones come too
+# close at the same time step, the makespan (the time step at which the last
+# drone arrives), the planning time, and the size of the reservation table.
+# The distance fields of the targets, which both share, are computed first.
+#
+# Usage:
+#   python -m benchmarks.bench_cooperative --agents 2 4 6 8 10
+
+import argparse
+import io
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from src import scene_parser
+from src.cooperative import CooperativePlanner
+from src.path import Point
+
+
+def free(scene, point):
+    try:
+        scene.checkPoint(point, "Point")
+        return True
+    except Exception:
+        return False
+
+
+def randomPoints(scene, count, spacing, rng):
+    high   = np.array(scene.space.shape) * scene.resolution - 0.2
+    points = []
+    while len(points) < count:
+        point = Point(*rng.uniform((0.2, 0.2, 0.3), high))
+        if free(scene, point) and all(point.distanceTo(other) >= spacing for other in points):
+            points.append(point)
+    return points
+
+
+def plan(scene, planner, tasks, cooperative):
+    paths = []
+    start = time.perf_counter()
+    for drone, (source, target) in enumerate(tasks):
+        # without cooperation, every drone plans on an empty table
+        if not cooperative:
+            planner.table.release(drone - 1)
+        paths.append(planner.planPath(drone, source, target)[:-1])
+    return paths, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark cooperative path planning')
+    parser.add_argument('--room-spec', nargs = '+', default = ['./examples/room_spec_3.yaml'])
+    parser.add_argument('--agents', type = int, nargs = '+', default = [2, 4, 6, 8, 10])
+    parser.add_argument('--trials', type = int, default = 5)
+    parser.add_argument('--spacing', type = float, default = 0.4, help = 'Smallest distance between starts and between targets')
+    args = parser.parse_args()
+
+    for spec in args.room_spec:
+        try:
+            scene = scene_parser.parse(spec)
+        except Exception as e:
+            print("{}: cannot be parsed, skipping: {}".format(spec, e))
+            continue
+
+        print(spec)
+        rng = np.random.RandomState(0)
+        for agents in args.agents:
+            results = { False : [], True : [] }
+            failures = 0
+            for _ in range(args.trials):
+                tasks = list(zip(randomPoints(scene, agents, args.spacing, rng), randomPoints(scene, agents, args.spacing, rng)))
+                for _, target in tasks:
+                    scene.distanceField(target, cached = 16)
+                for cooperative in [False, True]:
+                    planner = CooperativePlanner(scene)
+                    try:
+                        # A* is chatty
+                        with redirect_stdout(io.StringIO()):
+                            paths, seconds = plan(scene, planner, tasks, cooperative)
+                    except Exception:
+                        failures += 1
+                        continue
+                    results[cooperative].append(( planner.conflicts(paths)
+                                                , max(len(path) for path in paths)
+                                                , seconds
+                                                , planner.table.size()
+                                                ))
+
+            for cooperative in [False, True]:
+                conflicts, makespan, seconds, size = np.mean(results[cooperative], axis = 0)
+                print("  {:2d} agents, {:11s}: {:6.1f} conflicts, makespan {:5.1f} steps, planned in {:6.3f}s, {:6.0f} reservations"
+                      .format(agents, "cooperative" if cooperative else "independent", conflicts, makespan, seconds, size))
+            if failures:
+                print("  {:2d} agents: {:d} plans failed".format(agents, failures))
+
+
+if __name__ == '__main__':
+    main()
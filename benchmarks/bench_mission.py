@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Flies a mission end to end without hardware: the planning server runs in its
+# own process as usual, and the controller flies a simulated crazyflie on a
+# clock that runs faster than real time. Reports the simulated time of every
+# leg and of the whole mission, and how well the control loop kept its rate.
+#
+# Usage:
+#   python -m benchmarks.bench_mission --speedup 5
+
+import argparse
+import time
+from json import dumps
+from multiprocessing import Process, Queue
+
+import numpy as np
+import requests
+
+from src.controller import ControllerThread, DistanceCommand, StartCommand
+from src.PlanningServer import run_path_planner
+from src.simulator import SimulatedClock, SimulatedCrazyflie
+
+# relative moves, starting 30cm above the start position after take-off
+LEGS = [ (1.0,  0.0, 0.7)
+       , (2.0,  0.5, 0.0)
+       , (0.0,  3.0, 0.0)
+       , (-2.5, 0.0, -0.5)
+       ]
+
+
+def wait_for(condition, clock, timeout):
+    deadline = clock.monotonic() + timeout
+    while not condition():
+        if clock.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark a simulated mission through planner and controller')
+    parser.add_argument('--room-spec', default = './examples/room_spec_3.yaml')
+    parser.add_argument('--port', type = int, default = 8103)
+    parser.add_argument('--start', type = float, nargs = 3, default = (0.5, 0.5, 0.0))
+    parser.add_argument('--speedup', type = float, default = 5)
+    parser.add_argument('--rate', type = float, default = 50, help = 'Rate of the control loop in Hz')
+    parser.add_argument('--tolerance', type = float, default = 0.1)
+    parser.add_argument('--timeout', type = float, default = 60, help = 'Simulated seconds per leg')
+    args = parser.parse_args()
+
+    queue  = Queue()
+    server = Process(target = run_path_planner, args = ("127.0.0.1", args.port, queue, args.room_spec))
+    server.start()
+
+    url = 'http://127.0.0.1:{}'.format(args.port)
+    while True:
+        try:
+            requests.post(url, data = dumps({}))
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    cf      = SimulatedCrazyflie(position = args.start, clock = SimulatedClock(args.speedup))
+    control = ControllerThread(cf, queue, planner_url = url, period_in_ms = 1000.0 / args.rate,
+                               time_source = cf.clock)
+    control.debug = False
+    control.start()
+    cf.open_link('sim://0')
+
+    legs = []
+    try:
+        # the controller is ready once the estimator has been reset
+        if not wait_for(lambda: hasattr(control, 'yaw_ref'), cf.clock, args.timeout):
+            raise Exception("The controller did not get ready!")
+
+        target = np.array(args.start) + np.r_[0.0, 0.0, 0.3]
+        arrived = lambda: (queue.empty() and np.linalg.norm(cf.model.pos[0] - target) < args.tolerance
+                                         and np.linalg.norm(cf.model.vel[0]) < args.tolerance)
+        realStart = time.perf_counter()
+        simStart  = cf.clock.monotonic()
+        for command, move in [(StartCommand(), (0.0, 0.0, 0.0))] + [(DistanceCommand(*leg), leg) for leg in LEGS]:
+            target   = target + move
+            legStart = cf.clock.monotonic()
+            queue.put(command)
+            if not wait_for(arrived, cf.clock, args.timeout):
+                raise Exception("Did not reach {} in time, at {}!".format(target, cf.model.pos[0]))
+            legs.append((target, cf.clock.monotonic() - legStart))
+        simTime  = cf.clock.monotonic() - simStart
+        realTime = time.perf_counter() - realStart
+    finally:
+        control.disable()
+        cf.close_link()
+        server.terminate()
+        server.join()
+
+    for target, duration in legs:
+        print("to ({:5.2f}, {:5.2f}, {:5.2f}): {:6.2f}s".format(*target, duration))
+    print("mission: {:.2f}s simulated in {:.2f}s, {:.1f}x real time".format(simTime, realTime, simTime / realTime))
+
+    stats = control.clock.stats()
+    print("control loop: {:d} ticks, {:d} deadlines missed, period p99 {:.3f}ms (simulated)"
+          .format(stats["ticks"], stats["missed"], stats["period"]["p99"]))
+
+
+if __name__ == '__main__':
+    main()
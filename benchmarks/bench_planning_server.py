@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# Measures throughput and latency of the path planning server under concurrent
+# plan requests, and how long a land request takes while the server is busy.
+#
+# Usage:
+#   python -m benchmarks.bench_planning_server --workers 4 --concurrency 8
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps
+from multiprocessing import Process, Queue
+from threading import Thread
+
+import numpy as np
+import requests
+
+import src.scene_parser as scene_parser
+from src.PlanningServer import run_path_planner
+
+
+def drain(queue):
+    while True:
+        queue.get()
+
+
+def randomFreePoints(scene, count, rng):
+    free = np.argwhere(~scene.space.astype(bool))
+    cells = free[rng.randint(len(free), size = count)]
+    return (cells + 0.5) * scene.resolution
+
+
+def percentile(values, q):
+    return 1e3 * np.percentile(values, q) if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the path planning server')
+    parser.add_argument('--room-spec', default = './examples/room_spec_3.yaml')
+    parser.add_argument('--port', type = int, default = 8101)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--concurrency', type = int, default = 8)
+    parser.add_argument('--requests', type = int, default = 32)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    queue  = Queue()
+    server = Process(target = run_path_planner, args = ("127.0.0.1", args.port, queue, args.room_spec, args.workers))
+    server.start()
+    Thread(target = drain, args = (queue,), daemon = True).start()
+
+    url   = 'http://127.0.0.1:{}'.format(args.port)
+    scene = scene_parser.parse(args.room_spec)
+    rng   = np.random.RandomState(args.seed)
+    starts, targets = randomFreePoints(scene, args.requests, rng), randomFreePoints(scene, args.requests, rng)
+
+    # wait for the server to come up
+    while True:
+        try:
+            requests.post(url, data = dumps({}))
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    def plan(i):
+        body = dumps({"command": "plan", "data": {"start": list(starts[i]), "target": list(targets[i])}})
+        requestStart = time.perf_counter()
+        requests.post(url, data = body)
+        return time.perf_counter() - requestStart
+
+    def land():
+        body = dumps({"command": "land", "data": {"start": list(starts[0])}})
+        latencies = []
+        while not done:
+            requestStart = time.perf_counter()
+            requests.post(url, data = body)
+            latencies.append(time.perf_counter() - requestStart)
+            time.sleep(0.2)
+        return latencies
+
+    done = False
+    try:
+        with ThreadPoolExecutor(max_workers = args.concurrency + 1) as executor:
+            landProbe = executor.submit(land)
+            benchStart = time.perf_counter()
+            latencies = list(executor.map(plan, range(args.requests)))
+            elapsed = time.perf_counter() - benchStart
+            done = True
+            landLatencies = landProbe.result()
+    finally:
+        done = True
+        server.terminate()
+        server.join()
+
+    print("workers: {}, concurrency: {:d}, requests: {:d}".format(args.workers or 'cpus', args.concurrency, args.requests))
+    print("throughput: {:.2f} plans/s".format(args.requests / elapsed))
+    print("plan latency: p50 {:.1f}ms, p99 {:.1f}ms".format(percentile(latencies, 50), percentile(latencies, 99)))
+    print("land latency while busy: p50 {:.1f}ms, p99 {:.1f}ms".format(percentile(landLatencies, 50), percentile(landLatencies, 99)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Compares the latency from issuing a plan request until its first waypoint
+# can be taken from the controller's command queue, over HTTP (waypoints are
+# pickled into the queue by the planning process) and over the local Unix
+# domain socket (the path comes back in the reply and is queued by the client).
+#
+# Usage:
+#   python -m benchmarks.bench_planning_transport --requests 200
+
+import argparse
+import os
+import tempfile
+import time
+from json import dumps
+from multiprocessing import Process, Queue
+from queue import Empty
+
+import numpy as np
+import requests
+
+from src.planning_client import PlanningClient, SocketPlanningClient
+from src.PlanningServer import PathCommand, REPLACE, run_path_planner
+
+
+def drain(queue):
+    while True:
+        try:
+            queue.get(timeout = 0.05)
+        except Empty:
+            return
+
+
+def percentile(values, q):
+    return 1e3 * np.percentile(values, q)
+
+
+def measure(send, queue, moves, count):
+    latencies = []
+    for i in range(count):
+        start, target = moves[i % len(moves)]
+        requestStart = time.perf_counter()
+        future = send(start, target)
+        queue.get()
+        latencies.append(time.perf_counter() - requestStart)
+        future.result()
+        drain(queue)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the transports between controller and planner')
+    parser.add_argument('--room-spec', default = './examples/room_spec_3.yaml')
+    parser.add_argument('--port', type = int, default = 8102)
+    parser.add_argument('--workers', type = int, default = 1)
+    parser.add_argument('--requests', type = int, default = 200)
+    args = parser.parse_args()
+
+    socketPath = os.path.join(tempfile.mkdtemp(), 'planner.sock')
+    queue      = Queue()
+    server     = Process(target = run_path_planner, args = ("127.0.0.1", args.port, queue, args.room_spec, args.workers, socketPath))
+    server.start()
+
+    # short moves back and forth, so that the transport dominates
+    a, b  = (2.2, 0.4, 1.3), (2.2, 0.6, 1.3)
+    moves = [(a, b), (b, a)]
+
+    url = 'http://127.0.0.1:{}'.format(args.port)
+    while True:
+        try:
+            requests.post(url, data = dumps({}))
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    def deliver(waypoints, stop, plan, times):
+        queue.put(PathCommand(waypoints, REPLACE, stop, plan, times))
+
+    http  = PlanningClient(url)
+    local = SocketPlanningClient(socketPath, deliver)
+    # both clients speak for drone 0, whose plans are numbered in one sequence
+    local.plans = http.plans
+    try:
+        # warm up connections and caches
+        measure(http.plan, queue, moves, 4)
+        measure(local.plan, queue, moves, 4)
+
+        results = [ ("http",   measure(http.plan,  queue, moves, args.requests))
+                  , ("socket", measure(local.plan, queue, moves, args.requests))
+                  ]
+    finally:
+        http.close()
+        local.close()
+        server.terminate()
+        server.join()
+
+    print("requests: {:d}".format(args.requests))
+    for name, latencies in results:
+        print("{:6s} request -> first waypoint: p50 {:.2f}ms, p99 {:.2f}ms"
+              .format(name, percentile(latencies, 50), percentile(latencies, 99)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Measures how the swarm simulation scales with the number of drones. Every
+# drone takes off from its own start position and flies a mission through
+# random targets in the room, planned on the room's grid beforehand. Larger
+# swarms reuse the missions, since there is no collision avoidance anyway. The
+# batched Swarm is compared to stepping one single-drone Swarm per drone.
+#
+# Usage:
+#   python -m benchmarks.bench_swarm --drones 1 5 20 50 100
+
+import argparse
+import io
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from src import scene_parser
+from src.path import Point
+from src.swarm import Swarm
+
+
+class Start():
+    def execute(self, drone):
+        drone.startMotors()
+
+
+class Land():
+    def execute(self, drone):
+        drone.land()
+
+
+def free(scene, point):
+    try:
+        scene.checkPoint(Point(*point), "Point")
+        return True
+    except Exception:
+        return False
+
+
+def missions(scene, count, targets, rng):
+    """
+    Start positions on the floor and planned waypoints for ``count`` drones.
+    """
+    low, high = np.array([0.2, 0.2, 0.0]), np.array(scene.space.shape) * scene.resolution - 0.2
+    starts, paths = [], []
+    while len(starts) < count:
+        start = np.r_[rng.uniform(low[:2], high[:2]), 0.0]
+        points = [start + np.r_[0.0, 0.0, 0.3]]
+        while len(points) <= targets:
+            point = rng.uniform(low + np.r_[0.0, 0.0, 0.3], high)
+            if free(scene, point):
+                points.append(point)
+        if not free(scene, points[0]):
+            continue
+        try:
+            # A* is chatty
+            with redirect_stdout(io.StringIO()):
+                path, _ = scene.planMission(Point(*points[0]), [Point(*p) for p in points[1:]])
+        except Exception:
+            continue
+        starts.append(start)
+        paths.append([(p.x, p.y, p.z) for p in path])
+    return np.array(starts), paths
+
+
+def batched(starts, paths):
+    swarm = Swarm(starts, separation = False)
+    for i, path in enumerate(paths):
+        swarm.send(i, Start(), *path, Land())
+    start = time.perf_counter()
+    simulated = swarm.run()
+    return simulated, time.perf_counter() - start, int(round(simulated / swarm.dt))
+
+
+def separate(starts, paths):
+    swarms = [Swarm(start) for start in starts]
+    for swarm, path in zip(swarms, paths):
+        swarm.send(0, Start(), *path, Land())
+    start = time.perf_counter()
+    busy  = swarms
+    while busy:
+        for swarm in busy:
+            swarm.step()
+        busy = [swarm for swarm in busy if swarm.busy().any()]
+    return max(swarm.time for swarm in swarms), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmark the swarm simulation')
+    parser.add_argument('--room-spec', default = './examples/room_spec_3.yaml')
+    parser.add_argument('--drones', type = int, nargs = '+', default = [1, 5, 10, 20, 50, 100])
+    parser.add_argument('--targets', type = int, default = 3, help = 'Targets per mission')
+    parser.add_argument('--missions', type = int, default = 20, help = 'How many different missions to plan')
+    parser.add_argument('--baseline', type = int, default = 20, help = 'Largest swarm to also simulate drone by drone')
+    args = parser.parse_args()
+
+    scene = scene_parser.parse(args.room_spec)
+    rng   = np.random.RandomState(0)
+
+    planningStart = time.perf_counter()
+    starts, paths = missions(scene, args.missions, args.targets, rng)
+    print("planned {:d} missions in {:.2f}s".format(len(paths), time.perf_counter() - planningStart))
+
+    drones = max(args.drones)
+    starts = np.resize(starts, (drones, 3))
+    paths  = [paths[i % len(paths)] for i in range(drones)]
+
+    for n in args.drones:
+        simulated, wall, steps = batched(starts[:n], paths[:n])
+        line = ("{:4d} drones: {:6.1f}s simulated in {:6.2f}s, {:6.1f}x real time, {:6.2f}us per drone and step"
+                .format(n, simulated, wall, simulated / wall, 1e6 * wall / (n * steps)))
+        if n <= args.baseline:
+            _, separateWall = separate(starts[:n], paths[:n])
+            line += ", drone by drone {:6.2f}s".format(separateWall)
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,9 @@ setuptools.setup(
     packages=['src'],
     entry_points={
         'console_scripts': [
-            'crazyflie-on-voice = src.__main__:main'
+            'crazyflie-on-voice = src.__main__:main',
+            'crazyflie-roadmap = src.roadmap:main',
+            'crazyflie-landmarks = src.landmarks:main'
         ]
     },
     version='0.0.1',
@@ -1,9 +1,123 @@
 # Author: Christopher Blöcker, Timotheus Kampik, Tobias Sundqvist
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from json import loads, dumps
 from json.decoder import JSONDecodeError
+from threading import Condition, Lock, Thread
+from urllib.parse import urlparse, parse_qs
+import logging
+import time
 from src.controller import *
+from src.metrics import Histogram, Registry
+import src.metrics as metrics
+
+log = logging.getLogger(__name__)
+
+# commands that go to the control queue of a crazyflie, which it checks on
+# every tick, instead of waiting behind the path in its command queue
+URGENT_COMMANDS = { "stop" : StopCommand
+                  , "land" : LandComand
+                  , "hold" : HoldCommand
+                  }
+
+
+class Subscriber():
+    """
+    A client of the live telemetry. It keeps at most ``backlog`` frames; if it
+    falls behind, the oldest frames are dropped.
+    """
+    def __init__(self, drone, period, backlog):
+        self.drone     = drone
+        self.period    = period
+        self.frames    = deque(maxlen = backlog)
+        self.condition = Condition()
+        self.last      = float('-inf')
+        self.dropped   = 0
+
+    def offer(self, now, frame):
+        # at most one frame per period of the subscriber
+        if now - self.last < self.period:
+            return
+        self.last = now
+        with self.condition:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(frame)
+            self.condition.notify()
+
+    def take(self, timeout):
+        """
+        The oldest frame, or None if there was none within the timeout.
+        """
+        with self.condition:
+            if not self.frames:
+                self.condition.wait(timeout)
+            return self.frames.popleft() if self.frames else None
+
+
+class TelemetryHub():
+    """
+    Polls the state that the controllers publish and hands every new state to
+    the subscribers of its drone. A frame is encoded once for all subscribers,
+    and a slow subscriber only loses its own frames.
+    """
+    def __init__(self, states, rate = 50.0, backlog = 8):
+        """
+        :param states: the ``SharedState``s of all drones, indexed by drone id
+        :param rate: how often the states are polled [Hz]
+        :param backlog: how many frames a subscriber keeps at most
+        """
+        self.states      = states
+        self.period      = 1.0 / rate
+        self.backlog     = backlog
+        self.subscribers = []
+        self.lock        = Lock()
+        # frames dropped for subscribers that are gone
+        self.droppedBefore = 0
+
+        self.thread = Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def subscribe(self, drone, rate = None):
+        if not 0 <= drone < len(self.states):
+            raise Exception("Unknown drone: {}".format(drone))
+        subscriber = Subscriber(drone, 0.0 if rate is None else 1.0 / rate, self.backlog)
+        with self.lock:
+            self.subscribers = self.subscribers + [subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers    = [other for other in self.subscribers if other is not subscriber]
+            self.droppedBefore += subscriber.dropped
+
+    def dropped(self):
+        """
+        How many frames were dropped for subscribers that fell behind.
+        """
+        with self.lock:
+            return self.droppedBefore + sum(subscriber.dropped for subscriber in self.subscribers)
+
+    def _run(self):
+        sequences = [0] * len(self.states)
+        while True:
+            now = time.monotonic()
+            for drone, state in enumerate(self.states):
+                subscribers = [subscriber for subscriber in self.subscribers if subscriber.drone == drone]
+                if not subscribers:
+                    continue
+                sequence, fields = state.read()
+                if sequence == sequences[drone]:
+                    continue
+                sequences[drone] = sequence
+
+                frame = { name : (values[0] if len(values) == 1 else values.tolist()) for name, values in fields.items() }
+                frame["drone"] = drone
+                event = "data: {}\n\n".format(dumps(frame)).encode()
+                for subscriber in subscribers:
+                    subscriber.offer(now, event)
+            time.sleep(self.period)
 
 
 class CrazyHandler(BaseHTTPRequestHandler):
@@ -15,28 +129,77 @@ class CrazyHandler(BaseHTTPRequestHandler):
         self.send_header('Content-type', 'text/json')
         self.end_headers()
 
+    def log_message(self, format, *args):
+        # the access log of http.server, written to stderr on every request
+        log.debug("%s " + format, self.address_string(), *args)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            metrics.reply(self, self.server.metrics)
+            return
+        if url.path != "/telemetry" or self.server.telemetry is None:
+            self.send_error(404)
+            return
+
+        query = parse_qs(url.query)
+        try:
+            drone      = int(query.get("drone", ["0"])[0])
+            rate       = float(query["rate"][0]) if "rate" in query else None
+            subscriber = self.server.telemetry.subscribe(drone, rate)
+        except Exception as e:
+            self.send_error(400, str(e))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            while True:
+                # a comment from time to time notices clients that went away
+                frame = subscriber.take(timeout = 1.0)
+                self.wfile.write(frame if frame is not None else b": idle\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.server.telemetry.unsubscribe(subscriber)
+
     def do_POST(self):
+        received = time.monotonic()
         content_length = int(self.headers['Content-Length'])
         request = self.rfile.read(content_length)
 
         try:
             json = loads(request.decode())
-            print("[DEBUG] Received request: {}".format(str(json)))
+            log.debug("Received request: %s", json)
+
+            # requests without a drone id go to the first drone
+            drone = json.get("drone", 0)
+            if isinstance(drone, bool) or not isinstance(drone, int) or not 0 <= drone < len(self.server.commandQueues):
+                raise Exception("Unknown drone: {}".format(drone))
+            commandQueue = self.server.commandQueues[drone]
+            controlQueue = self.server.controlQueues[drone]
 
             if "command" in json:
                 if json["command"] == "start":
-                    self.server.commandQueue.put(StartCommand())
-                elif json["command"] == "stop":
-                    self.server.commandQueue.put(StopCommand())
-                elif json["command"] == "land":
-                    self.server.commandQueue.put(LandComand())
+                    commandQueue.put(StartCommand())
+                elif json["command"] in URGENT_COMMANDS:
+                    command = URGENT_COMMANDS[json["command"]]()
+                    command.received = time.monotonic()
+                    controlQueue.put(command)
                 else:
                     raise Exception("Invalid command: {}".format(json["command"]))
 
             elif "distance" in json:
                 [ dx, dy, dz ] = json["distance"]
 
-                self.server.commandQueue.put(DistanceCommand(dx, dy, dz))
+                commandQueue.put(DistanceCommand(dx, dy, dz))
+
+            elif "distances" in json:
+                distances = [ (dx, dy, dz) for [ dx, dy, dz ] in json["distances"] ]
+
+                commandQueue.put(MissionCommand(distances, json.get("reorder", False)))
 
             else:
                 raise Exception("Unexpected input: {}".format(json))
@@ -47,17 +210,51 @@ class CrazyHandler(BaseHTTPRequestHandler):
 
         self._set_headers()
         self.wfile.write(dumps(reply).encode())
+        self.server.requestLatency.observe((time.monotonic() - received) * 1e3)
 
 
-def run_server(hostname, port, commandQueue):
+def make_server(hostname, port, commandQueues, controlQueues = None, liveStates = None, rate = 50.0):
     """
-    Runs a server and listen for commands sent to the crazyflie
+    Creates a server that listens for commands sent to the crazyflies
 
     :param hostname:
     :param port:
-    :param commandQueue:
-    :return:
+    :param commandQueues: the command queues of all drones, indexed by drone
+                          id; a single queue belongs to drone 0
+    :param controlQueues: the control queues of all drones for stop, land,
+                          and hold; without them, these go to the command queues
+    :param liveStates: the ``SharedState``s that the controllers of all drones
+                       publish, streamed on ``GET /telemetry``
+    :param rate: the highest rate of the live telemetry [Hz]
+    :return: the server
+    """
+    server = ThreadingHTTPServer((hostname, port), CrazyHandler)
+    server.daemon_threads = True
+    server.telemetry = None if liveStates is None else TelemetryHub(liveStates, rate)
+
+    server.commandQueues = commandQueues if isinstance(commandQueues, (list, tuple)) else [commandQueues]
+    if controlQueues is None:
+        server.controlQueues = server.commandQueues
+    else:
+        server.controlQueues = controlQueues if isinstance(controlQueues, (list, tuple)) else [controlQueues]
+
+    # what GET /metrics reports [ms]
+    server.requestLatency = Histogram.exponential(0.125, 2, 16)
+    server.metrics        = Registry()
+    server.metrics.histogram('control_http_request_latency_milliseconds', 'Time to answer a command', server.requestLatency)
+    for drone, commandQueue in enumerate(server.commandQueues):
+        server.metrics.gauge('control_command_queue_depth', 'Commands in the command queue', metrics.queue_depth(commandQueue), drone = str(drone))
+    if server.telemetry is not None:
+        server.metrics.gauge('control_telemetry_subscribers', 'Clients of the live telemetry', lambda: len(server.telemetry.subscribers))
+        server.metrics.counter('control_telemetry_dropped_frames_total', 'Frames dropped for clients that fell behind',
+                               server.telemetry.dropped)
+
+    return server
+
+
+def run_server(hostname, port, commandQueues, controlQueues = None, liveStates = None, rate = 50.0):
+    """
+    Runs a server and listen for commands sent to the crazyflies, see
+    ``make_server``.
     """
-    server = HTTPServer((hostname, port), CrazyHandler)
-    server.commandQueue = commandQueue
-    server.serve_forever()
+    make_server(hostname, port, commandQueues, controlQueues, liveStates, rate).serve_forever()
@@ -1,73 +1,441 @@
 # Author: Christopher Blöcker, Timotheus Kampik, Tobias Sundqvist
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from json import loads
+from concurrent.futures import CancelledError, Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from json import dumps, loads
+from threading import Lock
+import signal
+import logging
+import sys
 from src.controller import *
+from src.planning_pool import PlanningPool
+from src.scheduler import Scheduler
 import src.scene_parser as scene_parser
+import src.landmarks as landmarks
+import src.planning_socket as planning_socket
+import src.roadmap as roadmap
+from src.cooperative import CooperativePlanner
+from src.metrics import Histogram, Registry
+import src.metrics as metrics
+
+log = logging.getLogger(__name__)
 
 # The request handler for the path planning server.
 # When the crazyflie sends a path planning request, the path planning server
-# plans a path in the static scene and sends a sequence of PositionCommands to
-# the crazyflie.
+# plans a path in the static scene and sends it as one PathCommand to the
+# crazyflie that sent the request, identified by the "drone" field. Every
+# request is handled in its own thread, the planning itself runs in a pool of
+# worker processes, so a slow plan does not block other requests.
+# Requests are scheduled as jobs: landing and stopping come before planning,
+# and a newer request of a drone cancels its obsolete older ones.
+# While a drone hovers, the server computes the distance field from its
+# position in the background, which turns its next plan into a lookup. With
+# several drones, plans avoid the trajectories that the other drones reserved
+# and are sent with the time of every waypoint, which the drones keep to.
 
 
 class PathPlanner(BaseHTTPRequestHandler):
-    def _set_headers(self):
+    # keep connections open, the controller sends its requests over a few;
+    # without TCP_NODELAY, replies on an open connection wait for delayed ACKs
+    protocol_version        = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _reply(self, reply):
+        body = dumps(reply).encode()
         self.send_response(200)
         self.send_header('Content-type', 'text/json')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # the access log of http.server, written to stderr on every request
+        log.debug("%s " + format, self.address_string(), *args)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            metrics.reply(self, self.server.metrics)
+            return
+        if self.path == "/stats":
+            reply = self.server.scheduler.stats()
+        else:
+            reply = { "error" : "Unknown path: {}".format(self.path) }
+
+        self._reply(reply)
 
     def do_POST(self):
+        received = time.monotonic()
         content_length = int(self.headers['Content-Length'])
         request = self.rfile.read(content_length)
 
         try:
             json = loads(request.decode())
-            print("[DEBUG] Received request: {}".format(str(json)))
+            log.debug("Received request: %s", json)
 
             if "command" in json:
-                if json["command"] == "plan":
-                    start, target = json["data"]["start"], json["data"]["target"]
-
-                    start  = Point(start[0],  start[1],  start[2])
-                    target = Point(target[0], target[1], target[2])
-
-                    planningStart = time.time()
-                    path = self.server.scene.planPath(start, target)
-                    print("[DEBUG] Found path: {:s}".format(str(path)))
-                    print("[DEBUG] Path planning took {:.2f}s.".format(time.time() - planningStart))
-                    for waypoint in path:
-                        self.server.commandQueue.put(PositionCommand(waypoint.x, waypoint.y, waypoint.z))
-
-                elif json["command"] == "land":
-                    start = json["data"]["start"]
-                    start = Point(start[0], start[1], start[2])
-
-                    try:
-                        path = self.server.scene.planLanding(start)
-                    except Exception as e:
-                        print(e)
-                        raise e
-
-                    print("[DEBUG] Found landing path: {:s}".format(str(path)))
-                    for waypoint in path:
-                        self.server.commandQueue.put(PositionCommand(waypoint.x, waypoint.y, waypoint.z))
-                    self.server.commandQueue.put(StopCommand())
-
+                result = self.server.submit(json).result()
             else:
                 raise Exception("Unexpected input: {}".format(json))
 
             reply = { "ok" : json }
+            if json["command"] == "plan_mission":
+                reply["order"] = result
+        except (CancelledError, PlanningCancelled):
+            reply = { "cancelled" : json }
         except Exception as e:
            reply = { "error" : str(e) }
 
-        self._set_headers()
-        self.wfile.write(dumps(reply).encode())
+        self._reply(reply)
+        self.server.requestLatency.observe((time.monotonic() - received) * 1e3)
+
+
+class PlanningHTTPServer(ThreadingHTTPServer):
+    """
+    The path planning server. Handles requests concurrently and makes sure
+    that the waypoints of different paths are not interleaved in the queue.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, commandQueues, scene, workers = None):
+        """
+        :param address:
+        :param commandQueues: the command queues of all drones, indexed by
+                              drone id; a single queue belongs to drone 0
+        :param scene:
+        :param workers: the number of planning processes, shared by all drones
+        """
+        self.commandQueues = commandQueues if isinstance(commandQueues, (list, tuple)) else [commandQueues]
+        self.scene        = scene
+        self.roadmap      = None
+        self.pool         = PlanningPool(scene, workers)
+        self.queueLock    = Lock()
+        # the distance field from where each drone hovers
+        self.fields       = {}
+        # the number of the latest plan that each drone requested
+        self.plans        = {}
+
+        # several drones plan around each other's reserved trajectories; a
+        # time step is the time to fly through one grid cell [s]. The searches
+        # share the reservations, so they run one at a time, and the job whose
+        # trajectory each drone reserved is kept to release it if it is dropped
+        self.cooperative     = CooperativePlanner(scene) if len(self.commandQueues) > 1 else None
+        self.cooperativeLock = Lock()
+        self.reservations    = {}
+        self.stepTime        = 0.2
+        self.origin          = time.monotonic()
+
+        # one thread per planning worker, one for distance fields and one more,
+        # so that landing and stopping never wait for a free thread
+        self.scheduler    = Scheduler( self.pool.workers + 2
+                                     , limits = { "plan" : self.pool.workers, "hover" : 1 }
+                                     )
+
+        # what GET /metrics reports [ms]
+        self.planLatency    = Histogram.exponential(1, 2, 16)
+        self.requestLatency = Histogram.exponential(1, 2, 16)
+        self.metrics        = Registry()
+        self.metrics.histogram('planning_plan_latency_milliseconds', 'Time to plan a path or mission', self.planLatency)
+        self.metrics.histogram('planning_expansions', 'Cells expanded by a search', self.pool.searches)
+        self.metrics.histogram('planning_http_request_latency_milliseconds', 'Time to answer a request', self.requestLatency)
+        for name in ["submitted", "completed", "failed", "cancelled", "coalesced"]:
+            self.metrics.counter('planning_jobs_{}_total'.format(name), 'Jobs {}'.format(name),
+                                 lambda name = name: self.scheduler.stats()[name])
+        self.metrics.gauge('planning_jobs_queued', 'Jobs waiting to run', lambda: self.scheduler.stats()["queued"])
+        self.metrics.gauge('planning_jobs_running', 'Jobs running', lambda: self.scheduler.stats()["running"])
+
+        ThreadingHTTPServer.__init__(self, address, PathPlanner)
+
+    def submit(self, request, deliver = None):
+        """
+        Schedules a request as a job.
+
+        :param request: the decoded request, see ``PathPlanner``
+        :param deliver: optional function that receives the path, whether the
+                        crazyflie stops after it, and the number of its plan
+                        instead of the command queue
+        :return: a ``Future`` of the result of the job
+        """
+        drone   = request.get("drone", 0)
+        command = request["command"]
+
+        if isinstance(drone, bool) or not isinstance(drone, int) or not 0 <= drone < len(self.commandQueues):
+            raise Exception("Unknown drone: {}".format(drone))
+
+        # paths are sent with the number of the plan they answer, so that the
+        # drone can tell paths of requests it made obsolete; a request that
+        # arrives after a newer one over another connection is obsolete, too
+        number = request.get("plan")
+        if number is not None:
+            with self.queueLock:
+                if number < self.plans.get(drone, 0):
+                    obsolete = Future()
+                    obsolete.cancel()
+                    return obsolete
+                self.plans[drone] = number
+
+        if command == "plan":
+            start, target = request["data"]["start"], request["data"]["target"]
+            key           = (tuple(start), tuple(target))
+
+            start  = Point(start[0],  start[1],  start[2])
+            target = Point(target[0], target[1], target[2])
+
+            return self.scheduler.submit(drone, "plan", key, lambda job: self.plan(job, start, target, deliver), number)
+
+        elif command == "plan_mission":
+            start, targets = request["data"]["start"], request["data"]["targets"]
+            reorder        = request["data"].get("reorder", False)
+            key            = (tuple(start), tuple(map(tuple, targets)), reorder)
+
+            start   = Point(start[0], start[1], start[2])
+            targets = [Point(target[0], target[1], target[2]) for target in targets]
+
+            # a mission is a plan, it supersedes and is superseded by plans
+            return self.scheduler.submit(drone, "plan", key, lambda job: self.planMission(job, start, targets, reorder, deliver), number)
+
+        elif command == "land":
+            start = request["data"]["start"]
+            key   = tuple(start)
+            start = Point(start[0], start[1], start[2])
+
+            return self.scheduler.submit(drone, "land", key, lambda job: self.land(job, start, deliver), number)
+
+        elif command == "hover":
+            start = request["data"]["start"]
+            key   = tuple(start)
+            start = Point(start[0], start[1], start[2])
+
+            return self.scheduler.submit(drone, "hover", key, lambda job: self.hover(job, start), number)
+
+        elif command == "stop":
+            return self.scheduler.submit(drone, "stop", None, lambda job: self.stop(job, deliver), number)
+
+        raise Exception("Invalid command: {}".format(command))
+
+    def plan(self, job, start, target, deliver = None):
+        """
+        Plans a path and sends it to the crazyflie. Plans on the precomputed
+        roadmap of the room if there is one, then on the distance field from
+        where the crazyflie hovers, and falls back to A* on the occupancy grid
+        otherwise.
+        """
+        planningStart = time.time()
+        path = due = None
+
+        if self.cooperative is not None:
+            path, due = self.planCooperatively(job, start, target)
+
+        if path is None and self.roadmap is not None:
+            try:
+                path = self.scene.postprocessPath(self.roadmap.planPath(start, target))
+            except Exception as e:
+                log.debug("Roadmap planning failed, falling back to A*: %s", e)
+
+        if path is None:
+            path = self.planFromField(job.drone, start, target)
+
+        if path is None:
+            future = self.pool.planPath(start, target)
+            job.onCancel = lambda: self.pool.cancel(future)
+            if job.cancelled:
+                self.pool.cancel(future)
+            path = future.result()
+
+        log.debug("Found path: %s", path)
+        log.debug("Path planning took %.2fs.", time.time() - planningStart)
+        self.planLatency.observe((time.time() - planningStart) * 1e3)
+        try:
+            self.sendPath(job, path, deliver = deliver, due = due)
+        except PlanningCancelled:
+            self.releaseReservation(job)
+            raise
+
+    def planMission(self, job, start, targets, reorder, deliver = None):
+        """
+        Plans a path through a sequence of targets and sends it to the
+        crazyflie. Uses the roadmap for all legs if possible.
+
+        :return: the order in which the targets are visited
+        """
+        planningStart = time.time()
+        path = None
+
+        if self.roadmap is not None:
+            order = orderTargets(start, targets) if reorder else list(range(len(targets)))
+            try:
+                path = [start]
+                for i in order:
+                    path.extend(self.roadmap.planPath(path[-1], targets[i])[1:])
+                path = self.scene.postprocessPath(path)
+            except Exception as e:
+                log.debug("Roadmap planning failed, falling back to A*: %s", e)
+                path = None
+
+        if path is None:
+            future = self.pool.planMission(start, targets, reorder)
+            job.onCancel = lambda: self.pool.cancel(future)
+            if job.cancelled:
+                self.pool.cancel(future)
+            path, order = future.result()
+
+        log.debug("Found mission path: %s", path)
+        log.debug("Mission planning took %.2fs.", time.time() - planningStart)
+        self.planLatency.observe((time.time() - planningStart) * 1e3)
+        self.sendPath(job, path, deliver = deliver)
+        return order
+
+    def planCooperatively(self, job, start, target):
+        """
+        Plans a path that keeps clear of the paths of the other drones and
+        reserves it for the drone of the job. The path is not postprocessed:
+        it keeps one waypoint per time step, so that the drone can keep to the
+        time steps that were reserved.
+
+        :return: the path and when the drone is due at each of its waypoints
+                 on ``time.monotonic``, or ``None, None`` if there is no path
+        """
+        with self.cooperativeLock:
+            # superseded while waiting for the searches of the other drones
+            if job.cancelled:
+                raise PlanningCancelled("Path was superseded before it was planned.")
+
+            step = int((time.monotonic() - self.origin) / self.stepTime)
+            self.cooperative.table.expire(step)
+            try:
+                path = self.cooperative.planPath(job.drone, start, target, step, lambda: job.cancelled)
+            except PlanningCancelled:
+                raise
+            except Exception as e:
+                log.debug("Cooperative planning failed, falling back to A*: %s", e)
+                return None, None
+            self.reservations[job.drone] = job
+            self.pool.searches.observe(self.cooperative.expansions)
+
+        # the target lies in the last cell and is due with it
+        steps = list(range(step, step + len(path) - 1)) + [step + len(path) - 2]
+        return path, [self.origin + s * self.stepTime for s in steps]
+
+    def releaseReservation(self, job):
+        """
+        Releases the trajectory that a job reserved if its path is not sent,
+        unless a newer job of the drone reserved its own since.
+        """
+        if self.cooperative is None:
+            return
+        with self.cooperativeLock:
+            if self.reservations.get(job.drone) is job:
+                del self.reservations[job.drone]
+                self.cooperative.table.release(job.drone)
+
+    def planFromField(self, drone, start, target):
+        """
+        Plans on the distance field of the drone if it was computed for the start.
+
+        :return: the path, or ``None`` if there is no suitable distance field
+        """
+        field = self.fields.get(drone)
+        if field is None:
+            return None
+
+        try:
+            if field.startCell != self.scene.checkPoint(start, "Start"):
+                return None
+            return self.scene.planFromField(field, target)
+        except Exception as e:
+            log.debug("Planning on the distance field failed, falling back to A*: %s", e)
+            return None
+
+    def hover(self, job, start):
+        """
+        Computes the distance field from where the crazyflie hovers, so that
+        its next plan from there is a lookup instead of a search.
+        """
+        future = self.pool.distanceField(start)
+        job.onCancel = lambda: self.pool.cancel(future)
+        if job.cancelled:
+            self.pool.cancel(future)
+        field = future.result()
+
+        with self.queueLock:
+            if job.cancelled:
+                raise PlanningCancelled("Drone moved on before the distance field was ready.")
+            self.fields[job.drone] = field
+
+    def land(self, job, start, deliver = None):
+        """
+        Plans a landing path and sends it to the crazyflie, followed by a stop.
+        """
+        try:
+            path = self.scene.planLanding(start)
+        except Exception as e:
+            log.error("Landing failed: %s", e)
+            raise e
+
+        log.debug("Found landing path: %s", path)
+        self.sendPath(job, path, stop = True, deliver = deliver)
+
+    def stop(self, job, deliver = None):
+        """
+        Stops the motors of the crazyflie.
+        """
+        self.sendPath(job, [], stop = True, deliver = deliver)
+
+    def sendPath(self, job, path, stop = False, deliver = None, due = None):
+        """
+        Puts a path into the command queue as one PathCommand that replaces
+        the drone's current path, or hands it to ``deliver`` if the requester
+        wants to enqueue it itself. The path carries the newest plan of the
+        requests that were coalesced into the job.
+
+        :param stop: whether the crazyflie stops after the path
+        :param due: optional times on ``time.monotonic`` at which the drone is
+                    due at the waypoints; they are sent as seconds from now
+        """
+        with self.queueLock:
+            # a newer request made this one obsolete while we were planning
+            if job.cancelled:
+                raise PlanningCancelled("Path was superseded before it was sent.")
+
+            # the drone leaves the start of its distance field
+            self.fields.pop(job.drone, None)
+
+            plan  = self.scheduler.close(job)
+            now   = time.monotonic()
+            times = None if due is None else [t - now for t in due]
+            if deliver is not None:
+                deliver(path, stop, plan, times)
+                return
+
+            waypoints = [(waypoint.x, waypoint.y, waypoint.z) for waypoint in path]
+            self.commandQueues[job.drone].put(PathCommand(waypoints, REPLACE, stop, plan, times))
+
+    def server_close(self):
+        ThreadingHTTPServer.server_close(self)
+        self.pool.shutdown()
 
 
 # Run the path planning server and assume a static scene with static obstacles.
-def run_path_planner(hostname, port, command_queue, room_config):
-    server = HTTPServer((hostname, port), PathPlanner)
-    server.commandQueue = command_queue
-    server.scene = scene_parser.parse(room_config)
-    server.serve_forever()
+# All drones share the scene and the planning processes; their paths are routed
+# to their command queues by drone id.
+def run_path_planner(hostname, port, command_queues, room_config, workers = None, socket_path = None):
+    scene           = scene_parser.parse(room_config)
+    scene.landmarks = landmarks.load(room_config, scene)
+    if scene.landmarks is None:
+        log.info("No landmarks for %s. Run 'crazyflie-landmarks build %s' to speed up A*.", room_config, room_config)
+
+    server = PlanningHTTPServer((hostname, port), command_queues, scene, workers)
+    server.roadmap = roadmap.load(room_config)
+    if server.roadmap is None:
+        log.info("No roadmap for %s, planning on the grid. Run 'crazyflie-roadmap build %s' to create one.", room_config, room_config)
+    # local clients can also plan over a Unix domain socket
+    local = planning_socket.serve(socket_path, server) if socket_path else None
+
+    # shut the worker processes down when we are terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        if local is not None:
+            local.shutdown()
+            local.server_close()
+        server.server_close()
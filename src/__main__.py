@@ -4,26 +4,61 @@
 
 from __future__ import print_function
 
-import logging
 import numpy as np
 import argparse
 import sys
 import termios
+import time
 
 from cflib import crazyflie, crtp
-from src.controller import ControllerThread
+from src.controller import ControllerThread, LIVE_FIELDS
+from src.state import SharedState
+from src.simulator import SimulatedClock, SimulatedCrazyflie
 from multiprocessing import Process, Queue
 from src.ControlServer import run_server
 from src.PlanningServer import run_path_planner
 from src.voice_control_loop import start_command_loop
+import src.logs as logs
+import src.metrics as metrics
 
 parser = argparse.ArgumentParser(description='Crazyflie control platform')
-parser.add_argument('-u', '--uri', type=str, default='radio://0/110/2M',
-                    help='The URI of the Crazyflie')
+parser.add_argument('-u', '--uri', type=str, nargs='+', default=['radio://0/110/2M'],
+                    help='The URIs of the Crazyflies, one controller runs per '
+                         'Crazyflie')
+parser.add_argument('-sim', '--simulate', type=float, nargs='+', default=None,
+                    metavar='X Y Z',
+                    help='Flies simulated Crazyflies starting at the given '
+                         'positions (three coordinates each) instead of '
+                         'connecting to real ones')
+parser.add_argument('-su', '--speedup', type=float, default=1.0,
+                    help='How much faster than real time the simulation runs')
 parser.add_argument('-cp', '--control-port', type=int, default=8000,
                     help='The port for the control server')
+parser.add_argument('-cr', '--control-rate', type=float, default=50,
+                    help='The rate of the control loop in Hz')
+parser.add_argument('-tp', '--telemetry-period', type=str, nargs='+',
+                    default=[], metavar='FIELD=MS',
+                    help='Log period of a telemetry field (stab_att, pos, '
+                         'vel_bf, attq) in ms, instead of the control period')
+parser.add_argument('-t16', '--fp16-telemetry', action='store_true',
+                    default=False,
+                    help='Sends the telemetry as half-precision floats, '
+                         'which fits it into a single log block')
 parser.add_argument('-pp', '--planning-port', type=int, default=8001,
                     help='The port for the planning server')
+parser.add_argument('-pw', '--planning-workers', type=int, default=None,
+                    help='The number of path planning worker processes. '
+                         'Defaults to the number of CPUs')
+parser.add_argument('-ps', '--planning-socket', type=str, default=None,
+                    help='Path of a Unix domain socket on which the controller '
+                         'talks to the planning server instead of HTTP')
+parser.add_argument('-mp', '--metrics-port', type=int, default=None,
+                    help='Port on which the metrics of the controllers and the '
+                         'voice client are served as GET /metrics')
+parser.add_argument('-ll', '--log-level', type=str, nargs='+',
+                    default=['INFO'], metavar='[MODULE=]LEVEL',
+                    help='Log level of all modules, or of one module, e.g. '
+                         'src.controller=DEBUG')
 parser.add_argument('-rs', '--room-spec', type=str,
                     default='./examples/room_spec_1.yaml',
                     help='The port for the planning server')
@@ -47,10 +82,22 @@ args = vars(parser.parse_args())
 room_config = args['room_spec']
 control_port = args['control_port']
 planning_port = args['planning_port']
+control_rate = args['control_rate']
+planning_workers = args['planning_workers']
+planning_socket = args['planning_socket']
 start_voice_control = args['voice']
 start_only_voice_control = args['voice_only']
 voice_api = args['voice_api']
 control_url = args['control_url']
+simulate = args['simulate']
+speedup = args['speedup']
+telemetry_periods = { field : float(period) for field, period in
+                      (option.split('=') for option in args['telemetry_period']) }
+fp16_telemetry = args['fp16_telemetry']
+metrics_port = args['metrics_port']
+log_level, log_levels = logs.parse_levels(args['log_level'])
+# cflib is chatty below warnings
+log_levels.setdefault('cflib', 'WARNING')
 
 
 def read_input(file=sys.stdin):
@@ -70,10 +117,14 @@ def read_input(file=sys.stdin):
         termios.tcsetattr(file.fileno(), termios.TCSADRAIN, old_attrs)
 
 
-def handle_keyboard_input(control, server):
+def handle_keyboard_input(controls, server):
     pos_step = 0.1 # [m]
     yaw_step = 5   # [deg]
 
+    # the keys act on one drone at a time
+    selected = 0
+    control  = controls[selected]
+
     for ch in read_input():
         if ch == 'h':
             print('Key map:')
@@ -91,6 +142,8 @@ def handle_keyboard_input(control, server):
             print('j: Increase yaw-reference by ', yaw_step, 'm.')
             print('l: Decrease yaw-reference by ', yaw_step, 'deg.')
             print('7: Toggle debug logging')
+            print('8: Print control loop timing')
+            print('n: Select the next drone')
         elif ch == '>':
             control.increase_thrust()
             print('Increased thrust to', control.thrust_r)
@@ -132,62 +185,95 @@ def handle_keyboard_input(control, server):
             if not control.enabled:
                 print('Uppercase Q quits the program')
             control.disable()
+        elif ch == 'n':
+            selected = (selected + 1) % len(controls)
+            control  = controls[selected]
+            print('Selected drone', selected)
         elif ch == 'Q':
             server.terminate()
-            control.disable()
+            for control in controls:
+                control.disable()
             print('Bye!')
             break
         elif ch == '7':
             control.toggle_debug()
+        elif ch == '8':
+            control.print_timing()
         else:
             print('Unhandled key', ch, 'was pressed')
 
 
 def main():
+    # all modules log through a queue, the servers in their own processes
+    logs.setup(log_level, log_levels)
+
+    # the metrics of this process: the control loops and the voice client;
+    # the servers report theirs on their own ports
+    if metrics_port is not None:
+        metrics.serve(metrics_port)
+
     if not start_only_voice_control:
-        uri = args['uri']
-        logging.basicConfig()
+        uris = args['uri']
         crtp.init_drivers(enable_debug_driver=False)
 
-        # the command queue for the crazyflie
-        crazyflieCommandQueue = Queue()
+        # set up the crazyflies, or simulated ones that share a clock
+        if simulate is not None:
+            if len(simulate) % 3 != 0:
+                print('Simulated start positions need three coordinates each!')
+                sys.exit(1)
+            clock = SimulatedClock(speedup)
+            cfs   = [SimulatedCrazyflie(position=simulate[i:i+3], clock=clock, seed=i // 3)
+                     for i in range(0, len(simulate), 3)]
+            uris  = ['sim://{}'.format(i) for i in range(len(cfs))]
+            time_source = clock
+        else:
+            cfs = [crazyflie.Crazyflie(rw_cache='./cache') for _ in uris]
+            time_source = time
 
-        # set up the crazyflie
-        cf = crazyflie.Crazyflie(rw_cache='./cache')
-        control = ControllerThread(cf, crazyflieCommandQueue)
-        control.start()
+        # one command queue, control queue for stop, land, and hold, and
+        # controller per crazyflie; the servers route requests to them by
+        # drone id, which is the index of the URI
+        commandQueues = [Queue() for _ in cfs]
+        controlQueues = [Queue() for _ in cfs]
+        # the state of every control loop, streamed live by the control server
+        liveStates = [SharedState(LIVE_FIELDS) for _ in cfs]
+        controls = []
+        for drone, (cf, commandQueue, controlQueue, live) in enumerate(zip(cfs, commandQueues, controlQueues, liveStates)):
+            control = ControllerThread(cf, commandQueue,
+                                       planner_url=f'http://localhost:{planning_port}',
+                                       planner_socket=planning_socket,
+                                       period_in_ms=1000.0/control_rate,
+                                       time_source=time_source,
+                                       drone=drone if len(cfs) > 1 else None,
+                                       control_queue=controlQueue,
+                                       telemetry_periods=telemetry_periods,
+                                       fp16_telemetry=fp16_telemetry,
+                                       live=live)
+            control.start()
+            controls.append(control)
 
-        # start the web interface to the crazyflie
+        # start the web interface to the crazyflies
         server = Process(
             target=run_server,
-            args=("0.0.0.0", control_port, crazyflieCommandQueue))
+            args=("0.0.0.0", control_port, commandQueues, controlQueues, liveStates,
+                  control_rate))
         server.start()
 
-        # start the path planning server
+        # start the path planning server, shared by all crazyflies
         pathPlanner = Process(
             target=run_path_planner,
-            args=("0.0.0.0", planning_port, crazyflieCommandQueue, room_config))
+            args=("0.0.0.0", planning_port, commandQueues, room_config, planning_workers,
+                  planning_socket))
         pathPlanner.start()
 
-        # connect to the crazyflie
-        if uri is None:
-            print('Scanning for Crazyflies...')
-            available = crtp.scan_interfaces()
-            if available:
-                print('Found Crazyflies:')
-                for i in available:
-                    print('-', i[0])
-                uri = available[0][0]
-            else:
-                print('No Crazyflies found!')
-                sys.exit(1)
-
-        print('Connecting to', uri)
-        cf.open_link(uri)
+        for cf, uri in zip(cfs, uris):
+            print('Connecting to', uri)
+            cf.open_link(uri)
 
-        handle_keyboard_input(control, server)
+        handle_keyboard_input(controls, server)
 
-        cf.close_link()
+        for cf in cfs:
+            cf.close_link()
 
     if start_voice_control or start_only_voice_control:
         start_command_loop(f'{control_url}:{control_port}', voice_api)
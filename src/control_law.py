@@ -0,0 +1,105 @@
+# The control law of the crazyflie, separated from the controller thread.
+#
+# A PID controller on the position error computes roll and pitch setpoints
+# for the horizontal axes and the thrust for the vertical axis. The law works
+# in place on preallocated buffers and on any number of states at once: all
+# buffers have a leading batch shape, and gains may be given per state, so the
+# same code controls one drone at 50 Hz or evaluates thousands of states for
+# simulation and gain tuning.
+
+import numpy as np
+
+
+class ControlGains():
+    """
+    Gains, physical constants, and output limits of the control law. Each gain
+    is a scalar or an array that broadcasts over the batch of states.
+    """
+    def __init__( self
+                , height_proportional   = 0.25  # this should not be lower than 0.25
+                , height_derivative     = 0.15
+                , height_integral       = 0.075
+                , position_proportional = 15
+                , position_derivative   = 15
+                , position_integral     = 0
+                , yaw_derivative        = 1
+                , C = 100000
+                , m = 0.0327
+                , g = 9.82
+                , roll_limit   = (-30.0, 30.0)
+                , pitch_limit  = (-30.0, 30.0)
+                , yaw_limit    = (-200.0, 200.0)
+                , thrust_limit = (0, 65535)
+                ):
+        stack = lambda horizontal, vertical: np.stack(np.broadcast_arrays(horizontal, horizontal, vertical), axis = -1)
+
+        # per axis x, y, z
+        self.proportional = stack(position_proportional, height_proportional).astype(float)
+        self.derivative   = stack(position_derivative,   height_derivative).astype(float)
+        self.integral     = stack(position_integral,     height_integral).astype(float)
+
+        self.yaw_derivative = np.asarray(yaw_derivative, dtype = float)
+        self.C     = np.asarray(C, dtype = float)
+        self.hover = np.asarray(m * g, dtype = float)
+
+        # per output roll, pitch, yaw rate, thrust
+        self.lower = np.array([roll_limit[0], pitch_limit[0], yaw_limit[0], thrust_limit[0]], dtype = float)
+        self.upper = np.array([roll_limit[1], pitch_limit[1], yaw_limit[1], thrust_limit[1]], dtype = float)
+
+
+class ControlState():
+    """
+    Preallocated buffers for ``control_step`` with a leading batch shape.
+    The caller fills ``pos``, ``vel``, and ``pos_ref``; ``integral`` and
+    ``out`` are carried from one step to the next.
+    """
+    def __init__(self, shape = ()):
+        shape = tuple(int(n) for n in np.atleast_1d(shape))
+        self.pos      = np.zeros(shape + (3,))
+        self.vel      = np.zeros(shape + (3,))
+        self.pos_ref  = np.zeros(shape + (3,))
+        self.integral = np.zeros(shape + (3,))
+        self.error    = np.zeros(shape + (3,))
+        self.scratch  = np.zeros(shape + (3,))
+        # roll, pitch, yaw rate, thrust
+        self.out      = np.zeros(shape + (4,))
+
+    def reset(self):
+        """
+        Forgets the integrated error, e.g. when the motors are started.
+        """
+        self.integral[...] = 0.0
+
+
+def control_step(gains, state, dt):
+    """
+    Computes the control signals for all states in place, without allocating.
+
+    :param gains: the ``ControlGains``
+    :param state: the ``ControlState``, its ``integral`` and ``out`` are updated
+    :param dt: the control period in seconds
+    :return: ``state.out``, the roll, pitch, yaw rate, and thrust setpoints
+    """
+    error, u, out = state.error, state.scratch, state.out
+
+    np.subtract(state.pos_ref, state.pos, out = error)
+    np.multiply(error, dt, out = u)
+    np.add(state.integral, u, out = state.integral)
+
+    # u = Kp * e - Kd * v + Ki * integral, per axis
+    np.multiply(gains.proportional, error, out = u)
+    np.multiply(gains.derivative, state.vel, out = error)
+    np.subtract(u, error, out = u)
+    np.multiply(gains.integral, state.integral, out = error)
+    np.add(u, error, out = u)
+
+    # a positive error in y needs a negative roll, one in x a positive pitch
+    np.negative(u[..., 1], out = out[..., 0])
+    out[..., 1] = u[..., 0]
+    # the yaw rate is damped from its previous value
+    np.multiply(gains.yaw_derivative, out[..., 2], out = out[..., 2])
+    np.add(u[..., 2], gains.hover, out = out[..., 3])
+    np.multiply(gains.C, out[..., 3], out = out[..., 3])
+
+    np.clip(out, gains.lower, gains.upper, out = out)
+    return out
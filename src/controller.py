@@ -2,35 +2,35 @@
 #
 # Author: Christopher Blöcker, Timotheus Kampik, Tobias Sundqvist, Marcus?
 
+import logging
+import queue
 import time
+from collections import deque
 from tf import transformations as trans
 
-from cflib.crazyflie.log import LogConfig
 from threading           import Thread
 from src.path import *
-from requests            import post
-from json                import dumps
+from src.planning_client import PlanningClient, SocketPlanningClient
+from src.flight_recorder import FlightRecorder, FLIGHT_COLUMNS
+from src.periodic import PeriodicScheduler
+from src.metrics import Histogram, REGISTRY, queue_depth
+from src.state import StateStore
+from src.telemetry import Telemetry, TelemetryField
+import src.estimator as estimator
+from src.control_law import ControlGains, ControlState, control_step
+from src.logs import Throttle
 
-# constants
-K_height_proportional = 0.25  # this should not be lower than 0.25
-K_height_derivative   = 0.15
-K_height_integral     = 0.075
-
-K_position_proportional = 15
-K_position_derivative   = 15
-K_position_integral     = 0
-
-K_yaw_derivative        = 1
-
-C = 100000
-m = 0.0327
-g = 9.82
+log = logging.getLogger(__name__)
 
 
 class Command():
     """
     Commands can be applied to the crazyflie
     """
+    # when the server received the command, from time.monotonic, which all
+    # processes share; set for the commands of the control queue
+    received = None
+
     def __init__(self):
         pass
 
@@ -53,6 +53,21 @@ class DistanceCommand(Command):
         drone.setRelativeTarget(self.dx, self.dy, self.dz)
 
 
+class MissionCommand(Command):
+    """
+    The mission command sets a sequence of new reference positions for the
+    crazyflie, each relative to the previous one, starting at the current
+    reference position. All legs are planned in one request.
+    """
+    def __init__(self, distances, reorder = False):
+        Command.__init__(self)
+        self.distances = distances
+        self.reorder   = reorder
+
+    def execute(self, drone):
+        drone.setRelativeMission(self.distances, self.reorder)
+
+
 class PositionCommand(Command):
     """
     The position command sets a new reference position for the crazyflie, however,
@@ -68,6 +83,34 @@ class PositionCommand(Command):
         drone.setAbsoluteTarget(self.x, self.y, self.z)
 
 
+# how a path command treats the waypoints that are left of the previous path
+REPLACE = "replace"  # fly the new path instead
+APPEND  = "append"   # fly the new path after them
+CLEAR   = "clear"    # drop them and stay at the current reference position
+
+
+class PathCommand(Command):
+    """
+    The path command carries all waypoints of a planned path in one message.
+    Unlike other commands, it takes effect as soon as the crazyflie receives
+    it, according to its policy. If stop is set, the crazyflie stops once it
+    reached the last waypoint. Paths of plans older than the latest plan the
+    crazyflie requested are ignored, so a stale path is never flown. A timed
+    path has the time of every waypoint in seconds after the path was
+    received, and the crazyflie does not fly on to a waypoint before its time.
+    """
+    def __init__(self, waypoints, policy = REPLACE, stop = False, plan = None, times = None):
+        Command.__init__(self)
+        self.waypoints = np.asarray(waypoints, dtype = float).reshape(-1, 3)
+        self.policy    = policy
+        self.stop      = stop
+        self.plan      = plan
+        self.times     = None if times is None else np.asarray(times, dtype = float).reshape(-1)
+
+    def execute(self, drone):
+        drone.followPath(self)
+
+
 class StartCommand(Command):
     """
     The start command starts the crazyflie and sets the reference position a few
@@ -104,6 +147,33 @@ class StopCommand(Command):
         drone.stopMotors()
 
 
+class HoldCommand(Command):
+    """
+    The hold command keeps the crazyflie at its current position, dropping the
+    rest of its path and the commands that wait for it.
+    """
+    def __init__(self):
+        Command.__init__(self)
+
+    def execute(self, drone):
+        drone.hold()
+
+
+# what the control loop publishes on every tick for the live telemetry of the
+# control server, see ``SharedState``
+LIVE_FIELDS = { 'time'      : 1
+              , 'pos'       : 3
+              , 'vel'       : 3
+              , 'attq'      : 4
+              , 'pos_ref'   : 3
+              , 'yaw_ref'   : 1
+              , 'setpoint'  : 4
+              , 'enabled'   : 1
+              , 'waypoints' : 1
+              , 'commands'  : 1
+              }
+
+
 class ControllerThread(Thread):
     """
     The controller thread for the crazyflie
@@ -116,25 +186,58 @@ class ControllerThread(Thread):
     pitch_limit  = (-30.0, 30.0)
     yaw_limit    = (-200.0, 200.0)
     enabled = False
-    debug   = True
 
     # to integrate over the error
     dt     = period_in_ms/1000.0
-    ex_int = 0
-    ey_int = 0
-    ez_int = 0
 
-    def __init__(self, cf, commandQueue):
+    def __init__(self, cf, commandQueue, planner_url = "http://localhost:8001", planner_socket = None,
+                 period_in_ms = None, time_source = time, drone = None, control_queue = None,
+                 telemetry_periods = None, fp16_telemetry = False, live = None):
         super(ControllerThread, self).__init__()
         self.cf = cf
         self.commandQueue = commandQueue
+        # Stop, land, and hold commands that cannot wait for the path to be
+        # flown; checked on every tick before the command queue
+        self.controlQueue = control_queue
+        # Optional SharedState with LIVE_FIELDS, read by the control server
+        self.live = live
+        # Identifies the crazyflie to the servers if there are several
+        self.drone = drone
+        # The time module, or the clock of a simulated crazyflie
+        self.time = time_source
+
+        # Paces the control loop, and keeps statistics about how well it does
+        if period_in_ms is not None:
+            self.period_in_ms = period_in_ms
+            self.dt           = period_in_ms/1000.0
+        self.clock = PeriodicScheduler(self.dt, clock = self.time)
+
+        # The control law and its buffers, including the integrated error
+        self.gains   = ControlGains(roll_limit   = self.roll_limit,
+                                    pitch_limit  = self.pitch_limit,
+                                    yaw_limit    = self.yaw_limit,
+                                    thrust_limit = self.thrust_limit)
+        self.control = ControlState()
+        # the state of the control loop is logged every two seconds at most
+        self.debug_throttle = Throttle(2.0)
+
+        # All planning requests go through a few connections to the planning server.
+        # Over the local socket, we get the planned paths back and queue them ourselves.
+        if planner_socket is not None:
+            self.planner = SocketPlanningClient(planner_socket, self.enqueue_path, drone = drone)
+        else:
+            self.planner = PlanningClient(planner_url, drone = drone)
+
+        # The waypoints of the current path and the commands that wait for
+        # the crazyflie to reach them, and when it may fly on to each waypoint
+        self.waypoints       = deque()
+        self.waypoint_times  = deque()
+        self.stop_after_path = False
+        self.commands        = deque()
 
         # Reset state
         self.disable(stop=False)
 
-        # Keeps track of when we last printed
-        self.last_time_print = 0.0
-
         # Connect some callbacks from the Crazyflie API
         self.cf.connected.add_callback(self._connected)
         self.cf.disconnected.add_callback(self._disconnected)
@@ -142,102 +245,104 @@ class ControllerThread(Thread):
         self.cf.connection_lost.add_callback(self._connection_lost)
         self.send_setpoint = self.cf.commander.send_setpoint
 
-        # Pose estimate from the Kalman filter
-        self.pos = np.r_[0.0, 0.0, 0.0]
-        self.vel = np.r_[0.0, 0.0, 0.0]
-        self.attq = np.r_[0.0, 0.0, 0.0, 1.0]
-        self.R = np.eye(3)
-
-        # Attitide (roll, pitch, yaw) from stabilizer
-        self.stab_att = np.r_[0.0, 0.0, 0.0]
+        # Pose estimate from the Kalman filter and attitude (roll, pitch, yaw)
+        # from the stabilizer, published by the log callbacks and read once
+        # per tick by the control loop
+        self.state = StateStore({ 'pos' : 3, 'vel_bf' : 3, 'attq' : 4, 'R' : 9, 'stab_att' : 3 },
+                                initial = { 'attq' : (0.0, 0.0, 0.0, 1.0), 'R' : np.eye(3).reshape(-1) },
+                                clock   = self.time)
+        self.update_state()
+
+        # The log variables, packed into as few log blocks as fit; fields can
+        # have their own periods [ms]
+        self.telemetry = Telemetry(self.telemetry_fields(), self.period_in_ms, periods = telemetry_periods,
+                                   fp16 = fp16_telemetry, clock = self.time)
+
+        # How old the estimate is when we use it and how long it takes from
+        # receiving a position until the setpoint is sent [ms]
+        self.state_age       = Histogram.exponential(0.5, 2, 12)
+        self.actuation_delay = Histogram.exponential(0.5, 2, 12)
+        # ... and how long it takes from the server receiving a command of the
+        # control queue until the setpoint changed [ms]
+        self.control_latency = Histogram.exponential(0.5, 2, 12)
+
+        # How long to wait for the estimate to converge after a reset, and
+        # how long it took [s]
+        self.estimator_timeout = 10.0
+        self.time_to_ready     = None
+
+        # Warn about estimates older than stale_after, stop the motors when
+        # they get older than stale_cutoff [s]
+        self.stale_after  = 0.1
+        self.stale_cutoff = 0.5
+        self.stale        = False
+        self.stale_ticks  = 0
+
+        self.register_metrics(REGISTRY)
 
         # This makes Python exit when this is the only thread alive.
         self.daemon = True
 
     def _connected(self, link_uri):
-        print('Connected to', link_uri)
-
-        log_stab_att = LogConfig(name='Stabilizer', period_in_ms=self.period_in_ms)
-        log_stab_att.add_variable('stabilizer.roll', 'float')
-        log_stab_att.add_variable('stabilizer.pitch', 'float')
-        log_stab_att.add_variable('stabilizer.yaw', 'float')
-        self.cf.log.add_config(log_stab_att)
-
-        log_pos = LogConfig(name='Kalman Position', period_in_ms=self.period_in_ms)
-        log_pos.add_variable('kalman.stateX', 'float')
-        log_pos.add_variable('kalman.stateY', 'float')
-        log_pos.add_variable('kalman.stateZ', 'float')
-        self.cf.log.add_config(log_pos)
-
-        log_vel = LogConfig(name='Kalman Velocity', period_in_ms=self.period_in_ms)
-        log_vel.add_variable('kalman.statePX', 'float')
-        log_vel.add_variable('kalman.statePY', 'float')
-        log_vel.add_variable('kalman.statePZ', 'float')
-        self.cf.log.add_config(log_vel)
-
-        log_att = LogConfig(name='Kalman Attitude', period_in_ms=self.period_in_ms)
-        log_att.add_variable('kalman.q0', 'float')
-        log_att.add_variable('kalman.q1', 'float')
-        log_att.add_variable('kalman.q2', 'float')
-        log_att.add_variable('kalman.q3', 'float')
-        self.cf.log.add_config(log_att)
-
-        if log_stab_att.valid and log_pos.valid and log_vel.valid and log_att.valid:
-            log_stab_att.data_received_cb.add_callback(self._log_data_stab_att)
-            log_stab_att.error_cb.add_callback(self._log_error)
-            log_stab_att.start()
-
-            log_pos.data_received_cb.add_callback(self._log_data_pos)
-            log_pos.error_cb.add_callback(self._log_error)
-            log_pos.start()
-
-            log_vel.error_cb.add_callback(self._log_error)
-            log_vel.data_received_cb.add_callback(self._log_data_vel)
-            log_vel.start()
-
-            log_att.error_cb.add_callback(self._log_error)
-            log_att.data_received_cb.add_callback(self._log_data_att)
-            log_att.start()
-        else:
-            raise RuntimeError('One or more of the variables in the configuration was not'
-                               'found in log TOC. Will not get any position data.')
+        log.info('Connected to %s', link_uri)
+        self.telemetry.start(self.cf, self.state.publish)
 
     def _connection_failed(self, link_uri, msg):
-        print('Connection to %s failed: %s' % (link_uri, msg))
+        log.error('Connection to %s failed: %s', link_uri, msg)
 
     def _connection_lost(self, link_uri, msg):
-        print('Connection to %s lost: %s' % (link_uri, msg))
+        log.error('Connection to %s lost: %s', link_uri, msg)
 
     def _disconnected(self, link_uri):
-        print('Disconnected from %s' % link_uri)
-
-    def _log_data_stab_att(self, timestamp, data, logconf):
-        self.stab_att = np.r_[data['stabilizer.roll'],
-                              data['stabilizer.pitch'],
-                              data['stabilizer.yaw']]
-
-    def _log_data_pos(self, timestamp, data, logconf):
-        self.pos = np.r_[data['kalman.stateX'],
-                         data['kalman.stateY'],
-                         data['kalman.stateZ']]
-
-    def _log_data_vel(self, timestamp, data, logconf):
-        vel_bf = np.r_[data['kalman.statePX'],
-                       data['kalman.statePY'],
-                       data['kalman.statePZ']]
-        self.vel = np.dot(self.R, vel_bf)
-
-    def _log_data_att(self, timestamp, data, logconf):
+        log.info('Disconnected from %s', link_uri)
+
+    def telemetry_fields(self):
+        """The log variables that the control loop needs, by field of the state store"""
+        return [ TelemetryField('stab_att', ['stabilizer.roll', 'stabilizer.pitch', 'stabilizer.yaw'])
+               , TelemetryField('pos',      ['kalman.stateX', 'kalman.stateY', 'kalman.stateZ'])
+               # body frame, rotated into the world frame when the control loop reads it
+               , TelemetryField('vel_bf',   ['kalman.statePX', 'kalman.statePY', 'kalman.statePZ'])
+               , TelemetryField('attq',     ['kalman.q0', 'kalman.q1', 'kalman.q2', 'kalman.q3'], convert = self._attitude)
+               ]
+
+    def _attitude(self, q):
         # NOTE q0 is real part of Kalman state's quaternion, but
         # transformations.py wants it as last dimension.
-        self.attq = np.r_[data['kalman.q1'], data['kalman.q2'],
-                          data['kalman.q3'], data['kalman.q0']]
+        attq = np.r_[q[1], q[2], q[3], q[0]]
         # Extract 3x3 rotation matrix from 4x4 transformation matrix
-        self.R = trans.quaternion_matrix(self.attq)[:3, :3]
-        #r, p, y = trans.euler_from_quaternion(self.attq)
-
-    def _log_error(self, logconf, msg):
-        print('Error when logging %s: %s' % (logconf.name, msg))
+        R = trans.quaternion_matrix(attq)[:3, :3]
+        return { 'attq' : attq, 'R' : R.reshape(-1) }
+
+    def update_state(self):
+        """Takes a consistent snapshot of the state estimate for this tick"""
+        state = self.state.snapshot()
+        self.pos      = state.pos
+        self.attq     = state.attq
+        self.R        = state.R.reshape(3, 3)
+        self.vel      = np.dot(self.R, state.vel_bf)
+        self.stab_att = state.stab_att
+        return state
+
+    def check_state(self, state):
+        """Records how old the estimate is and stops the motors if it is too old
+        to fly on. Returns whether the estimate is fresh."""
+        now = self.time.monotonic()
+        age = max(state.age('pos', now), state.age('attq', now))
+        if age < float('inf'):
+            self.state_age.observe(age * 1e3)
+
+        if age <= self.stale_after:
+            self.stale = False
+            return True
+
+        self.stale_ticks += 1
+        if not self.stale:
+            log.warning('State estimate is %.0fms old!', age * 1e3)
+            self.stale = True
+        if age > self.stale_cutoff:
+            log.warning('Lost the state estimate, stopping motors!')
+            self.disable()
+        return False
 
     def make_position_sanity_check(self):
       """We assume that the position from the LPS should be
@@ -248,10 +353,11 @@ class ControllerThread(Thread):
     def run(self):
         """Control loop definition"""
         while not self.cf.is_connected():
-            time.sleep(0.2)
+            self.time.sleep(0.2)
 
-        print('Waiting for position estimate to be good enough...')
+        log.info('Waiting for position estimate to be good enough...')
         self.reset_estimator()
+        self.update_state()
         self.make_position_sanity_check();
 
         # how accurately do we want the drone to reach its position?
@@ -261,24 +367,41 @@ class ControllerThread(Thread):
         self.yaw_ref    = 0.0
         self.stop_motor = False
         position_found  = False
-
-        print('[INFO ] Initial positional reference:', self.pos_ref)
-        print('[INFO ] Initial thrust reference:', self.thrust_r)
-        print('[INFO ] Ready! Press e to enable motors, h for help and Q to quit')
-
-        log_file_name = 'flightlog_' + time.strftime("%Y%m%d_%H%M%S") + '.csv'
-        with open(log_file_name, 'w') as fh:
-            t0 = time.time()
+        hovering        = False
+
+        log.info('Initial positional reference: %s', self.pos_ref)
+        log.info('Initial thrust reference: %s', self.thrust_r)
+        log.info('Ready! Press e to enable motors, h for help and Q to quit')
+
+        # convert with: python -m src.flight_recorder export <log file>
+        # analyse with: python -m src.flight_log analyze <log file>
+        log_file_name = 'flightlog_' + time.strftime("%Y%m%d_%H%M%S") + ('' if self.drone is None else '_{}'.format(self.drone)) + '.bin'
+        # the period lets src.flight_log replay the log through the control law
+        with FlightRecorder(log_file_name, FLIGHT_COLUMNS, metadata = { "period" : self.dt, "drone" : self.drone }) as recorder:
+            t0 = self.time.time()
+            self.clock.start()
             while True:
-                time_start = time.time()
+                state = self.update_state()
+                if self.enabled:
+                    self.check_state(state)
+
+                # stop, land, and hold take effect on this tick
+                urgent = self.receive_control_commands()
 
                 # set the new target position if we have reached the current target sufficiently well
                 if np.linalg.norm(self.pos_ref - self.pos) < tolerance and not position_found:
                     position_found = True
 
-                if position_found and not self.commandQueue.empty():
-                    self.commandQueue.get().execute(self)
+                # paths take effect immediately, other commands once we are there
+                self.receive_commands()
+                if position_found and self.next_target():
                     position_found = False
+                    hovering       = False
+
+                # let the planner prepare for the next target while we hover
+                if position_found and not hovering and not self.waypoints and not self.commands:
+                    self.hover()
+                    hovering = True
 
                 # calculate the control signals to reach the desired position
                 self.calc_control_signals()
@@ -286,70 +409,59 @@ class ControllerThread(Thread):
                 if self.enabled:
                     sp = (self.roll_r, self.pitch_r, self.yawrate_r, int(self.thrust_r))
                     self.send_setpoint(*sp)
-                    # Log data to file for analysis
-                    ld = np.r_[time.time() - t0]
-                    ld = np.append(ld, np.asarray(sp))
-                    ld = np.append(ld, self.pos_ref)
-                    ld = np.append(ld, self.yaw_ref)
-                    ld = np.append(ld, self.pos)
-                    ld = np.append(ld, self.vel)
-                    ld = np.append(ld, self.attq)
-                    ld = np.append(ld, (np.reshape(self.R, -1)))
-                    ld = np.append(ld, trans.euler_from_quaternion(self.attq))
-                    ld = np.append(ld, self.stab_att)
-                    fh.write(','.join(map(str, ld)) + '\n')
-                    fh.flush()
-                self.loop_sleep(time_start)
+                    self.actuation_delay.observe((self.time.monotonic() - state.received['pos']) * 1e3)
+                    # Log data for analysis, written to the file in the background
+                    ld = recorder.claim()
+                    if ld is not None:
+                        ld[0]     = self.time.time() - t0
+                        ld[1:5]   = sp
+                        ld[5:8]   = self.pos_ref
+                        ld[8]     = self.yaw_ref
+                        ld[9:12]  = self.pos
+                        ld[12:15] = self.vel
+                        ld[15:19] = self.attq
+                        ld[19:28] = self.R.reshape(-1)
+                        ld[28:31] = self.stab_att
+                        recorder.commit()
+                if urgent:
+                    self.observe_control_latency(urgent)
+                if self.live is not None:
+                    self.publish_live(self.time.time() - t0)
+                self.clock.wait()
 
     def calc_control_signals(self):
         """
         calculates the control signals: roll, pitch, yaw
         """
-        roll, pitch, yaw  = trans.euler_from_quaternion(self.attq)
-
-        # Compute control errors in position
-        ex, ey, ez = self.pos_ref - self.pos
-
-        vx, vy, vz = self.vel
-        self.ex_int += ex * self.dt
-        self.ey_int += ey * self.dt
-        self.ez_int += ez * self.dt
-
-        phi_ref    =      K_position_proportional * ex - K_position_derivative * vx + K_position_integral * self.ex_int
-        theta_ref  =   - (K_position_proportional * ey - K_position_derivative * vy + K_position_integral * self.ey_int)
-        psi_ref    =                                     K_yaw_derivative      * self.yawrate_r
-        thrust_ref = C * (K_height_proportional   * ez - K_height_derivative   * vz + K_height_integral   * self.ez_int + m*g)
-
-        # The code below will simply send the thrust that you can set using
-        # the keyboard and put all other control signals to zero. It also
-        # shows how, using numpy, you can threshold the signals to be between
-        # the lower and upper limits defined by the arrays *_limit
-        self.roll_r    = np.clip(theta_ref, *self.roll_limit)
-        self.pitch_r   = np.clip(phi_ref, *self.pitch_limit)
-        self.yawrate_r = np.clip(psi_ref, *self.yaw_limit)
-        self.thrust_r  = np.clip(thrust_ref, *self.thrust_limit)
-
-        if self.debug and (time.time() - 2.0) > self.last_time_print:
-            self.last_time_print = time.time()
-
-            print("ref:      ({:.2f}, {:.2f}, {:.2f}, {:.2f})".format(self.pos_ref[0], self.pos_ref[1], self.pos_ref[2], self.yaw_ref))
-            print("pos:      ({:.2f}, {:.2f}, {:.2f}, {:.2f})".format(self.pos[0], self.pos[1], self.pos[2], yaw))
-            print("vel:      ({:.2f}, {:.2f}, {:.2f})".format(self.vel[1], self.vel[1], self.vel[2]))
-            print("error:    ({:.2f}, {:.2f}, {:.2f})".format(ex, ey, ez))
-            print("integral: ({:.2f}, {:.2f}, {:.2f})".format(self.ex_int, self.ey_int, self.ez_int))
-            print("control:  ({:.2f}, {:.2f}, {:.2f}, {:.2f})".format(self.roll_r, self.pitch_r, self.yawrate_r, self.thrust_r))
-            print("")
+        control = self.control
+        control.pos[:]     = self.pos
+        control.vel[:]     = self.vel
+        control.pos_ref[:] = self.pos_ref
+        control.out[2]     = self.yawrate_r
+
+        # the signals are thresholded to the *_limit ranges by the control law
+        self.roll_r, self.pitch_r, self.yawrate_r, self.thrust_r = control_step(self.gains, control, self.dt).tolist()
+
+        # every two seconds at most, and only computed if it is logged
+        if log.isEnabledFor(logging.DEBUG) and self.debug_throttle.due():
+            roll, pitch, yaw = trans.euler_from_quaternion(self.attq)
+            log.debug("\n"
+                      "  ref:      (%.2f, %.2f, %.2f, %.2f)\n"
+                      "  pos:      (%.2f, %.2f, %.2f, %.2f)\n"
+                      "  vel:      (%.2f, %.2f, %.2f)\n"
+                      "  error:    (%.2f, %.2f, %.2f)\n"
+                      "  integral: (%.2f, %.2f, %.2f)\n"
+                      "  control:  (%.2f, %.2f, %.2f, %.2f)",
+                      *self.pos_ref, self.yaw_ref, *self.pos, yaw, *self.vel, *(self.pos_ref - self.pos),
+                      *control.integral, self.roll_r, self.pitch_r, self.yawrate_r, self.thrust_r,
+                      extra = self.debug_throttle.extra())
 
     def reset_estimator(self):
         """
-        Resets the Kalman filter estimator
+        Resets the Kalman filter estimator and waits until it has converged
         """
-        self.cf.param.set_value('kalman.resetEstimation', '1')
-        time.sleep(0.1)
-        self.cf.param.set_value('kalman.resetEstimation', '0')
-        # Sleep a bit, hoping that the estimator will have converged
-        # Should be replaced by something that actually checks...
-        time.sleep(1.5)
+        self.time_to_ready = estimator.reset_estimator(self.cf, self.time, timeout = self.estimator_timeout)
+        log.info('Position estimate converged after %.2fs', self.time_to_ready)
 
     def disable(self, stop=True):
         """
@@ -358,7 +470,7 @@ class ControllerThread(Thread):
         if stop:
             self.send_setpoint(0.0, 0.0, 0.0, 0)
         if self.enabled:
-            print('Disabling controller')
+            log.info('Disabling controller')
         self.enabled = False
         self.roll_r    = 0.0
         self.pitch_r   = 0.0
@@ -370,24 +482,58 @@ class ControllerThread(Thread):
         Enables the controller
         """
         if not self.enabled:
-            print('Enabling controller')
+            log.info('Enabling controller')
         # Need to send a zero setpoint to unlock the controller.
         self.send_setpoint(0.0, 0.0, 0.0, 0)
         # let it take off a bit, i.e. 30cm above the resting position
         self.pos_ref = self.pos + np.r_[0.0, 0.0, 0.3]
         self.enabled = True
         # reset the integrated error!
-        self.ex_int = 0
-        self.ey_int = 0
-        self.ez_int = 0
-
-    def loop_sleep(self, time_start):
-        """ Sleeps the control loop to make it run at a specified rate """
-        delta_time = 1e-3*self.period_in_ms - (time.time() - time_start)
-        if delta_time > 0:
-            time.sleep(delta_time)
-        else:
-            print('Deadline missed by', -delta_time, 'seconds. Too slow control loop!')
+        self.control.reset()
+
+    def register_metrics(self, registry):
+        """Registers the timing of the control loop and the depth of its queues"""
+        drone = str(0 if self.drone is None else self.drone)
+        registry.histogram('crazyflie_control_period_milliseconds', 'Time between two ticks of the control loop',
+                           self.clock.periods, drone = drone)
+        registry.histogram('crazyflie_control_jitter_milliseconds', 'How late the control loop woke up',
+                           self.clock.jitter, drone = drone)
+        registry.histogram('crazyflie_control_overrun_milliseconds', 'How far ticks ran past their deadline',
+                           self.clock.overruns, drone = drone)
+        registry.histogram('crazyflie_state_age_milliseconds', 'Age of the state estimate when the control loop used it',
+                           self.state_age, drone = drone)
+        registry.histogram('crazyflie_actuation_delay_milliseconds', 'Time from receiving a position until the setpoint was sent',
+                           self.actuation_delay, drone = drone)
+        registry.histogram('crazyflie_control_command_latency_milliseconds', 'Time from the server receiving stop, land, or hold until the setpoint changed',
+                           self.control_latency, drone = drone)
+        registry.counter('crazyflie_control_missed_deadlines_total', 'Ticks that missed their deadline',
+                         lambda: self.clock.missed, drone = drone)
+        registry.counter('crazyflie_stale_ticks_total', 'Ticks with a stale state estimate',
+                         lambda: self.stale_ticks, drone = drone)
+        registry.gauge('crazyflie_command_queue_depth', 'Commands in the command queue',
+                       queue_depth(self.commandQueue), drone = drone)
+        registry.gauge('crazyflie_waiting_commands', 'Commands taken from the queue that wait for the path to be flown',
+                       lambda: len(self.commands), drone = drone)
+        registry.gauge('crazyflie_waypoints', 'Waypoints left of the current path',
+                       lambda: len(self.waypoints), drone = drone)
+        registry.gauge('crazyflie_estimator_ready_seconds', 'How long the state estimate took to converge after the last reset',
+                       lambda: float('nan') if self.time_to_ready is None else self.time_to_ready, drone = drone)
+
+    def print_timing(self):
+        """ Prints how well the control loop keeps its rate and how fresh its state estimate is """
+        stats = self.clock.stats()
+        log.info('Control loop at %.0f Hz: %d ticks, %d deadlines missed, %d ticks skipped',
+                 1000.0/self.period_in_ms, stats['ticks'], stats['missed'], stats['skipped'])
+        stats['state age']       = self.state_age.snapshot()
+        stats['actuation delay'] = self.actuation_delay.snapshot()
+        stats['control latency'] = self.control_latency.snapshot()
+        for name in ['period', 'jitter', 'overruns', 'state age', 'actuation delay', 'control latency']:
+            log.info('  %-15s mean %.3fms, p50 %.3fms, p99 %.3fms, max %.3fms',
+                     name, stats[name]['mean'], stats[name]['p50'], stats[name]['p99'], stats[name]['max'])
+        log.info('  %d ticks with a stale state estimate', self.stale_ticks)
+        for name, block in self.telemetry.stats().items():
+            log.info('  log block %s: %d bytes every %.0fms, %d frames, interval p50 %.3fms, p99 %.3fms',
+                     name, block['bytes'], block['period'], block['frames'], block['intervals']['p50'], block['intervals']['p99'])
 
     def increase_thrust(self):
         """
@@ -405,26 +551,156 @@ class ControllerThread(Thread):
 
     def toggle_debug(self):
         """
-        Enable/disable debug mode
+        Enable/disable the debug output of the controller
         """
-        print("[DEBUG] Switching debug output {:s}".format("off" if self.debug else "on"))
-        self.debug = not self.debug
+        debug = not log.isEnabledFor(logging.DEBUG)
+        log.setLevel(logging.DEBUG if debug else logging.INFO)
+        log.info("Switching debug output %s", "on" if debug else "off")
 
     def setRelativeTarget(self, dx, dy, dz):
         """Sets a reference position, relative to the current reference position.
-        For that, a path planning request is made to the path planning server in
-        a separate thread. (But it's really annoying that we can't start a process
-        from a thread!) Once the path is planned, the path planning server sets
-        a sequence of PositionCommands to the crazyflie."""
-        json = dumps({ "command" : "plan"
-                     , "data"    : { "start"  : (self.pos_ref[0],      self.pos_ref[1],      self.pos_ref[2])
-                                   , "target" : (self.pos_ref[0] + dx, self.pos_ref[1] + dy, self.pos_ref[2] + dz)
-                                   }
-                     })
-        t = Thread(target = post, args = ("http://localhost:8001", json))
-        t.daemon = True
-        t.start()
+        For that, a path planning request is sent to the path planning server
+        by the planning client, which does not block the control loop. Once the
+        path is planned, the path planning server sends it to the crazyflie
+        as a PathCommand."""
+        self.planner.plan( (self.pos_ref[0],      self.pos_ref[1],      self.pos_ref[2])
+                         , (self.pos_ref[0] + dx, self.pos_ref[1] + dy, self.pos_ref[2] + dz)
+                         )
+
+
+    def setRelativeMission(self, distances, reorder = False):
+        """Sets a sequence of reference positions, each relative to the previous
+        one, starting at the current reference position. The whole mission is
+        planned by the path planning server in a single request. If reorder is
+        set, the planner may visit the resulting targets in any order."""
+        targets  = []
+        position = np.array(self.pos_ref, dtype = float)
+        for dx, dy, dz in distances:
+            position = position + np.r_[dx, dy, dz]
+            targets.append(tuple(position))
+
+        self.planner.planMission((self.pos_ref[0], self.pos_ref[1], self.pos_ref[2]), targets, reorder)
+
+    def hover(self):
+        """Tells the path planning server that we hover at the current reference
+        position, so that it can compute the distances to all reachable
+        positions from here before the next target is set."""
+        self.planner.hover((self.pos_ref[0], self.pos_ref[1], self.pos_ref[2]))
+
+    def enqueue_path(self, waypoints, stop, plan = None, times = None):
+        """Queues a planned path that replaces the current one, and whether
+        the crazyflie should stop once it has followed the path."""
+        self.commandQueue.put(PathCommand(waypoints, REPLACE, stop, plan, times))
+
+    def receive_commands(self):
+        """Takes all commands from the command queue without waiting. Paths
+        are applied right away, other commands wait for their turn."""
+        while True:
+            try:
+                command = self.commandQueue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(command, PathCommand):
+                command.execute(self)
+            else:
+                self.commands.append(command)
+
+    def receive_control_commands(self):
+        """Executes all commands of the control queue right away, each after
+        dropping the current path. Returns the commands."""
+        commands = []
+        while self.controlQueue is not None:
+            try:
+                command = self.controlQueue.get_nowait()
+            except queue.Empty:
+                break
+            self.hold()
+            command.execute(self)
+            commands.append(command)
+        return commands
+
+    def observe_control_latency(self, commands):
+        """Records how long the commands took from the server to the setpoint,
+        which should be at most one control period."""
+        # the control server stamps the commands in its own process, so this
+        # is the clock that processes share, not self.time, which runs faster
+        # for a simulated crazyflie
+        now = time.monotonic()
+        for command in commands:
+            if command.received is None:
+                continue
+            latency = (now - command.received) * 1e3
+            self.control_latency.observe(latency)
+            if latency > self.period_in_ms:
+                log.warning('%s took %.1fms from the server to the setpoint!', type(command).__name__, latency)
+
+    def publish_live(self, t):
+        """Publishes the state of this tick for the live telemetry"""
+        self.live.write(time      = t,
+                        pos       = self.pos,
+                        vel       = self.vel,
+                        attq      = self.attq,
+                        pos_ref   = self.pos_ref,
+                        yaw_ref   = self.yaw_ref,
+                        setpoint  = (self.roll_r, self.pitch_r, self.yawrate_r, self.thrust_r),
+                        enabled   = self.enabled,
+                        waypoints = len(self.waypoints),
+                        commands  = len(self.commands))
+
+    def next_target(self):
+        """Moves on to the next waypoint, stops after the last one if the path
+        says so, or executes the next command. Waits at the current waypoint
+        until the time of the next one. Returns whether there was anything to
+        do."""
+        if self.waypoints:
+            due = self.waypoint_times[0]
+            if due is not None and self.time.monotonic() < due:
+                return False
+            self.waypoint_times.popleft()
+            self.setAbsoluteTarget(*self.waypoints.popleft())
+        elif self.stop_after_path:
+            self.stop_after_path = False
+            self.stopMotors()
+        elif self.commands:
+            self.commands.popleft().execute(self)
+        else:
+            return False
+        return True
 
+    def followPath(self, command):
+        """
+        Used by PathCommand.execute. Replaces, extends, or clears the
+        waypoints that are left to fly to.
+        """
+        if command.plan is not None and command.plan < self.planner.lastPlan:
+            log.debug("Ignoring the path of outdated plan %s", command.plan)
+            return
+
+        if command.policy != APPEND:
+            self.waypoints.clear()
+            self.waypoint_times.clear()
+            self.stop_after_path = False
+        if command.policy != CLEAR:
+            self.waypoints.extend(map(tuple, command.waypoints))
+            if command.times is None:
+                self.waypoint_times.extend([None] * len(command.waypoints))
+            else:
+                now = self.time.monotonic()
+                self.waypoint_times.extend((now + command.times).tolist())
+        self.stop_after_path = self.stop_after_path or command.stop
+
+    def hold(self):
+        """
+        Used by HoldCommand.execute. Drops the rest of the path, the commands
+        that wait for it, and the paths still being planned, and stays at the
+        current position.
+        """
+        self.waypoints.clear()
+        self.waypoint_times.clear()
+        self.stop_after_path = False
+        self.commands.clear()
+        self.planner.supersede()
+        self.setAbsoluteTarget(*self.pos)
 
     def setAbsoluteTarget(self, x, y, z):
         """
@@ -434,17 +710,14 @@ class ControllerThread(Thread):
         :param z:
         """
         self.pos_ref = np.r_[x, y, z]
-
-        if self.debug:
-            print("[DEBUG] Setting reference position to ({:.2f}, {:.2f}, {:.2f})".format(self.pos_ref[0], self.pos_ref[1], self.pos_ref[2]))
+        log.debug("Setting reference position to (%.2f, %.2f, %.2f)", x, y, z)
 
     def stopMotors(self):
         """
         Used by StopCommand.execute. Tells the crazyflie to "land".
         """
         self.disable()
-        if self.debug:
-            print("[DEBUG] Stopping motors!")
+        log.debug("Stopping motors!")
 
 
     def startMotors(self):
@@ -452,17 +725,10 @@ class ControllerThread(Thread):
         Used by StartCommand.execute. Tells the crazyflie to start.
         """
         self.enable()
-        if self.debug:
-            print("[DEBUG] Starting motors!")
+        log.debug("Starting motors!")
 
     def land(self):
         """
         Send the land command to the planner
         """
-        json = dumps({ "command" : "land"
-                     , "data"    : { "start" : (self.pos_ref[0], self.pos_ref[1], self.pos_ref[2]) }
-                     })
-
-        t = Thread(target = post, args = ("http://localhost:8001", json))
-        t.daemon = True
-        t.start()
+        self.planner.land((self.pos_ref[0], self.pos_ref[1], self.pos_ref[2]))
@@ -0,0 +1,271 @@
+# Cooperative path planning for several drones in the same scene.
+#
+# Paths that are planned independently of each other can cross at the same
+# time. Here, every drone plans over (cell, time step) with space-time A* and
+# avoids the cells that other drones have reserved for the same time steps,
+# then reserves its own trajectory (cooperative A*). A time step is the time it
+# takes to fly from one cell to the next, and waiting in a cell is a move, too.
+#
+# The reservation table only looks a fixed number of time steps ahead and
+# forgets steps that have passed, so its memory is bounded by the number of
+# drones times that window; beyond the window, a path continues along the
+# cheapest path in the static scene. A drone that arrived keeps its target
+# reserved until it plans again. The search is guided by the exact distances
+# to the target in the static scene, taken from its distance field.
+#
+# A path has one waypoint per time step, waiting is a repeated waypoint. The
+# planning server sends it as it is, with the time of every waypoint, and the
+# controller does not fly on to a waypoint before its time, so waits are held
+# and a fast drone does not run ahead of its reservations. A drone that is
+# slower than one cell per time step falls behind them beyond the slack.
+
+from src.path import *
+
+
+class ReservationTable():
+    """
+    The cells that the drones occupy at every time step within the window,
+    and the cells they park in after they arrived.
+    """
+    def __init__(self, grid, window = 128, clearance = 1, slack = 1):
+        """
+        :param grid: the ``SearchGrid`` whose cell indices are reserved
+        :param window: how many time steps ahead cells are reserved
+        :param clearance: how many cells around a drone are reserved with it
+        :param slack: for how many time steps before and after a drone is in a
+                      cell it is reserved, to tolerate deviations in timing
+        """
+        self.window    = window
+        self.clearance = clearance
+        self.slack     = slack
+        self.offsets   = [ (dx * grid.shape[1] + dy) * grid.shape[2] + dz
+                           for dx in range(-clearance, clearance + 1)
+                           for dy in range(-clearance, clearance + 1)
+                           for dz in range(-clearance, clearance + 1)
+                         ]
+        # time step -> cell -> drone
+        self.slots     = {}
+        # cell -> (drone, time step from which on it is parked there)
+        self.parked    = {}
+        # drone -> its reserved (time step, cell) pairs and parking cells
+        self.reserved  = {}
+        self.parking   = {}
+        self.now       = 0
+
+    def expire(self, now):
+        """
+        Forgets the time steps before ``now``.
+        """
+        for step in [step for step in self.slots if step < now]:
+            del self.slots[step]
+        for drone in self.reserved:
+            self.reserved[drone] = [(step, cell) for step, cell in self.reserved[drone] if step >= now]
+        self.now = now
+
+    def release(self, drone):
+        """
+        Removes all reservations of a drone.
+        """
+        for step, cell in self.reserved.pop(drone, []):
+            slot = self.slots.get(step)
+            if slot is not None and slot.get(cell) == drone:
+                del slot[cell]
+                if not slot:
+                    del self.slots[step]
+        for cell in self.parking.pop(drone, []):
+            if self.parked.get(cell, (None,))[0] == drone:
+                del self.parked[cell]
+
+    def reserve(self, drone, cells, startStep):
+        """
+        Reserves a trajectory for a drone, replacing its previous one.
+
+        :param drone:
+        :param cells: the cell of the drone at every time step from ``startStep`` on
+        :param startStep:
+        """
+        self.release(drone)
+        reserved = []
+        end      = self.now + self.window
+        for step, cell in enumerate(cells, startStep):
+            if step >= end:
+                break
+            for slotStep in range(step - self.slack, step + self.slack + 1):
+                slot = self.slots.setdefault(slotStep, {})
+                for offset in self.offsets:
+                    # the first reservation of a cell wins
+                    if slot.setdefault(cell + offset, drone) == drone:
+                        reserved.append((slotStep, cell + offset))
+        self.reserved[drone] = reserved
+
+        parkedFrom = startStep + len(cells) - 1
+        parking    = [cells[-1] + offset for offset in self.offsets]
+        for cell in parking:
+            self.parked.setdefault(cell, (drone, parkedFrom))
+        self.parking[drone] = parking
+
+    def isFree(self, drone, cell, step):
+        """
+        Whether no other drone occupies the cell at the time step.
+        """
+        slot = self.slots.get(step)
+        if slot is not None and slot.get(cell, drone) != drone:
+            return False
+        other, since = self.parked.get(cell, (drone, 0))
+        return other == drone or step < since
+
+    def isFreeFrom(self, drone, cell, step):
+        """
+        Whether no other drone occupies the cell at the time step or later.
+        """
+        if self.parked.get(cell, (drone,))[0] != drone:
+            return False
+        for slotStep, slot in self.slots.items():
+            if slotStep >= step and slot.get(cell, drone) != drone:
+                return False
+        return True
+
+    def size(self):
+        """
+        The number of reservations in the table.
+        """
+        return sum(len(slot) for slot in self.slots.values()) + len(self.parked)
+
+
+class CooperativePlanner():
+    """
+    Plans paths for several drones in one scene that do not meet.
+    """
+    def __init__(self, scene, window = 128, clearance = 1, slack = 1, waitCost = None, maxExpansions = 200000,
+                 fields = 16):
+        """
+        :param scene: the ``Scene``
+        :param window: see ``ReservationTable``
+        :param clearance: see ``ReservationTable``
+        :param slack: see ``ReservationTable``
+        :param waitCost: the cost of waiting for one time step, the resolution by default
+        :param maxExpansions: after how many expanded nodes a search gives up
+        :param fields: how many distance fields of targets the scene keeps
+        """
+        self.scene         = scene
+        self.grid          = scene.searchGrid()
+        self.table         = ReservationTable(self.grid, window, clearance, slack)
+        self.waitCost      = scene.resolution if waitCost is None else waitCost
+        self.maxExpansions = maxExpansions
+        self.expansions    = 0
+        self.fields        = fields
+
+        # waiting is a move to the same cell
+        self.moves = self.grid.neighbours + [(0, self.waitCost)]
+
+    def planPath(self, drone, start, target, startStep = 0, cancelled = None):
+        """
+        Plans a path that avoids the obstacles and the trajectories reserved
+        by other drones, and reserves it for the drone.
+
+        :param drone: the id of the drone
+        :param start:
+        :param target:
+        :param startStep: the time step at which the drone is at the start
+        :param cancelled: optional function that is polled during the search and
+                          returns ``True`` if the result is not needed anymore
+        :return: the path through the centres of the grid cells, one point per
+                 time step, ending with the target
+        """
+        startCell  = self.scene.checkPoint(start,  "Start")
+        targetCell = self.scene.checkPoint(target, "Target")
+        grid       = self.grid
+        table      = self.table
+
+        startIndex  = grid.index(startCell)
+        targetIndex = grid.index(targetCell)
+
+        # the exact costs to the target in the static scene
+        field     = self.scene.distanceField(target, self.fields)
+        estimates = field.costs.tolist()
+        if estimates[startIndex] == float('inf'):
+            raise Exception("Cannot find a path to target!")
+
+        free     = grid.free
+        moves    = self.moves
+        horizon  = table.now + table.window
+        start    = (startIndex, startStep)
+        costs    = { start : 0.0 }
+        cameFrom = { start : start }
+        explored = set()
+
+        queue = Empty(key = snd).insert((start, estimates[startIndex]))
+
+        expansions = 0
+        goal       = None
+        while not queue.isEmpty():
+            (current, _), queue = queue.popMin()
+            if current in explored:
+                continue
+            explored.add(current)
+
+            expansions += 1
+            if expansions > self.maxExpansions:
+                break
+            if cancelled is not None and expansions % 256 == 0 and cancelled():
+                raise PlanningCancelled("Planning to {} was cancelled.".format(target))
+
+            cell, step = current
+
+            # arrived for good, or beyond the window, where nothing is reserved
+            if (cell == targetIndex and table.isFreeFrom(drone, cell, step)) or step >= horizon:
+                goal = current
+                break
+
+            currentCost = costs[current]
+            for offset, cost in moves:
+                neighbour = cell + offset
+                if not free[neighbour] or not table.isFree(drone, neighbour, step + 1):
+                    continue
+
+                node = (neighbour, step + 1)
+                cost = currentCost + cost
+                if node not in explored and cost < costs.get(node, float('inf')):
+                    costs[node]    = cost
+                    cameFrom[node] = current
+                    queue = queue.insert((node, cost + estimates[neighbour]))
+
+        self.expansions = expansions
+        if goal is None:
+            raise Exception("Cannot find a path to target!")
+
+        cells = [goal[0]]
+        node  = goal
+        while node != cameFrom[node]:
+            node = cameFrom[node]
+            cells.append(node[0])
+        cells.reverse()
+
+        # beyond the window, follow the cheapest path in the static scene
+        while cells[-1] != targetIndex:
+            cells.append(int(field.cameFrom[cells[-1]]))
+
+        table.reserve(drone, cells, startStep)
+        return [grid.point(cell) for cell in cells] + [target]
+
+    def conflicts(self, trajectories, distance = None):
+        """
+        Counts the time steps at which two trajectories come closer than the
+        given distance, by default the distance that the clearance keeps.
+
+        :param trajectories: lists of points, one point per time step
+        :return: the number of (pair, time step) conflicts
+        """
+        if distance is None:
+            distance = (self.table.clearance + 1) * self.scene.resolution - 1e-9
+
+        count = 0
+        steps = max(len(trajectory) for trajectory in trajectories)
+        for step in range(steps):
+            # drones stay where they arrived
+            points = [trajectory[min(step, len(trajectory) - 1)] for trajectory in trajectories]
+            for i in range(len(points)):
+                for j in range(i + 1, len(points)):
+                    if points[i].distanceTo(points[j]) < distance:
+                        count += 1
+        return count
@@ -0,0 +1,65 @@
+# Resets the Kalman filter of the crazyflie and waits until it has converged.
+#
+# After a reset, the variances of the estimated position start high and drop
+# as the filter takes in measurements. Instead of sleeping for a fixed time,
+# the variances are logged at a high rate, and the estimate counts as ready
+# once they have stayed low and within a small band for a whole window of
+# samples; a filter that is stuck has flat variances, too, but high ones.
+# That is quick when the filter converges quickly, and an estimate that does
+# not converge in time is an error instead of something to fly on.
+
+import time
+from collections import deque
+from threading import Lock
+
+from cflib.crazyflie.log import LogConfig
+
+VARIANCES = ['kalman.varPX', 'kalman.varPY', 'kalman.varPZ']
+
+
+def reset_estimator(cf, clock = time, window = 10, threshold = 0.001, ceiling = 0.01, period_in_ms = 10, timeout = 10.0):
+    """
+    Resets the Kalman filter and waits until its position variances converged.
+
+    :param cf: the connected ``Crazyflie``
+    :param clock: provides ``monotonic`` and ``sleep``, the ``time`` module by default
+    :param window: how many consecutive samples have to be within the threshold
+    :param threshold: the largest difference between the samples of a window [m^2]
+    :param ceiling: the largest variance of a converged estimate [m^2]
+    :param period_in_ms: the log period of the variances
+    :param timeout: how long to wait at most [s]
+    :return: how long it took after the reset [s]
+    """
+    samples = deque(maxlen = window)
+    lock    = Lock()
+
+    def received(timestamp, data, logconf):
+        with lock:
+            samples.append([data[name] for name in VARIANCES])
+
+    logconf = LogConfig(name = 'Kalman Variance', period_in_ms = period_in_ms)
+    for name in VARIANCES:
+        logconf.add_variable(name, 'float')
+    cf.log.add_config(logconf)
+    logconf.data_received_cb.add_callback(received)
+
+    cf.param.set_value('kalman.resetEstimation', '1')
+    clock.sleep(0.1)
+    cf.param.set_value('kalman.resetEstimation', '0')
+
+    start = clock.monotonic()
+    logconf.start()
+    try:
+        while clock.monotonic() - start < timeout:
+            clock.sleep(period_in_ms / 1000.0)
+            with lock:
+                if len(samples) < window:
+                    continue
+                spreads = [max(values) - min(values) for values in zip(*samples)]
+                highest = max(max(values) for values in samples)
+            if max(spreads) < threshold and highest < ceiling:
+                return clock.monotonic() - start
+    finally:
+        logconf.stop()
+
+    raise RuntimeError('The position estimate did not converge within {:.1f}s'.format(timeout))
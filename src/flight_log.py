@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+
+# Analysis and replay of flight logs that do not fit into memory.
+#
+# A flight log, either a recording of the ``FlightRecorder`` or a CSV export of
+# it, is converted once into a columnar cache next to it: MAGIC, the length of
+# the header as uint32, a JSON header, and then the values column by column as
+# little-endian float64. The cache is memory-mapped, so an analysis only pages
+# in the columns it reads, and it is rebuilt when the log changes. Conversion
+# and replay work through the log in chunks of rows.
+#
+# The analysis computes the tracking error, how long it took to settle at
+# every waypoint, how often the control signals were saturated, and how many
+# ticks missed their deadline. The replay feeds the logged state estimates and
+# references through the control law, with the recorded gains or others, and
+# compares its control signals to the recorded ones.
+#
+# Usage:
+#   python -m src.flight_log analyze flightlog_20190101_120000.bin
+#   python -m src.flight_log replay flightlog_20190101_120000.bin --gain height_integral=0.1
+
+import argparse
+import json
+import os
+import sys
+from itertools import islice
+
+import numpy as np
+
+from src.control_law import ControlGains, ControlState, control_step
+from src.flight_recorder import FLIGHT_COLUMNS, HEADER, MAGIC
+
+CACHE_MAGIC = b'CFCOL\x00\x01\x00'
+
+# older logs were written as CSV without a header and with the Euler angles
+# of the estimate before the attitude of the stabilizer
+LEGACY_COLUMNS = FLIGHT_COLUMNS[:28] + ['roll', 'pitch', 'yaw'] + FLIGHT_COLUMNS[28:]
+
+# the recorded control signals, in the order of ``ControlState.out``
+OUTPUTS = ['roll_r', 'pitch_r', 'yawrate_r', 'thrust_r']
+
+
+def cache_path(path):
+    return os.path.splitext(path)[0] + '.columns'
+
+
+def _read_header(fh, magic, path):
+    if fh.read(len(magic)) != magic:
+        raise Exception("{} is not a flight log.".format(path))
+    size, = HEADER.unpack(fh.read(HEADER.size))
+    return json.loads(fh.read(size).decode()), len(magic) + HEADER.size + size
+
+
+def _source(path):
+    stat = os.stat(path)
+    return { "path" : os.path.basename(path), "size" : stat.st_size, "mtime" : stat.st_mtime }
+
+
+def _recording_chunks(path, chunk):
+    """
+    The columns, metadata, number of rows, and chunks of rows of a recording.
+    """
+    with open(path, 'rb') as fh:
+        header, offset = _read_header(fh, MAGIC, path)
+    columns  = header.pop("columns")
+    rowSize  = len(columns) * np.dtype(header["dtype"]).itemsize
+    # a row that was cut off when recording stopped is left out
+    rows     = (os.path.getsize(path) - offset) // rowSize
+
+    def chunks():
+        if rows == 0:
+            return
+        data = np.memmap(path, dtype = header["dtype"], mode = 'r', offset = offset, shape = (rows, len(columns)))
+        for start in range(0, rows, chunk):
+            yield data[start:start + chunk]
+
+    return columns, header, rows, chunks()
+
+
+def _csv_chunks(path, chunk):
+    """
+    The columns, metadata, number of rows, and chunks of rows of a CSV file,
+    with or without a header line.
+    """
+    with open(path) as fh:
+        first = fh.readline().strip()
+        rows  = sum(1 for line in fh if line.strip()) + 1
+
+    try:
+        width   = len(np.array(first.split(','), dtype = float))
+        columns = { len(FLIGHT_COLUMNS) : FLIGHT_COLUMNS, len(LEGACY_COLUMNS) : LEGACY_COLUMNS }.get(width)
+        if columns is None:
+            raise Exception("{} has {:d} columns and no header.".format(path, width))
+        skip = 0
+    except ValueError:
+        columns = [name.strip() for name in first.split(',')]
+        rows   -= 1
+        skip    = 1
+
+    def chunks():
+        with open(path) as fh:
+            lines = (line for line in islice(fh, skip, None) if line.strip())
+            while True:
+                block = list(islice(lines, chunk))
+                if not block:
+                    return
+                yield np.loadtxt(block, delimiter = ',', ndmin = 2)
+
+    return list(columns), {}, rows, chunks()
+
+
+def convert(path, cache = None, chunk = 65536):
+    """
+    Converts a flight log into a columnar cache, a chunk of rows at a time.
+
+    :param path: a recording of the ``FlightRecorder`` or a CSV file
+    :param cache: the path of the cache, next to the log by default
+    :param chunk: how many rows are converted at once
+    :return: the path of the cache
+    """
+    cache = cache or cache_path(path)
+    with open(path, 'rb') as fh:
+        recording = fh.read(len(MAGIC)) == MAGIC
+    columns, metadata, rows, chunks = (_recording_chunks if recording else _csv_chunks)(path, chunk)
+
+    header = json.dumps({ "columns" : columns, "rows" : rows, "metadata" : metadata, "source" : _source(path) })
+    # the values start at a multiple of 64 bytes
+    offset = len(CACHE_MAGIC) + HEADER.size + len(header)
+    header = (header + ' ' * (-offset % 64)).encode()
+    offset = len(CACHE_MAGIC) + HEADER.size + len(header)
+
+    partial = cache + '.partial'
+    with open(partial, 'wb') as fh:
+        fh.write(CACHE_MAGIC + HEADER.pack(len(header)) + header)
+        fh.truncate(offset + rows * len(columns) * 8)
+
+    if rows:
+        data  = np.memmap(partial, dtype = '<f8', mode = 'r+', offset = offset, shape = (len(columns), rows))
+        start = 0
+        for values in chunks:
+            if values.shape[1] != len(columns):
+                raise Exception("{} has rows with {:d} instead of {:d} columns.".format(path, values.shape[1], len(columns)))
+            data[:, start:start + len(values)] = values.T
+            start += len(values)
+        data.flush()
+        del data
+
+    os.replace(partial, cache)
+    return cache
+
+
+class FlightLog():
+    """
+    The columns of a flight log, memory-mapped from its columnar cache.
+    """
+    def __init__(self, path, cache = None, chunk = 65536):
+        """
+        :param path: a recording of the ``FlightRecorder`` or a CSV file
+        :param cache: the path of the cache, next to the log by default; it is
+                      built if it does not exist or the log changed since
+        :param chunk: how many rows are converted at once
+        """
+        self.path  = path
+        self.cache = cache or cache_path(path)
+
+        header, offset = self._header()
+        if header is None or header["source"]["size"] != os.path.getsize(path) \
+                          or header["source"]["mtime"] != os.path.getmtime(path):
+            convert(path, self.cache, chunk)
+            header, offset = self._header()
+
+        self.columns  = header["columns"]
+        self.metadata = header["metadata"]
+        self.rows     = header["rows"]
+        if self.rows:
+            self.data = np.memmap(self.cache, dtype = '<f8', mode = 'r', offset = offset, shape = (len(self.columns), self.rows))
+        else:
+            self.data = np.zeros((len(self.columns), 0))
+
+    def _header(self):
+        try:
+            with open(self.cache, 'rb') as fh:
+                return _read_header(fh, CACHE_MAGIC, self.cache)
+        except Exception:
+            return None, 0
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        """
+        A column, as a read-only view into the cache.
+        """
+        if name not in self.columns:
+            raise Exception("{} has no column {}.".format(self.path, name))
+        return self.data[self.columns.index(name)]
+
+    def stack(self, names, start = 0, stop = None):
+        """
+        Some columns of some rows, one row per row of the log.
+        """
+        return np.stack([self[name][start:stop] for name in names], axis = -1)
+
+    def period(self, gap = 0.5):
+        """
+        The period of the control loop [s], as recorded or the median interval.
+        """
+        if "period" in self.metadata:
+            return self.metadata["period"]
+        dt = np.diff(self['t'])
+        dt = dt[dt <= gap]
+        return float(np.median(dt)) if len(dt) else float('nan')
+
+    def segments(self, gap = 0.5):
+        """
+        The first rows of the parts of the log between which the motors were
+        disabled, i.e. where the time jumps by more than ``gap`` seconds.
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype = int)
+        return np.r_[0, np.flatnonzero(np.diff(self['t']) > gap) + 1]
+
+
+def tracking_error(log):
+    """
+    The distance between the reference and the estimated position [m], per row.
+    """
+    squared = np.zeros(len(log))
+    for axis in 'xyz':
+        error    = log[axis + '_ref'] - log[axis]
+        squared += error * error
+    return np.sqrt(squared)
+
+
+def settle_times(log, tolerance = 0.2, error = None, gap = 0.5):
+    """
+    How long it took to settle at every waypoint, that is, until the tracking
+    error stayed below the tolerance for as long as the waypoint was the
+    reference.
+
+    :param log: the ``FlightLog``
+    :param tolerance: [m]
+    :param error: the tracking error, if it was already computed
+    :param gap: see ``FlightLog.segments``
+    :return: the first row of every waypoint and the time it took to settle
+             there [s], ``nan`` if it did not settle before the next one
+    """
+    error = tracking_error(log) if error is None else error
+    t     = log['t']
+    if len(t) == 0:
+        return np.zeros(0, dtype = int), np.zeros(0)
+
+    changed = np.zeros(len(t), dtype = bool)
+    changed[log.segments(gap)] = True
+    for name in ['x_ref', 'y_ref', 'z_ref']:
+        changed[1:] |= np.diff(log[name]) != 0
+    starts = np.flatnonzero(changed)
+    ends   = np.r_[starts[1:], len(t)]
+
+    # the last row of every waypoint at which the error was not below the tolerance
+    rows      = np.where(error >= tolerance, np.arange(len(t)), -1)
+    unsettled = np.maximum.reduceat(rows, starts)
+
+    settled = np.where(unsettled < starts, starts, np.minimum(unsettled + 1, len(t) - 1))
+    times   = t[settled] - t[starts]
+    times[unsettled == ends - 1] = np.nan
+    return starts, times
+
+
+def saturation(log, gains = None):
+    """
+    The fraction of rows at which each control signal was at one of its limits.
+    """
+    gains = gains or ControlGains()
+    if len(log) == 0:
+        return { name : 0.0 for name in OUTPUTS }
+    return { name : float(np.mean((log[name] <= lower) | (log[name] >= upper)))
+             for name, lower, upper in zip(OUTPUTS, gains.lower, gains.upper)
+           }
+
+
+def deadlines(log, period = None, factor = 1.5, gap = 0.5):
+    """
+    The ticks that came later than ``factor`` periods after the previous one.
+
+    :param period: the period of the control loop [s], see ``FlightLog.period``
+    :return: dict with the period, the number of intervals between ticks, how
+             many of them missed the deadline, and the longest one [s]
+    """
+    period = period or log.period(gap)
+    dt     = np.diff(log['t'])
+    dt     = dt[dt <= gap]
+    return { "period"    : period
+           , "intervals" : len(dt)
+           , "missed"    : int(np.count_nonzero(dt > factor * period))
+           , "longest"   : float(dt.max()) if len(dt) else float('nan')
+           }
+
+
+def analyze(log, tolerance = 0.2, period = None, gains = None, gap = 0.5):
+    """
+    Tracking error, settle times, saturation, and deadline misses of a flight log.
+    """
+    error           = tracking_error(log)
+    starts, settled = settle_times(log, tolerance, error, gap)
+    dt              = np.diff(log['t'])
+    return { "rows"       : len(log)
+           , "duration"   : float(np.sum(dt[dt <= gap]))
+           , "segments"   : len(log.segments(gap))
+           , "error"      : { "rms" : float(np.sqrt(np.mean(error ** 2))) if len(error) else float('nan')
+                            , "p95" : float(np.percentile(error, 95))    if len(error) else float('nan')
+                            , "max" : float(error.max())                 if len(error) else float('nan')
+                            }
+           , "waypoints"  : { "starts" : log['t'][starts], "settle" : settled }
+           , "saturation" : saturation(log, gains)
+           , "deadlines"  : deadlines(log, period, gap = gap)
+           }
+
+
+def replay(log, gains = None, period = None, gap = 0.5, chunk = 65536):
+    """
+    Computes the control signals for the logged states and references with the
+    control law and compares them to the recorded ones. The integrated error
+    starts from zero in every segment, like it does when the motors are
+    enabled, and the yaw rate is damped from the recorded one.
+
+    :param log: the ``FlightLog``
+    :param gains: the ``ControlGains``, the defaults of the controller by default
+    :param period: the period of the control loop [s], see ``FlightLog.period``
+    :param gap: see ``FlightLog.segments``
+    :param chunk: how many rows are replayed at once
+    :return: per control signal, the largest and the RMS difference, and the row of the largest
+    """
+    gains  = gains or ControlGains()
+    dt     = period or log.period(gap)
+    starts = log.segments(gap)
+
+    largest  = np.zeros(4)
+    worst    = np.zeros(4, dtype = int)
+    squared  = np.zeros(4)
+    integral = np.zeros(3)
+    for start in range(0, len(log), chunk):
+        stop  = min(start + chunk, len(log))
+        state = ControlState(stop - start)
+        state.pos[:]     = log.stack(['x', 'y', 'z'], start, stop)
+        state.vel[:]     = log.stack(['vx', 'vy', 'vz'], start, stop)
+        state.pos_ref[:] = log.stack(['x_ref', 'y_ref', 'z_ref'], start, stop)
+        recorded         = log.stack(OUTPUTS, start, stop)
+
+        # the integral is a running sum of the errors, restarted with every segment
+        steps  = (state.pos_ref - state.pos) * dt
+        sums   = np.cumsum(np.vstack([integral, steps]), axis = 0)
+        first  = np.zeros(stop - start, dtype = int) - 1
+        inside = starts[(starts >= start) & (starts < stop)] - start
+        first[inside] = inside
+        first  = np.maximum.accumulate(first)
+        base   = np.where((first >= 0)[:, None], sums[np.maximum(first, 0)], 0.0)
+        state.integral[:] = sums[:-1] - base
+        integral = sums[-1] - base[-1]
+
+        # the yaw rate of the previous tick, none when the motors were enabled
+        previous = np.r_[0.0 if start == 0 else log['yawrate_r'][start - 1], recorded[:-1, 2]]
+        previous[inside] = 0.0
+        state.out[:, 2] = previous
+
+        out = control_step(gains, state, dt)
+        # the thrust is sent as an integer
+        np.trunc(out[:, 3], out = out[:, 3])
+
+        difference = np.abs(out - recorded)
+        squared   += np.sum(difference ** 2, axis = 0)
+        rows       = np.argmax(difference, axis = 0)
+        larger     = difference[rows, range(4)] > largest
+        largest[larger] = difference[rows, range(4)][larger]
+        worst[larger]   = rows[larger] + start
+
+    return { name : { "max" : float(largest[i])
+                    , "rms" : float(np.sqrt(squared[i] / len(log))) if len(log) else float('nan')
+                    , "row" : int(worst[i])
+                    }
+             for i, name in enumerate(OUTPUTS)
+           }
+
+
+def _gains(values):
+    """
+    ``ControlGains`` from a list of ``name=value``.
+    """
+    gains = {}
+    for value in values or []:
+        name, _, number = value.partition('=')
+        gains[name] = float(number)
+    return ControlGains(**gains)
+
+
+def _print_analysis(path, report, waypoints):
+    print("{}: {:d} rows, {:.1f}s in {:d} segments".format(path, report["rows"], report["duration"], report["segments"]))
+    error = report["error"]
+    print("  tracking error:  rms {:.3f}m, p95 {:.3f}m, max {:.3f}m".format(error["rms"], error["p95"], error["max"]))
+
+    settle  = report["waypoints"]["settle"]
+    settled = settle[~np.isnan(settle)]
+    print("  waypoints:       {:d}, {:d} settled, median {:.2f}s, max {:.2f}s"
+          .format(len(settle), len(settled), np.median(settled) if len(settled) else float('nan'),
+                  settled.max() if len(settled) else float('nan')))
+    if waypoints:
+        for start, time in zip(report["waypoints"]["starts"], settle):
+            print("    {:10.2f}s: {}".format(start, "not settled" if np.isnan(time) else "settled after {:.2f}s".format(time)))
+
+    print("  saturation:      " + ", ".join("{} {:.1%}".format(name, fraction) for name, fraction in report["saturation"].items()))
+    deadline = report["deadlines"]
+    print("  deadlines:       period {:.1f}ms, {:d} of {:d} missed, longest interval {:.1f}ms"
+          .format(deadline["period"] * 1e3, deadline["missed"], deadline["intervals"], deadline["longest"] * 1e3))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze and replay flight logs')
+    parser.add_argument('action', choices=['convert', 'analyze', 'replay'])
+    parser.add_argument('log', type=str, nargs='+', help='Flight recordings or CSV files')
+    parser.add_argument('--cache', type=str, help='Path of the columnar cache, next to the log by default')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='How close to a waypoint counts as settled [m]')
+    parser.add_argument('--period', type=float, help='Period of the control loop [s], recorded in the log by default')
+    parser.add_argument('--waypoints', action='store_true', help='Print the settle time of every waypoint')
+    parser.add_argument('--gain', type=str, action='append', metavar='NAME=VALUE',
+                        help='Replay with another gain of the control law, e.g. height_integral=0.1')
+    args = parser.parse_args(argv)
+
+    if args.cache and len(args.log) > 1:
+        parser.error('--cache needs a single log')
+
+    gains = _gains(args.gain)
+    for path in args.log:
+        log = FlightLog(path, args.cache)
+        if args.action == 'convert':
+            print("Converted {:d} rows to {}".format(len(log), log.cache))
+        elif args.action == 'analyze':
+            _print_analysis(path, analyze(log, args.tolerance, args.period, gains), args.waypoints)
+        else:
+            print("{}: {:d} rows replayed".format(path, len(log)))
+            for name, difference in replay(log, gains, args.period).items():
+                print("  {:10s} max difference {:10.4f} at row {:d}, rms {:10.4f}"
+                      .format(name, difference["max"], difference["row"], difference["rms"]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+# A flight recorder for the control loop. Rows of fixed width are written into
+# a preallocated ring buffer, which costs the control loop a few assignments
+# per tick. A background thread drains the buffer in blocks into a binary file.
+# If the writer falls behind and the buffer is full, rows are dropped and
+# counted instead of stalling the control loop.
+#
+# File format: MAGIC, the length of the header as uint32, a JSON header with
+# the names of the columns and further metadata, followed by the rows as little-endian float64.
+#
+# Usage:
+#   python -m src.flight_recorder export flightlog_20190101_120000.bin [out.csv]
+
+import argparse
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from threading import Event, Thread
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+MAGIC  = b'CFREC\x00\x01\x00'
+HEADER = struct.Struct('<I')
+
+# the columns the controller records on every tick; the Euler angles of the
+# estimate are not recorded, they follow from the quaternion
+FLIGHT_COLUMNS = ( ['t', 'roll_r', 'pitch_r', 'yawrate_r', 'thrust_r']
+                 + ['x_ref', 'y_ref', 'z_ref', 'yaw_ref']
+                 + ['x', 'y', 'z', 'vx', 'vy', 'vz']
+                 + ['qx', 'qy', 'qz', 'qw']
+                 + ['R{}{}'.format(i, j) for i in range(3) for j in range(3)]
+                 + ['stab_roll', 'stab_pitch', 'stab_yaw']
+                 )
+
+
+class FlightRecorder():
+    """
+    Records rows of float64 values into a ring buffer that is written to a
+    file by a background thread. Rows are recorded by ``claim``ing a row,
+    filling it in place and ``commit``ting it. Only one thread may record.
+    """
+    def __init__(self, path, columns, capacity = 4096, block = 256, interval = 0.5, metadata = None):
+        self.path     = path
+        self.columns  = list(columns)
+        self.buffer   = np.zeros((capacity, len(self.columns)))
+        self.capacity = capacity
+        self.block    = block
+        self.interval = interval
+
+        # rows committed by the control loop and rows written by the writer
+        self.committed = 0
+        self.written   = 0
+        self.dropped   = 0
+
+        self.file = open(path, 'wb')
+        header    = dict(metadata or {}, columns = self.columns, dtype = "<f8", started = time.time())
+        header    = json.dumps(header).encode()
+        self.file.write(MAGIC + HEADER.pack(len(header)) + header)
+
+        self.ready   = Event()
+        self.closed  = False
+        self.writer  = Thread(target = self._write, daemon = True)
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def claim(self):
+        """
+        The next free row of the buffer, to be filled in place.
+
+        :return: the row, or ``None`` if the buffer is full and the row is dropped
+        """
+        if self.committed - self.written >= self.capacity:
+            self.dropped += 1
+            return None
+        return self.buffer[self.committed % self.capacity]
+
+    def commit(self):
+        """
+        Marks the claimed row as complete.
+        """
+        self.committed += 1
+        if self.committed % self.block == 0:
+            self.ready.set()
+
+    def record(self, values):
+        """
+        Records a complete row at once.
+        """
+        row = self.claim()
+        if row is not None:
+            row[:] = values
+            self.commit()
+
+    def close(self):
+        """
+        Writes the remaining rows and closes the file.
+        """
+        self.closed = True
+        self.ready.set()
+        self.writer.join()
+        self.file.close()
+        if self.dropped:
+            log.warning("Flight recorder dropped %d rows.", self.dropped)
+
+    def _drain(self):
+        committed = self.committed
+        while self.written < committed:
+            start = self.written % self.capacity
+            end   = min(self.capacity, start + committed - self.written)
+            self.file.write(self.buffer[start:end].astype('<f8', copy = False).tobytes())
+            self.written += end - start
+        self.file.flush()
+
+    def _write(self):
+        while not self.closed:
+            self.ready.wait(self.interval)
+            self.ready.clear()
+            self._drain()
+        self._drain()
+
+
+def read(path):
+    """
+    Reads a file written by a ``FlightRecorder``.
+
+    :param path:
+    :return: the names of the columns and the rows as a 2D array
+    """
+    with open(path, 'rb') as fh:
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise Exception("{} is not a flight recording.".format(path))
+        size,  = HEADER.unpack(fh.read(HEADER.size))
+        header = json.loads(fh.read(size).decode())
+        rows   = np.fromfile(fh, dtype = header["dtype"])
+
+    columns = header["columns"]
+    # a row that was cut off when recording stopped
+    rows = rows[:len(rows) - len(rows) % len(columns)]
+    return columns, rows.reshape(-1, len(columns))
+
+
+def export_csv(path, csv_path):
+    """
+    Converts a flight recording to CSV with a header line.
+    """
+    columns, rows = read(path)
+    np.savetxt(csv_path, rows, delimiter = ',', header = ','.join(columns), comments = '')
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert flight recordings')
+    parser.add_argument('action', choices=['export'])
+    parser.add_argument('recording', type=str, help='Path to the flight recording')
+    parser.add_argument('csv', type=str, nargs='?', help='Path to the CSV file, next to the recording by default')
+    args = parser.parse_args(argv)
+
+    csv_path = args.csv or os.path.splitext(args.recording)[0] + '.csv'
+    rows     = export_csv(args.recording, csv_path)
+    print("Exported {:d} rows to {}".format(rows, csv_path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
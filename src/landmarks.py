@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+# Landmark (ALT) heuristics for A* on the occupancy grid. The straight-line
+# distance underestimates the cost of a path badly when a wall forces a detour.
+# We compute exact distance fields from a few landmark cells once and store
+# them next to the room specification. For any cell n and target t, the
+# triangle inequality gives |d(L, t) - d(L, n)| <= d(n, t) for every landmark L,
+# which is a much tighter and still admissible estimate.
+#
+# Usage:
+#   python -m src.landmarks build   examples/room_spec_3.yaml
+#   python -m src.landmarks compare examples/room_spec_3.yaml
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+import src.scene_parser as scene_parser
+from src.path import Point, SearchState
+from src.roadmap import specDigest
+
+log = logging.getLogger(__name__)
+
+# bump whenever the file layout or the construction changes
+LANDMARKS_VERSION = 1
+
+
+def landmarksPath(specPath):
+    """
+    The location of the landmarks that belong to a room specification.
+
+    :param specPath: path to the YAML scene specification
+    :return: path to the landmark file next to the specification
+    """
+    return os.path.splitext(specPath)[0] + '.landmarks.npz'
+
+
+class Landmarks():
+    """
+    Distances from a set of landmark cells to all cells of a scene, indexed
+    like the ``SearchGrid`` of the scene.
+    """
+    def __init__(self, cells, distances, shape, resolution, digest):
+        self.cells      = cells
+        self.distances  = distances
+        self.shape      = tuple(shape)
+        self.resolution = resolution
+        self.digest     = digest
+
+    @staticmethod
+    def select(scene, count=8, digest=''):
+        """
+        Chooses landmarks by farthest-point selection: every new landmark is
+        the reachable cell that is farthest from all landmarks chosen so far,
+        so that landmarks end up behind walls and in corners.
+
+        :param scene:
+        :param count: number of landmarks
+        :param digest: fingerprint of the room specification
+        :return: the ``Landmarks``
+        """
+        grid = scene.searchGrid()
+        free = np.flatnonzero(~grid.blocked)
+        if len(free) == 0:
+            raise Exception("Cannot place landmarks in a scene without free space!")
+
+        # the first landmark is the cell farthest from an arbitrary free cell
+        costs     = scene.computeDistanceField(grid.cell(free[0])).costs
+        reachable = np.isfinite(costs)
+        nearest   = np.where(reachable, costs, -1.0)
+
+        cells, distances = [], []
+        for _ in range(min(count, int(reachable.sum()))):
+            cell  = grid.cell(int(np.argmax(nearest)))
+            costs = scene.computeDistanceField(cell).costs
+            cells.append(cell)
+            distances.append(costs)
+            np.minimum(nearest, np.where(reachable, costs, -1.0), out = nearest)
+
+        return Landmarks(cells, np.array(distances), grid.shape, scene.resolution, digest)
+
+    def lowerBounds(self, targetIndex):
+        """
+        The landmark lower bounds for the costs from every cell to the target.
+
+        :param targetIndex: index of the target cell in the ``SearchGrid``
+        :return: array of lower bounds, ``inf`` for cells that cannot reach the target
+        """
+        toTarget = self.distances[:, targetIndex:targetIndex+1]
+        with np.errstate(invalid = 'ignore'):
+            bounds = np.abs(toTarget - self.distances)
+        # neither the cell nor the target can be reached from the landmark
+        bounds[np.isnan(bounds)] = 0.0
+        return bounds.max(axis = 0)
+
+    def matches(self, scene):
+        """
+        Whether the landmarks were computed for the grid of this scene.
+        """
+        return self.shape == scene.searchGrid().shape and self.resolution == scene.resolution
+
+    def save(self, path):
+        """
+        Stores the landmarks in a compressed numpy archive.
+
+        :param path:
+        """
+        with open(path, 'wb') as fh:
+            np.savez_compressed( fh
+                               , version    = LANDMARKS_VERSION
+                               , cells      = np.array(self.cells)
+                               , distances  = self.distances
+                               , shape      = np.array(self.shape)
+                               , resolution = self.resolution
+                               , digest     = self.digest
+                               )
+
+    @staticmethod
+    def load(path):
+        """
+        Loads landmarks that were stored with ``save``.
+
+        :param path:
+        :return: the ``Landmarks``
+        """
+        with np.load(path) as data:
+            if int(data['version']) != LANDMARKS_VERSION:
+                raise Exception("Landmarks {} have an outdated format, please rebuild them.".format(path))
+
+            return Landmarks( [tuple(cell) for cell in data['cells'].tolist()]
+                            , data['distances']
+                            , data['shape'].tolist()
+                            , float(data['resolution'])
+                            , str(data['digest'])
+                            )
+
+
+def load(specPath, scene):
+    """
+    Loads the landmarks stored next to a room specification if they exist
+    and were computed from the current version of the specification.
+
+    :param specPath: path to the YAML scene specification
+    :param scene: the scene the landmarks are used in
+    :return: the ``Landmarks`` or ``None``
+    """
+    path = landmarksPath(specPath)
+    if not os.path.exists(path):
+        return None
+
+    landmarks = Landmarks.load(path)
+    if landmarks.digest != specDigest(specPath) or not landmarks.matches(scene):
+        log.warning('Landmarks %s are outdated, ignoring them.', path)
+        return None
+
+    return landmarks
+
+
+def build(specPath, count=8):
+    """
+    Selects landmarks for a room specification and stores them next to it.
+
+    :param specPath: path to the YAML scene specification
+    :return: the ``Landmarks``
+    """
+    scene     = scene_parser.parse(specPath)
+    landmarks = Landmarks.select(scene, count, digest=specDigest(specPath))
+    landmarks.save(landmarksPath(specPath))
+    return landmarks
+
+
+def compare(specPath, queries=20, seed=1):
+    """
+    Runs random queries with and without landmarks and reports how many
+    cells A* expands and how long it takes.
+    """
+    scene     = scene_parser.parse(specPath)
+    landmarks = load(specPath, scene)
+    if landmarks is None:
+        print("No up-to-date landmarks for {}.".format(specPath))
+        return False
+
+    grid  = scene.searchGrid()
+    state = SearchState(scene)
+    free  = np.flatnonzero(~grid.blocked)
+    rng   = np.random.RandomState(seed)
+
+    results = { "euclidean" : ([], []), "landmarks" : ([], []) }
+    for _ in range(queries):
+        startCell, targetCell = (grid.cell(int(i)) for i in rng.choice(free, 2))
+        target = scene.getPoint(targetCell)
+
+        for name, heuristic in [("euclidean", None), ("landmarks", landmarks)]:
+            scene.landmarks = heuristic
+            searchStart = time.perf_counter()
+            try:
+                scene.search(startCell, targetCell, target, state)
+            except Exception:
+                pass
+            results[name][0].append(state.expansions)
+            results[name][1].append(time.perf_counter() - searchStart)
+
+    for name, (expansions, durations) in results.items():
+        print("{:10s} expanded cells: median {:7.0f}, total {:8d}; search time: median {:.3f}s"
+              .format(name, np.median(expansions), int(np.sum(expansions)), np.median(durations)))
+
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build and compare landmark heuristics for room specifications')
+    parser.add_argument('action', choices=['build', 'compare'])
+    parser.add_argument('room_spec', type=str, help='Path to the room specification file')
+    parser.add_argument('-n', '--count', type=int, default=8,
+                        help='Number of landmarks')
+    parser.add_argument('-q', '--queries', type=int, default=20,
+                        help='Number of random queries to run when comparing')
+    args = parser.parse_args(argv)
+
+    if args.action == 'build':
+        buildStart = time.time()
+        landmarks = build(args.room_spec, count=args.count)
+        print("Selected {:d} landmarks in {:.2f}s: {}"
+              .format(len(landmarks.cells), time.time() - buildStart, landmarksPath(args.room_spec)))
+        return 0
+
+    return 0 if compare(args.room_spec, queries=args.queries) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+# Logging for all modules, without blocking the control loop or the planner.
+#
+# Every module logs to its own logger, ``logging.getLogger(__name__)``, and
+# levels can be set per module. The loggers hand records to a queue, and a
+# listener thread formats and writes them, so a slow terminal never stalls the
+# caller. Messages are formatted lazily, ``log.debug("path: %s", path)``, and
+# a disabled level costs a level check; values that only exist to be logged
+# are computed behind ``log.isEnabledFor``. Call sites that could flood the
+# log limit themselves with ``extra = every(seconds)``; what they drop is
+# counted and reported with their next message. Call sites whose values are
+# expensive to compute check a ``Throttle`` first instead.
+#
+# Processes that are forked after ``setup`` start their own listener.
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+FORMAT = '[%(level)-5s] %(name)s: %(message)s'
+
+# the names of the levels as they were always printed
+LEVEL_NAMES = { logging.WARNING : 'WARN', logging.CRITICAL : 'FATAL' }
+
+_listener = None
+_handler  = None
+
+
+def every(seconds):
+    """
+    The ``extra`` of a call site that logs at most once per ``seconds``.
+    """
+    return { "every" : seconds }
+
+
+class RateLimit(logging.Filter):
+    """
+    Drops records of a call site that come sooner than its interval after the
+    last record it let through, and counts them.
+    """
+    def __init__(self, clock = time):
+        super(RateLimit, self).__init__()
+        self.clock = clock
+        self.lock  = threading.Lock()
+        # (file, line) -> (time of the last record, dropped since)
+        self.sites = {}
+
+    def filter(self, record):
+        interval = getattr(record, 'every', None)
+        if not interval:
+            return True
+
+        now  = self.clock.monotonic()
+        site = (record.pathname, record.lineno)
+        with self.lock:
+            last, dropped = self.sites.get(site, (None, 0))
+            if last is not None and now - last < interval:
+                self.sites[site] = (last, dropped + 1)
+                return False
+            self.sites[site] = (now, 0)
+        record.suppressed = dropped
+        return True
+
+
+class Throttle():
+    """
+    The rate limit of one call site, checked before its message is computed::
+
+        if log.isEnabledFor(logging.DEBUG) and throttle.due():
+            log.debug("state: %s", expensive(), extra = throttle.extra())
+    """
+    def __init__(self, seconds, clock = time):
+        self.seconds = seconds
+        self.clock   = clock
+        self.last    = None
+        self.dropped = 0
+
+    def due(self):
+        """
+        Whether the interval has passed since the last message, otherwise the
+        message is counted as dropped.
+        """
+        now = self.clock.monotonic()
+        if self.last is not None and now - self.last < self.seconds:
+            self.dropped += 1
+            return False
+        self.last = now
+        return True
+
+    def extra(self):
+        """
+        The ``extra`` of the message, which reports the dropped ones.
+        """
+        dropped, self.dropped = self.dropped, 0
+        return { "suppressed" : dropped }
+
+
+class Formatter(logging.Formatter):
+    def __init__(self, fmt = FORMAT):
+        super(Formatter, self).__init__(fmt)
+
+    def format(self, record):
+        record.level = LEVEL_NAMES.get(record.levelno, record.levelname)
+        message = super(Formatter, self).format(record)
+        if getattr(record, 'suppressed', 0):
+            message += ' ({:d} similar messages suppressed)'.format(record.suppressed)
+        return message
+
+
+def parse_levels(values):
+    """
+    Levels from a list of ``LEVEL`` or ``MODULE=LEVEL``, e.g.
+    ``['INFO', 'src.path=DEBUG']``.
+
+    :return: the level of the root logger, or ``None``, and a dict of the others
+    """
+    level, levels = None, {}
+    for value in values or []:
+        name, _, number = value.rpartition('=')
+        number = number.upper()
+        if not isinstance(logging.getLevelName(number), int):
+            raise Exception("Unknown log level: {}".format(value))
+        if name:
+            levels[name] = number
+        else:
+            level = number
+    return level, levels
+
+
+def setup(level = 'INFO', levels = None, stream = None):
+    """
+    Sends the records of all loggers through a queue to a listener thread
+    that writes them to a stream. Can be called again to change the levels.
+
+    :param level: the level of all loggers without their own
+    :param levels: optional dict from logger names, e.g. ``'src.path'``, to their levels
+    :param stream: where the records are written, ``sys.stderr`` by default
+    """
+    global _listener, _handler
+    stop()
+
+    target = logging.StreamHandler(stream or sys.stderr)
+    target.setFormatter(Formatter())
+
+    records  = queue.SimpleQueue()
+    _handler = logging.handlers.QueueHandler(records)
+    # the message is merged with its arguments when the record is queued,
+    # since they may change afterwards; the listener formats the rest
+    _handler.addFilter(RateLimit())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_handler)
+    root.setLevel(level or 'INFO')
+    for name, value in (levels or {}).items():
+        logging.getLogger(name).setLevel(value)
+
+    _listener = logging.handlers.QueueListener(records, target, respect_handler_level = True)
+    _listener.start()
+
+
+def stop():
+    """
+    Writes the records that are left and stops the listener.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _forked():
+    # the listener thread is not forked along; the child writes its own records
+    global _listener
+    if _listener is not None:
+        records        = queue.SimpleQueue()
+        _handler.queue = records
+        _listener      = logging.handlers.QueueListener(records, *_listener.handlers, respect_handler_level = True)
+        _listener.start()
+
+
+atexit.register(stop)
+os.register_at_fork(after_in_child = _forked)
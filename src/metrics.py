@@ -0,0 +1,218 @@
+# Lightweight metrics for the real-time parts of the platform.
+#
+# A histogram counts observations in fixed buckets, so that recording a value
+# costs a binary search and an increment, and distributions can be queried
+# while they are being recorded. A registry names the metrics of a process and
+# renders them in the Prometheus text format, for ``GET /metrics``.
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+
+class Histogram():
+    """
+    Counts observations in buckets with the given upper bounds; values above
+    the last bound go into an overflow bucket.
+    """
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.reset()
+
+    @staticmethod
+    def exponential(start, factor, count):
+        """
+        A histogram with ``count`` bucket bounds growing from ``start`` by ``factor``.
+        """
+        return Histogram([start * factor**i for i in range(count)])
+
+    @staticmethod
+    def linear(start, width, count):
+        """
+        A histogram with ``count`` bucket bounds ``width`` apart from ``start``.
+        """
+        return Histogram([start + width * i for i in range(count)])
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count  = 0
+        self.total  = 0.0
+        self.min    = float('inf')
+        self.max    = float('-inf')
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count else float('nan')
+
+    def quantile(self, q):
+        """
+        Estimates a quantile as the upper bound of the bucket it falls into.
+
+        :param q: between 0 and 1
+        :return: the estimate, ``max`` if it falls into the overflow bucket
+        """
+        if self.count == 0:
+            return float('nan')
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        Summary statistics and the bucket counts.
+        """
+        return { "count"   : self.count
+               , "mean"    : self.mean()
+               , "min"     : self.min if self.count else float('nan')
+               , "max"     : self.max if self.count else float('nan')
+               , "p50"     : self.quantile(0.5)
+               , "p99"     : self.quantile(0.99)
+               , "buckets" : list(zip(self.bounds + [float('inf')], self.counts))
+               }
+
+
+class Registry():
+    """
+    The metrics of a process by name, rendered in the Prometheus text format.
+    Histograms are registered as they are, so recording a value costs no more
+    than without the registry; gauges and counters are functions that are
+    called when the metrics are scraped.
+    """
+    def __init__(self):
+        # name -> (type, help, {labels : source})
+        self.metrics = {}
+        self.lock    = Lock()
+
+    def _register(self, kind, name, help, source, labels):
+        with self.lock:
+            _, _, sources = self.metrics.setdefault(name, (kind, help, {}))
+            sources[tuple(sorted(labels.items()))] = source
+        return source
+
+    def histogram(self, name, help, histogram, **labels):
+        """
+        Registers a ``Histogram``.
+
+        :return: the histogram
+        """
+        return self._register("histogram", name, help, histogram, labels)
+
+    def gauge(self, name, help, function, **labels):
+        """
+        Registers a function that returns the current value.
+        """
+        return self._register("gauge", name, help, function, labels)
+
+    def counter(self, name, help, function, **labels):
+        """
+        Registers a function that returns a value that only increases.
+        """
+        return self._register("counter", name, help, function, labels)
+
+    def render(self):
+        """
+        All metrics in the Prometheus text format.
+        """
+        with self.lock:
+            metrics = [(name, kind, help, dict(sources)) for name, (kind, help, sources) in sorted(self.metrics.items())]
+
+        lines = []
+        for name, kind, help, sources in metrics:
+            lines.append("# HELP {} {}".format(name, help))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for labels, source in sources.items():
+                if kind != "histogram":
+                    lines.append("{}{} {}".format(name, _labels(labels), _number(source())))
+                    continue
+
+                counts = list(source.counts)
+                total  = 0
+                for bound, count in zip(source.bounds + [float('inf')], counts):
+                    total += count
+                    lines.append("{}_bucket{} {}".format(name, _labels(labels + (("le", _number(bound)),)), total))
+                lines.append("{}_sum{} {}".format(name, _labels(labels), _number(source.total)))
+                lines.append("{}_count{} {}".format(name, _labels(labels), total))
+        return "\n".join(lines) + "\n"
+
+
+def queue_depth(queue):
+    """
+    A gauge function for the number of items in a queue. A multiprocessing
+    queue cannot tell its size on macOS, its depth is NaN there.
+    """
+    def depth():
+        try:
+            return queue.qsize()
+        except NotImplementedError:
+            return float('nan')
+    return depth
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, value) for key, value in labels) + "}"
+
+
+def _number(value):
+    value = float(value)
+    if value != value:
+        return "NaN"
+    if value in (float('inf'), float('-inf')):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        reply(self, self.server.registry)
+
+    def log_message(self, *args):
+        pass
+
+
+def reply(handler, registry):
+    """
+    Answers a request of an HTTP handler with the metrics of a registry.
+    """
+    body = registry.render().encode()
+    handler.send_response(200)
+    handler.send_header('Content-type', 'text/plain; version=0.0.4')
+    handler.send_header('Content-Length', str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+def serve(port, registry = None, hostname = "0.0.0.0"):
+    """
+    Serves ``GET /metrics`` from a background thread.
+
+    :param registry: the ``Registry``, the one of the process by default
+    :return: the server
+    """
+    server = ThreadingHTTPServer((hostname, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry       = REGISTRY if registry is None else registry
+    Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+
+# the metrics of the process; the servers, which run in processes of their
+# own, keep theirs in their own registries
+REGISTRY = Registry()
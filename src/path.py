@@ -6,15 +6,28 @@
 #
 # Author: Christopher Blöcker
 
+import logging
 import numpy as np
 
+from collections import OrderedDict
+from math import sqrt
+
 from src.redblack import *
 
+log = logging.getLogger(__name__)
+
 # functions for tuple projections
 fst = lambda p: p[0]
 snd = lambda p: p[1]
 
 
+class PlanningCancelled(Exception):
+    """
+    Raised when a planning request is cancelled while it is being planned.
+    """
+    pass
+
+
 class Point():
     """
     A 3D point
@@ -68,6 +81,14 @@ class Object(ABC):
         """
         raise Exception("contains not implemented.")
 
+    def boundingBox(self):
+        """
+        The axis-aligned box that encloses the object.
+
+        :return: the lower and upper corner as numpy arrays
+        """
+        raise Exception("boundingBox not implemented.")
+
 
 class Scale(Object):
     """
@@ -94,6 +115,11 @@ class Scale(Object):
 
         return self.scaledObject.contains(scaledPoint)
 
+    def boundingBox(self):
+        lower, upper = self.scaledObject.boundingBox()
+        scale = np.r_[self.scaleX, self.scaleY, self.scaleZ]
+        return lower * scale, upper * scale
+
 
 class Translate(Object):
     """
@@ -120,6 +146,11 @@ class Translate(Object):
 
         return self.translatedObject.contains(translatedPoint)
 
+    def boundingBox(self):
+        lower, upper = self.translatedObject.boundingBox()
+        translation = np.r_[self.translateX, self.translateY, self.translateZ]
+        return lower + translation, upper + translation
+
 
 class Cube(Object):
     """
@@ -140,6 +171,161 @@ class Cube(Object):
            and 0 <= point.y <= 1 \
            and 0 <= point.z <= 1
 
+    def boundingBox(self):
+        return np.zeros(3), np.ones(3)
+
+
+class SearchGrid():
+    """
+    The occupancy grid of a scene prepared for searching. Cells are addressed
+    by a single index into a grid that is padded with one layer of occupied
+    cells, so that neighbours never have to be checked against the bounds.
+    """
+    def __init__(self, scene):
+        x, y, z     = scene.space.shape
+        self.shape  = (x + 2, y + 2, z + 2)
+
+        padded = np.ones(self.shape, dtype = bool)
+        padded[1:-1, 1:-1, 1:-1] = scene.space
+        self.blocked = padded.ravel()
+        self.free    = (~self.blocked).tolist()
+
+        # centres of the grid cells
+        i, j, k      = np.indices(self.shape)
+        self.centres = (np.stack([i.ravel(), j.ravel(), k.ravel()], axis = 1) - 0.5) * scene.resolution
+        self.xs      = self.centres[:, 0].tolist()
+        self.ys      = self.centres[:, 1].tolist()
+        self.zs      = self.centres[:, 2].tolist()
+
+        # index offsets to the 26 neighbours of a cell and the distances to them
+        self.neighbours = [ ( (dx * self.shape[1] + dy) * self.shape[2] + dz
+                            , scene.resolution * sqrt(dx*dx + dy*dy + dz*dz)
+                            )
+                            for dx in [-1, 0, 1]
+                            for dy in [-1, 0, 1]
+                            for dz in [-1, 0, 1]
+                            if (dx, dy, dz) != (0, 0, 0)
+                          ]
+
+    def index(self, cell):
+        return ((cell[0] + 1) * self.shape[1] + cell[1] + 1) * self.shape[2] + cell[2] + 1
+
+    def cell(self, index):
+        rest, k = divmod(index, self.shape[2])
+        i, j    = divmod(rest, self.shape[1])
+        return (i - 1, j - 1, k - 1)
+
+    def point(self, index):
+        return Point(self.xs[index], self.ys[index], self.zs[index])
+
+
+class DistanceField():
+    """
+    The costs of the cheapest paths from one start cell to all cells of a scene
+    and the predecessors along these paths. Once computed, a path from the
+    start to any target is found by following the predecessors, without search.
+    Cells are indexed like in the ``SearchGrid``.
+    """
+    def __init__(self, startCell, shape, resolution, costs, cameFrom, version):
+        self.startCell  = startCell
+        self.shape      = shape
+        self.resolution = resolution
+        self.costs      = costs
+        self.cameFrom   = cameFrom
+        self.version    = version
+
+    def index(self, cell):
+        return ((cell[0] + 1) * self.shape[1] + cell[1] + 1) * self.shape[2] + cell[2] + 1
+
+    def point(self, index):
+        rest, k = divmod(int(index), self.shape[2])
+        i, j    = divmod(rest, self.shape[1])
+        return Point((i - 0.5) * self.resolution, (j - 0.5) * self.resolution, (k - 0.5) * self.resolution)
+
+    def costTo(self, cell):
+        """
+        The cost of the cheapest path to a cell, ``inf`` if it cannot be reached.
+        """
+        return self.costs[self.index(cell)]
+
+    def pathTo(self, targetCell, target):
+        """
+        Follows the predecessors from the target back to the start.
+
+        :param targetCell:
+        :param target: the exact target point, which ends the path
+        :return: the path through the centres of the grid cells
+        """
+        endpoint = self.index(targetCell)
+        if not np.isfinite(self.costs[endpoint]):
+            raise Exception("Cannot find a path to target!")
+
+        path = [ target
+               , self.point(endpoint)
+               ]
+
+        while endpoint != self.cameFrom[endpoint]:
+            endpoint = self.cameFrom[endpoint]
+            path.append(self.point(endpoint))
+        return path[::-1]
+
+
+class SearchState():
+    """
+    Memory for searches on a ``SearchGrid``. Instead of allocating new
+    dictionaries for every search, costs and predecessors are kept in arrays
+    that are invalidated by increasing a generation counter, so consecutive
+    searches, like the legs of a mission, reuse them.
+    """
+    def __init__(self, scene):
+        size = len(scene.searchGrid().free)
+
+        self.generation = 0
+        self.expansions = 0
+        self.costs      = [0.0] * size
+        self.cameFrom   = [0] * size
+        self.seen       = [0] * size
+        self.explored   = [0] * size
+
+    def reset(self):
+        self.generation += 1
+        self.expansions  = 0
+
+
+def orderTargets(start, targets):
+    """
+    Orders targets into a short tour from the start: nearest neighbour
+    followed by 2-opt improvements, on straight-line distances.
+
+    :param start:
+    :param targets:
+    :return: the indices of the targets in the order they should be visited
+    """
+    points = [start] + list(targets)
+    order  = [0]
+    left   = set(range(1, len(points)))
+
+    while left:
+        nearest = min(left, key = lambda i: points[order[-1]].distanceTo(points[i]))
+        order.append(nearest)
+        left.remove(nearest)
+
+    distance = lambda a, b: points[order[a]].distanceTo(points[order[b]])
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(order) - 1):
+            for j in range(i + 1, len(order)):
+                # reverse order[i..j]; the tour is open, so there is no edge after the last target
+                before = distance(i - 1, i) + (distance(j, j + 1) if j + 1 < len(order) else 0)
+                after  = distance(i - 1, j) + (distance(i, j + 1) if j + 1 < len(order) else 0)
+                if after < before - 1e-9:
+                    order[i:j+1] = order[i:j+1][::-1]
+                    improved = True
+
+    return [i - 1 for i in order[1:]]
+
 
 class Scene():
     """
@@ -148,9 +334,28 @@ class Scene():
     regular cartesian grid according to the given resolution. The space is sampled
     and occupied grid cells are marked.
     """
-    def __init__(self, dimX, dimY, dimZ, resolution, obstacles):
+    def __init__(self, dimX, dimY, dimZ, resolution, obstacles, space = None):
       self.resolution = resolution
+      self.dimensions = (dimX, dimY, dimZ)
       self.bounds     = Scale(Cube(), dimX, dimY, dimZ)
+      self.obstacles  = obstacles
+
+      # built on demand for searching, dropped when the scene changes
+      self.version     = 0
+      self._searchGrid = None
+      self._fields     = OrderedDict()
+
+      # optional distances from landmark cells for a better A* heuristic,
+      # see ``src.landmarks``
+      self.landmarks   = None
+
+      # how many cells the last plan expanded
+      self.expansions  = 0
+
+      # an already sampled grid, e.g. one that lives in shared memory
+      if space is not None:
+          self.space = space
+          return
 
       # number of grid cells in each direction
       x = int(dimX / resolution)
@@ -158,7 +363,7 @@ class Scene():
       z = int(dimZ / resolution)
 
       # to store which cells are occupied
-      self.space = np.zeros((x, y, z))
+      self.space = np.zeros((x, y, z), dtype = bool)
 
       # Build the scene according to the given resolution and sample the space to
       # represent it as a 3D array with boolean values where True means that the
@@ -188,96 +393,290 @@ class Scene():
                , int(point.z  / self.resolution)
                )
 
-    def planPath(self, start, target):
+    def searchGrid(self):
         """
-        Use A* to plan a path from start to target and avoids the obstacles in the scene.
+        The grid that searches run on. It is built on first use and shared by
+        all searches in the scene.
+
+        :return: the ``SearchGrid``
+        """
+        if self._searchGrid is None:
+            self._searchGrid = SearchGrid(self)
+        return self._searchGrid
+
+    def updateSpace(self, space):
+        """
+        Replaces the occupancy grid, e.g. when obstacles have moved, and
+        invalidates everything that was derived from the old one.
+
+        :param space:
+        """
+        self.space       = space
+        self.version    += 1
+        self._searchGrid = None
+        self.landmarks   = None
+        self._fields.clear()
+
+    def computeDistanceField(self, startCell, cancelled = None):
+        """
+        Computes the costs of the cheapest paths from the start cell to all
+        cells of the scene. Instead of a Dijkstra search cell by cell, the
+        costs of all cells are relaxed over all neighbours at once until they
+        do not change anymore, which gives the same costs.
+
+        :param startCell:
+        :param cancelled: optional function, polled after every sweep, that
+                          tells whether to give up with ``PlanningCancelled``
+        :return: the ``DistanceField``
+        """
+        grid  = self.searchGrid()
+        size  = len(grid.blocked)
+        free  = ~grid.blocked
+        start = grid.index(startCell)
+
+        costs        = np.full(size, np.inf)
+        costs[start] = 0.0
+        candidates   = np.empty(size)
+
+        changed = True
+        while changed:
+            if cancelled is not None and cancelled():
+                raise PlanningCancelled("Distance field computation was cancelled.")
+
+            previous = costs.copy()
+            for offset, step in grid.neighbours:
+                if offset > 0:
+                    np.add(costs[offset:], step, out = candidates[:-offset])
+                    np.minimum(costs[:-offset], candidates[:-offset], out = costs[:-offset], where = free[:-offset])
+                else:
+                    np.add(costs[:offset], step, out = candidates[-offset:])
+                    np.minimum(costs[-offset:], candidates[-offset:], out = costs[-offset:], where = free[-offset:])
+            changed = not np.array_equal(previous, costs)
+
+        # the predecessor of a cell is the neighbour it is reached from most cheaply
+        via = np.full((len(grid.neighbours), size), np.inf)
+        for n, (offset, step) in enumerate(grid.neighbours):
+            if offset > 0:
+                via[n, :-offset] = costs[offset:] + step
+            else:
+                via[n, -offset:] = costs[:offset] + step
+        offsets  = np.array([offset for offset, _ in grid.neighbours])
+        cameFrom = np.arange(size) + offsets[np.argmin(via, axis = 0)]
+        cameFrom[~np.isfinite(costs)] = -1
+        cameFrom[start] = start
+
+        return DistanceField(startCell, grid.shape, self.resolution, costs, cameFrom, self.version)
+
+    def distanceField(self, start, cached = 8, cancelled = None):
+        """
+        The distance field from the cell of the start point. The most recently
+        used fields are cached per start cell until the scene changes.
 
         :param start:
+        :param cached: how many fields to keep
+        :param cancelled: see ``computeDistanceField``
+        :return: the ``DistanceField``
+        """
+        startCell = self.checkPoint(start, "Start")
+
+        if startCell in self._fields:
+            self._fields.move_to_end(startCell)
+            return self._fields[startCell]
+
+        field = self.computeDistanceField(startCell, cancelled)
+        self._fields[startCell] = field
+        while len(self._fields) > cached:
+            self._fields.popitem(last = False)
+        return field
+
+    def planFromField(self, field, target):
+        """
+        Plans a path from the start of a distance field to the target by
+        following the predecessors in the field.
+
+        :param field: the ``DistanceField``
         :param target:
         :return:
         """
-        # the start point must be within the scene
-        if not self.bounds.contains(start):
-            raise Exception("Start ({:.2f}, {:.2f}, {:.2f}) is out of bounds!".format(start.x, start.y, start.z))
+        if field.version != self.version:
+            raise Exception("The distance field is outdated!")
 
-        # the target point must be within the scene
-        if not self.bounds.contains(target):
-            raise Exception("Target ({:.2f}, {:.2f}, {:.2f}) is out of bounds!".format(target.x, target.y, target.z))
+        targetCell = self.checkPoint(target, "Target")
+        return self.postprocessPath(field.pathTo(targetCell, target))
+
+    def checkPoint(self, point, name):
+        """
+        Makes sure that a point can be used as start or target of a path.
+
+        :param point:
+        :param name: how to refer to the point in error messages
+        :return: the grid cell of the point
+        """
+        # the point must be within the scene
+        if not self.bounds.contains(point):
+            raise Exception("{} ({:.2f}, {:.2f}, {:.2f}) is out of bounds!".format(name, point.x, point.y, point.z))
 
+        # the point must not lie within an obstacle
+        cell = self.getCoordinate(point)
+        if self.space[cell[0], cell[1], cell[2]]:
+            raise Exception("{} {} point lies within an obstacle!".format(name, self.getPoint(cell)))
+
+        return cell
+
+    def planPath(self, start, target, cancelled = None):
+        """
+        Use A* to plan a path from start to target and avoids the obstacles in the scene.
+
+        :param start:
+        :param target:
+        :param cancelled: optional function that is polled during the search and
+                          returns ``True`` if the result is not needed anymore
+        :return:
+        """
         # the grid cells corresponding to start and target
-        startCell  = self.getCoordinate(start)
-        targetCell = self.getCoordinate(target)
+        startCell  = self.checkPoint(start,  "Start")
+        targetCell = self.checkPoint(target, "Target")
 
-        # the start point must not lie within an obstacle
-        if self.space[startCell[0], startCell[1], startCell[2]]:
-            raise Exception("Start {} point lies within an obstacle!".format(self.getPoint(startCell)))
+        state = SearchState(self)
+        path  = self.search(startCell, targetCell, target, state, cancelled)
+        self.expansions = state.expansions
+        return self.postprocessPath(path)
 
-        # the target point must not lie within an obstacle
-        if self.space[targetCell[0], targetCell[1], targetCell[2]]:
-            raise Exception("Target {} point lies within an obstacle!".format(self.getPoint(startCell)))
+    def planMission(self, start, targets, reorder = False, cancelled = None):
+        """
+        Plans a path from start through a sequence of targets. All legs share
+        the same search memory.
 
-        # explored and unexplored cells
-        explored   = set()
-        unexplored = { startCell : 0 }
+        :param start:
+        :param targets: list of targets
+        :param reorder: whether the targets may be visited in any order, in
+                        which case a short tour is chosen
+        :param cancelled: see ``planPath``
+        :return: the path and the order in which the targets are visited
+        """
+        if len(targets) == 0:
+            raise Exception("A mission needs at least one target!")
 
-        # a queue of cells to retrieve that cell with expected lowest cost
-        queue      = Empty(key = snd).insert((startCell, start.distanceTo(target)))
+        startCell = self.checkPoint(start, "Start")
+        cells     = [self.checkPoint(target, "Target") for target in targets]
+        order     = orderTargets(start, targets) if reorder else list(range(len(targets)))
+        state     = SearchState(self)
+        path      = []
 
-        # for reconstructing the path, stores the predecessor of cells along the cheapest path
-        cameFrom   = { startCell : startCell }
+        self.expansions = 0
+        for i in order:
+            leg = self.search(startCell, cells[i], targets[i], state, cancelled)
+            self.expansions += state.expansions
+
+            # the leg starts in the cell of the previous target, which we just reached
+            path.extend(leg if not path else leg[1:])
+            startCell = cells[i]
+
+        return self.postprocessPath(path), order
+
+    def estimates(self, targetIndex, target):
+        """
+        Lower bounds for the costs from every cell to the target: the
+        straight-line distance and, if the scene has landmarks, the bounds
+        that the landmarks give through the triangle inequality.
+
+        :param targetIndex: index of the target cell in the ``SearchGrid``
+        :param target: the exact target point
+        :return: list of estimates, indexed like the ``SearchGrid``
+        """
+        grid      = self.searchGrid()
+        estimates = np.sqrt(((grid.centres - (target.x, target.y, target.z))**2).sum(axis = 1))
 
-        # costs to get to the grid cells
-        costs      = { startCell : 0 }
+        if self.landmarks is not None:
+            np.maximum(estimates, self.landmarks.lowerBounds(targetIndex), out = estimates)
+
+        return estimates.tolist()
+
+    def search(self, startCell, targetCell, target, state, cancelled = None):
+        """
+        A* from the start cell to the target cell.
+
+        :param startCell:
+        :param targetCell:
+        :param target: the exact target point, which ends the path
+        :param state: the ``SearchState`` to use
+        :param cancelled: see ``planPath``
+        :return: the path through the centres of the grid cells
+        """
+        grid = self.searchGrid()
+        state.reset()
+
+        generation = state.generation
+        costs      = state.costs
+        cameFrom   = state.cameFrom
+        seen       = state.seen
+        explored   = state.explored
+        free       = grid.free
+        neighbours = grid.neighbours
+
+        startIndex  = grid.index(startCell)
+        targetIndex = grid.index(targetCell)
+        estimates   = self.estimates(targetIndex, target)
+
+        costs[startIndex]    = 0.0
+        cameFrom[startIndex] = startIndex
+        seen[startIndex]     = generation
+
+        # a queue of cells to retrieve that cell with expected lowest cost
+        queue = Empty(key = snd).insert((startIndex, 0.0))
+
+        expansions = 0
 
         # continue planning as long as we have unexplored grid cells left
-        while len(unexplored) > 0:
-            (current, currentCost), queue = queue.popMin()
-            while current not in unexplored:
-                (current, _), queue = queue.popMin()
-            unexplored.pop(current)
-            explored.add(current)
+        while not queue.isEmpty():
+            (current, _), queue = queue.popMin()
+            if explored[current] == generation:
+                continue
+            explored[current] = generation
+
+            expansions += 1
+            if cancelled is not None and expansions % 256 == 0 and cancelled():
+                raise PlanningCancelled("Planning to {} was cancelled.".format(target))
 
             # we found a path!
-            if current == targetCell:
-                return self.postprocessPath(self.reconstructPath(cameFrom, current, target))
+            if current == targetIndex:
+                state.expansions = expansions
+                return self.reconstructPath(cameFrom, current, target)
 
-            p = self.getPoint(current)
+            currentCost = costs[current]
 
-            for dx in [-1, 0, 1]:
-                for dy in [-1, 0, 1]:
-                    for dz in [-1, 0, 1]:
-                        x = current[0] + dx
-                        y = current[1] + dy
-                        z = current[2] + dz
+            for offset, step in neighbours:
+                neighbour = current + offset
 
-                        q = self.getPoint((x, y, z))
+                if free[neighbour] and explored[neighbour] != generation:
+                    cost = currentCost + step
 
-                        if (x, y, z) not in explored and self.bounds.contains(q) and not self.space[x, y, z]:
-                            cost = currentCost + p.distanceTo(q)
+                    if seen[neighbour] != generation or cost < costs[neighbour]:
+                        seen[neighbour]     = generation
+                        costs[neighbour]    = cost
+                        cameFrom[neighbour] = current
 
-                            if (x, y, z) not in unexplored or cost < unexplored[(x, y, z)]:
-                                queue = queue.insert(((x, y, z), cost + q.distanceTo(target)))
-                                unexplored[(x, y, z)] = cost
-                                cameFrom[(x, y, z)]   = current
-                                costs[(x, y, z)]      = cost
+                        queue = queue.insert((neighbour, cost + estimates[neighbour]))
 
+        state.expansions = expansions
         raise Exception("Cannot find a path to target!")
 
     def reconstructPath(self, cameFrom, endpoint, target):
         """
 
-        :param cameFrom:
+        :param cameFrom: the predecessors of the grid cells along the cheapest path
         :param endpoint:
         :param target:
         :return:
         """
+        grid = self.searchGrid()
         path = [ target
-               , self.getPoint(endpoint)
+               , grid.point(endpoint)
                ]
 
         while endpoint != cameFrom[endpoint]:
             endpoint = cameFrom[endpoint]
-            path.append(self.getPoint(endpoint))
+            path.append(grid.point(endpoint))
         return path[::-1]
 
     def planLanding(self, start):
@@ -286,18 +685,15 @@ class Scene():
         :param start:
         :return:
         """
-        print("[DEBUG] planning landing...")
-
         currentCell = self.getCoordinate(start)
         landingPath = [start]
-        print("[DEBUG] landing waypoint: {}".format(currentCell))
 
         # descend
         while not self.space[currentCell[0], currentCell[1], currentCell[2]] and currentCell[2] > 0:
-            print("[DEBUG] landing waypoint: {}".format(currentCell))
             currentCell = (currentCell[0], currentCell[1], currentCell[2] - 1)
             landingPath.append(self.getPoint(currentCell))
 
+        log.debug("Landing path: %s", landingPath)
         return landingPath
 
     def postprocessPath(self, path):
@@ -314,8 +710,7 @@ class Scene():
 
         reducedPath.append(path[-1])
 
-        print("[DEBUG] Original path: {}".format(path))
-        print("[DEBUG] Reduced path: {}".format(reducedPath))
+        log.debug("Reduced path of %d to %d waypoints: %s", len(path), len(reducedPath), reducedPath)
 
         return reducedPath
 
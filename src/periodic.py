@@ -0,0 +1,117 @@
+# A drift-free periodic scheduler for real-time loops.
+#
+# Deadlines are absolute multiples of the period on the monotonic clock, so
+# errors in one tick do not accumulate and wall-clock jumps have no effect.
+# The scheduler sleeps until shortly before the deadline and busy-waits for
+# the rest, because sleeping is only accurate to a fraction of a millisecond.
+# Periods, jitter, and overruns are recorded in histograms that can be
+# queried while the loop runs.
+
+import time
+
+from src.metrics import Histogram
+
+# what to do after a deadline was missed
+CATCH_UP = "catch_up"  # run the missed ticks back to back
+SKIP     = "skip"      # skip missed ticks, stay on the original grid of deadlines
+RESET    = "reset"     # start a new grid of deadlines from now
+
+
+class PeriodicScheduler():
+    """
+    Paces a loop that calls ``wait`` at the end of every tick.
+    """
+    def __init__(self, period, busy_wait = 0.0005, policy = SKIP, clock = time):
+        """
+        :param period: in seconds
+        :param busy_wait: how long before a deadline to stop sleeping, in seconds
+        :param policy: ``CATCH_UP``, ``SKIP``, or ``RESET``
+        :param clock: provides ``monotonic_ns`` and ``sleep``, the ``time`` module by default
+        """
+        if policy not in (CATCH_UP, SKIP, RESET):
+            raise Exception("Unknown catch-up policy: {}".format(policy))
+
+        self.period_ns    = int(round(period * 1e9))
+        self.busy_wait_ns = int(round(busy_wait * 1e9))
+        self.policy       = policy
+        self.clock        = clock
+
+        # in milliseconds
+        period_ms    = period * 1e3
+        self.periods  = Histogram.linear(0.5 * period_ms, 0.02 * period_ms, 51)
+        self.jitter   = Histogram.exponential(0.001, 2, 16)
+        self.overruns = Histogram.exponential(0.01, 2, 16)
+
+        self.ticks    = 0
+        self.missed   = 0
+        self.skipped  = 0
+        self.deadline = None
+        self.woken    = None
+
+    def start(self):
+        """
+        Starts the grid of deadlines at the current time.
+        """
+        self.woken    = self.clock.monotonic_ns()
+        self.deadline = self.woken + self.period_ns
+
+    def wait(self):
+        """
+        Waits for the next deadline.
+
+        :return: how late the deadline was met, in seconds
+        """
+        if self.deadline is None:
+            self.start()
+
+        now = self.clock.monotonic_ns()
+        if now > self.deadline:
+            self._missed(now)
+        else:
+            remaining = self.deadline - now - self.busy_wait_ns
+            if remaining > 0:
+                self.clock.sleep(remaining * 1e-9)
+            while self.clock.monotonic_ns() < self.deadline:
+                pass
+
+        woken = self.clock.monotonic_ns()
+        late  = woken - self.deadline
+
+        self.ticks += 1
+        self.periods.observe((woken - self.woken) * 1e-6)
+        self.jitter.observe(abs(late) * 1e-6)
+        self.woken     = woken
+        self.deadline += self.period_ns
+        return late * 1e-9
+
+    def _missed(self, now):
+        overrun = now - self.deadline
+        self.missed += 1
+        self.overruns.observe(overrun * 1e-6)
+
+        if self.policy == SKIP:
+            missed         = overrun // self.period_ns
+            self.skipped  += missed
+            self.deadline += missed * self.period_ns
+        elif self.policy == RESET:
+            self.deadline = now
+
+    def stats(self):
+        """
+        Timing statistics since the scheduler was started, durations in milliseconds.
+        """
+        return { "ticks"    : self.ticks
+               , "missed"   : self.missed
+               , "skipped"  : self.skipped
+               , "period"   : self.periods.snapshot()
+               , "jitter"   : self.jitter.snapshot()
+               , "overruns" : self.overruns.snapshot()
+               }
+
+    def reset_stats(self):
+        self.periods.reset()
+        self.jitter.reset()
+        self.overruns.reset()
+        self.ticks   = 0
+        self.missed  = 0
+        self.skipped = 0
@@ -0,0 +1,273 @@
+# A client for the path planning server. The controller sends all its
+# planning requests through one client, which owns a few worker threads with
+# one keep-alive connection each, instead of starting a thread and opening a
+# new connection for every command. The server only answers once a request is
+# done, so while one worker waits for a slow plan, the others send landing,
+# stopping and newer plans, which cancel it. Requests are answered through
+# futures and optional callbacks, and failed requests are reported instead of
+# being lost.
+# Local controllers can use a Unix domain socket instead of HTTP, see
+# ``src.planning_socket``.
+
+import itertools
+import logging
+import socket
+from concurrent.futures import Future
+from json import dumps
+from queue import Full, PriorityQueue
+from threading import Lock, Thread, local
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+import src.planning_socket as planning_socket
+
+log = logging.getLogger(__name__)
+
+# landing and stopping are sent before queued planning requests
+PRIORITIES = { "stop"         : 0
+             , "land"         : 1
+             , "plan"         : 2
+             , "plan_mission" : 2
+             , "hover"        : 3
+             }
+
+
+class PlanningError(Exception):
+    """
+    Raised when the path planning server could not handle a request.
+    """
+    pass
+
+
+def _succeeded(callback):
+    def done(future):
+        if not future.cancelled() and future.exception() is None:
+            callback(future.result())
+    return done
+
+
+class PlanningClient():
+    """
+    Sends requests to the path planning server from ``workers`` threads, the
+    most urgent waiting request first. At most ``maxPending`` requests can
+    wait at the same time, further requests fail immediately.
+    """
+    def __init__(self, url = "http://localhost:8001", timeout = 5.0, maxPending = 16, drone = None, workers = 4):
+        self.url      = url
+        self.timeout  = timeout
+        self.drone    = drone
+        self.requests = PriorityQueue(maxsize = maxPending)
+        self.sequence = itertools.count()
+        # requests that send a path are numbered, so that the controller can
+        # ignore paths of plans that a newer one replaced
+        self.plans    = itertools.count(1)
+        self.lastPlan = 0
+
+        # the connection of each worker
+        self.local = local()
+
+        self.lock     = Lock()
+        self.counters = { "sent" : 0, "failed" : 0, "cancelled" : 0, "rejected" : 0 }
+
+        self.workers = [Thread(target = self._work, daemon = True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def plan(self, start, target, callback = None):
+        """
+        Requests a path from start to target.
+
+        :param start: (x, y, z)
+        :param target: (x, y, z)
+        :param callback: optional function that is called with the reply
+        :return: a ``Future`` of the reply
+        """
+        return self.send("plan", { "start" : tuple(start), "target" : tuple(target) }, callback)
+
+    def planMission(self, start, targets, reorder = False, callback = None):
+        """
+        Requests a path from start through a sequence of targets.
+
+        :param start: (x, y, z)
+        :param targets: list of (x, y, z)
+        :param reorder: whether the targets may be visited in any order
+        :param callback: optional function that is called with the reply
+        :return: a ``Future`` of the reply
+        """
+        data = { "start" : tuple(start), "targets" : [tuple(target) for target in targets], "reorder" : reorder }
+        return self.send("plan_mission", data, callback)
+
+    def land(self, start, callback = None):
+        return self.send("land", { "start" : tuple(start) }, callback)
+
+    def hover(self, start, callback = None):
+        return self.send("hover", { "start" : tuple(start) }, callback)
+
+    def stop(self, callback = None):
+        return self.send("stop", None, callback)
+
+    def supersede(self):
+        """
+        Makes the paths of all requests sent so far outdated.
+        """
+        self.lastPlan = next(self.plans)
+
+    def send(self, command, data = None, callback = None):
+        """
+        Queues a request for the path planning server.
+
+        :param command: "plan", "plan_mission", "land", "hover", or "stop"
+        :param data: the data of the request
+        :param callback: optional function that is called with the reply
+                         once the request succeeded
+        :return: a ``Future`` of the reply; it fails with ``PlanningError`` if
+                 the server reports an error or cannot be reached
+        """
+        request = { "command" : command }
+        if data is not None:
+            request["data"] = data
+        if self.drone is not None:
+            request["drone"] = self.drone
+        if command != "hover":
+            request["plan"] = self.lastPlan = next(self.plans)
+
+        future = Future()
+        if callback is not None:
+            future.add_done_callback(_succeeded(callback))
+
+        try:
+            self.requests.put_nowait((PRIORITIES[command], next(self.sequence), request, future))
+        except Full:
+            self._count("rejected")
+            self._fail(request, future, PlanningError("Too many outstanding planning requests."))
+
+        return future
+
+    def stats(self):
+        """
+        Counters since the client was started.
+        """
+        with self.lock:
+            stats = dict(self.counters)
+        stats["pending"] = self.requests.qsize()
+        return stats
+
+    def close(self):
+        """
+        Stops the worker threads once all queued requests are sent.
+        """
+        for _ in self.workers:
+            self.requests.put((float('inf'), next(self.sequence), None, None))
+        for worker in self.workers:
+            worker.join()
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def _fail(self, request, future, error):
+        log.error("Planning request %s failed: %s", request["command"], error)
+        future.set_exception(error)
+
+    def _work(self):
+        try:
+            self._serve()
+        finally:
+            self._disconnect()
+
+    def _serve(self):
+        while True:
+            _, _, request, future = self.requests.get()
+            if request is None:
+                return
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            self._count("sent")
+            try:
+                reply = self._exchange(request)
+            except Exception as e:
+                self._count("failed")
+                self._fail(request, future, PlanningError("Cannot reach the path planner: {}".format(e)))
+                continue
+
+            if "error" in reply:
+                self._count("failed")
+                self._fail(request, future, PlanningError(reply["error"]))
+                continue
+
+            if "cancelled" in reply:
+                self._count("cancelled")
+                log.info("Planning request %s was superseded.", request["command"])
+
+            future.set_result(reply)
+
+    def _disconnect(self):
+        session = getattr(self.local, "session", None)
+        if session is not None:
+            session.close()
+        self.local.session = None
+
+    def _exchange(self, request):
+        if getattr(self.local, "session", None) is None:
+            self.local.session = Session()
+            self.local.session.mount("http://", HTTPAdapter(pool_connections = 1, pool_maxsize = 1))
+        response = self.local.session.post(self.url, data = dumps(request).encode(), timeout = self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+class SocketPlanningClient(PlanningClient):
+    """
+    A ``PlanningClient`` for a planner on the same machine that talks over a
+    Unix domain socket. The server returns planned paths in its replies and
+    the client hands them to ``deliver`` together with whether the crazyflie
+    should stop after the path, the number of the plan, and the times of the
+    waypoints if the path is timed, instead of the planner filling the
+    command queue.
+    """
+    def __init__(self, path, deliver, timeout = 5.0, maxPending = 16, drone = None, workers = 4):
+        self.path    = path
+        self.deliver = deliver
+        PlanningClient.__init__(self, path, timeout, maxPending, drone, workers)
+
+    def _connect(self):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        connection.connect(self.path)
+        self.local.connection = connection
+        self.local.stream     = connection.makefile('rb')
+
+    def _disconnect(self):
+        if getattr(self.local, "connection", None) is not None:
+            self.local.stream.close()
+            self.local.connection.close()
+        self.local.connection = None
+        self.local.stream     = None
+
+    def _exchange(self, request):
+        try:
+            if getattr(self.local, "connection", None) is None:
+                self._connect()
+            self.local.connection.sendall(planning_socket.encodeRequest(request))
+            status, waypoints, stop, extra, plan, times = planning_socket.decodeReply(self.local.stream)
+        except Exception:
+            # the next request reconnects
+            self._disconnect()
+            raise
+
+        if status == planning_socket.ERROR:
+            return { "error" : extra }
+        if status == planning_socket.CANCELLED:
+            return { "cancelled" : request }
+
+        # coalesced with an identical request, whose reply carries the path
+        if plan is not None:
+            self.deliver(waypoints, stop, plan or None, times)
+
+        reply = { "ok" : request }
+        if request["command"] == "plan_mission":
+            reply["order"] = extra
+        return reply
@@ -0,0 +1,180 @@
+# A pool of worker processes for path planning. The occupancy grid of the scene
+# is placed in shared memory once and every worker attaches to it, so that
+# neither the grid nor the scene has to be copied for each planning job.
+# Jobs that are already running can be cancelled through flags in shared
+# memory which the workers poll while searching. Next to its flag, every job
+# has a slot for the number of cells its search expanded.
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from threading import Lock
+
+from src.landmarks import Landmarks
+from src.metrics import Histogram
+from src.path import Point, Scene
+from src.shared import SharedArray
+
+# the scene of a worker process, its landmarks, the cancellation flags, and
+# the expansions of the jobs, set up by _attach
+_scene      = None
+_grid       = None
+_landmarks  = None
+_flags      = None
+_expansions = None
+
+
+def _attach(dimensions, resolution, descriptor, flagsDescriptor, expansionsDescriptor, landmarks):
+    global _scene, _grid, _landmarks, _flags, _expansions
+    _grid       = SharedArray.attach(descriptor)
+    _flags      = SharedArray.attach(flagsDescriptor)
+    _expansions = SharedArray.attach(expansionsDescriptor)
+    _scene = Scene(*dimensions, resolution, [], space = _grid.array)
+
+    if landmarks is not None:
+        landmarksDescriptor, cells, shape, digest = landmarks
+        _landmarks       = SharedArray.attach(landmarksDescriptor)
+        _scene.landmarks = Landmarks(cells, _landmarks.array, shape, resolution, digest)
+
+
+def _ready():
+    return _scene is not None
+
+
+def _cancelled(slot):
+    return None if slot is None else lambda: _flags.array[slot] != 0
+
+
+def _expanded(slot):
+    if slot is not None:
+        _expansions.array[slot] = _scene.expansions
+
+
+def _planPath(start, target, slot):
+    path = _scene.planPath(Point(*start), Point(*target), _cancelled(slot))
+    _expanded(slot)
+    return path
+
+
+def _planMission(start, targets, reorder, slot):
+    result = _scene.planMission(Point(*start), [Point(*target) for target in targets], reorder, _cancelled(slot))
+    _expanded(slot)
+    return result
+
+
+def _distanceField(start, slot):
+    return _scene.distanceField(Point(*start), cancelled = _cancelled(slot))
+
+
+class PlanningPool():
+    """
+    Runs planning jobs on the scene in a pool of worker processes.
+    """
+    def __init__(self, scene, workers = None):
+        self.scene   = scene
+        self.workers = workers or os.cpu_count() or 1
+        self.grid    = SharedArray.copy(scene.space)
+
+        # the landmark distances are large, so they are shared rather than copied
+        self.landmarks = None
+        landmarks      = None
+        if scene.landmarks is not None:
+            self.landmarks = SharedArray.copy(scene.landmarks.distances)
+            landmarks      = ( self.landmarks.descriptor(), scene.landmarks.cells
+                             , scene.landmarks.shape, scene.landmarks.digest
+                             )
+
+        # one cancellation flag per job that can run or wait at the same time
+        self.flags      = SharedArray.create((4 * self.workers,), 'i1')
+        self.expansions = SharedArray.create((4 * self.workers,), 'i8')
+        self.freeSlots  = list(range(4 * self.workers))
+        self.slotLock   = Lock()
+        # the number of cells expanded by the searches of the workers
+        self.searches   = Histogram.exponential(100, 2, 16)
+        # Spawned workers neither inherit the server's threads nor its sockets.
+        self.pool    = ProcessPoolExecutor( max_workers = self.workers
+                                          , mp_context  = multiprocessing.get_context('spawn')
+                                          , initializer = _attach
+                                          , initargs    = ( scene.dimensions, scene.resolution
+                                                          , self.grid.descriptor(), self.flags.descriptor()
+                                                          , self.expansions.descriptor(), landmarks
+                                                          )
+                                          )
+
+        # start all workers now rather than on the first planning request
+        wait([self.pool.submit(_ready) for _ in range(self.workers)])
+
+    def planPath(self, start, target):
+        """
+        Submits a path planning job.
+
+        :param start: ``Point``
+        :param target: ``Point``
+        :return: a ``Future`` of the list of waypoints
+        """
+        return self._submit(_planPath, (start.x, start.y, start.z), (target.x, target.y, target.z))
+
+    def planMission(self, start, targets, reorder = False):
+        """
+        Submits a mission planning job, see ``Scene.planMission``.
+
+        :param start: ``Point``
+        :param targets: list of ``Point``s
+        :param reorder: whether the targets may be visited in any order
+        :return: a ``Future`` of the list of waypoints and the order of the targets
+        """
+        targets = [(target.x, target.y, target.z) for target in targets]
+        return self._submit(_planMission, (start.x, start.y, start.z), targets, reorder)
+
+    def distanceField(self, start):
+        """
+        Submits a job that computes the distance field from the start,
+        see ``Scene.distanceField``.
+
+        :param start: ``Point``
+        :return: a ``Future`` of the ``DistanceField``
+        """
+        return self._submit(_distanceField, (start.x, start.y, start.z))
+
+    def _submit(self, function, *args):
+        with self.slotLock:
+            slot = self.freeSlots.pop() if self.freeSlots else None
+        if slot is not None:
+            self.flags.array[slot]      = 0
+            self.expansions.array[slot] = -1
+
+        future = self.pool.submit(function, *args, slot)
+        future.slot = slot
+        future.add_done_callback(self._release)
+        return future
+
+    def cancel(self, future):
+        """
+        Cancels a planning job, also if a worker is already planning it.
+        Cancelled running jobs fail with ``PlanningCancelled``.
+
+        :param future: as returned by ``planPath`` or ``planMission``
+        """
+        if future.cancel() or future.slot is None:
+            return
+
+        # the slot is only released after the job is done
+        with self.slotLock:
+            if not future.done():
+                self.flags.array[future.slot] = 1
+
+    def _release(self, future):
+        if future.slot is not None:
+            expansions = int(self.expansions.array[future.slot])
+            if expansions >= 0 and not future.cancelled() and future.exception() is None:
+                self.searches.observe(expansions)
+            with self.slotLock:
+                self.freeSlots.append(future.slot)
+
+    def shutdown(self):
+        self.pool.shutdown()
+        self.grid.close()
+        self.flags.close()
+        self.expansions.close()
+        if self.landmarks is not None:
+            self.landmarks.close()
@@ -0,0 +1,204 @@
+# A local transport between the controller and the path planning server over a
+# Unix domain socket. Requests and replies are small binary frames instead of
+# HTTP and JSON, and the planned path is returned in the reply, so that the
+# controller puts the waypoints into its command queue itself instead of
+# receiving them pickled from the planning process. The HTTP server stays
+# available for remote clients; both share the same scheduler and workers.
+#
+# A request frame is a header (command, flags, drone, number of the plan or 0,
+# number of points) followed by the points as float64 triples:
+#   plan:         start, target
+#   plan_mission: start, targets...   (flag REORDER)
+#   land, hover:  start
+#   stop:         -
+# A reply frame is a header (status, flags, number of waypoints, length of the
+# extra payload, number of the plan) followed by the waypoints as float64
+# triples, their times as float64 if the path is timed (flag TIMED), and the
+# extra payload: the order of the targets as int32 for missions, the message
+# for errors. A request that was coalesced with an
+# identical one gets no path, which goes out on the connection of the first,
+# with the number of the newest plan.
+
+import os
+import socketserver
+import struct
+from concurrent.futures import CancelledError
+from threading import Thread
+
+import numpy as np
+
+from src.path import PlanningCancelled
+
+REQUEST = struct.Struct('<BBHII')
+REPLY   = struct.Struct('<BBHIII')
+
+COMMANDS = [ "plan", "plan_mission", "land", "hover", "stop" ]
+
+# request flags
+REORDER = 1
+
+# reply status
+OK        = 0
+CANCELLED = 1
+ERROR     = 2
+
+# reply flags: the path is followed by a stop, the reply carries a path, the
+# path has a time for every waypoint
+STOP  = 1
+PATH  = 2
+TIMED = 4
+
+
+def _readExactly(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError("Connection closed.")
+    return data
+
+
+def encodeRequest(request):
+    """
+    :param request: a request like the ones sent to the HTTP server
+    :return: the frame as bytes
+    """
+    data    = request.get("data", {})
+    command = request["command"]
+
+    if command == "plan":
+        points = [data["start"], data["target"]]
+    elif command == "plan_mission":
+        points = [data["start"]] + list(data["targets"])
+    elif command in ("land", "hover"):
+        points = [data["start"]]
+    else:
+        points = []
+
+    flags = REORDER if data.get("reorder", False) else 0
+    body  = np.asarray(points, dtype = '<f8').tobytes()
+    header = REQUEST.pack(COMMANDS.index(command) + 1, flags, request.get("drone", 0), request.get("plan", 0), len(points))
+    return header + body
+
+
+def decodeRequest(stream):
+    """
+    Reads one request frame.
+
+    :param stream: a binary file-like object
+    :return: the request like the ones sent to the HTTP server
+    """
+    code, flags, drone, plan, count = REQUEST.unpack(_readExactly(stream, REQUEST.size))
+    points  = np.frombuffer(_readExactly(stream, 24 * count), dtype = '<f8').reshape(count, 3).tolist()
+    command = COMMANDS[code - 1]
+
+    request = { "command" : command, "drone" : drone }
+    if plan:
+        request["plan"] = plan
+    if command == "plan":
+        request["data"] = { "start" : points[0], "target" : points[1] }
+    elif command == "plan_mission":
+        request["data"] = { "start" : points[0], "targets" : points[1:], "reorder" : bool(flags & REORDER) }
+    elif command in ("land", "hover"):
+        request["data"] = { "start" : points[0] }
+    return request
+
+
+def encodeReply(status, path = None, stop = False, order = None, message = "", plan = 0, times = None):
+    """
+    :param path: the path, or ``None`` if the reply carries none
+    :param plan: the number of the plan of the path
+    :param times: the time of every waypoint, or ``None`` if the path is not timed
+    :return: the frame as bytes
+    """
+    flags = (STOP if stop else 0) | (PATH if path is not None else 0) | (TIMED if times is not None else 0)
+    path  = path or ()
+    waypoints = np.asarray([(p.x, p.y, p.z) for p in path], dtype = '<f8').reshape(-1, 3)
+    times     = np.asarray(times if times is not None else (), dtype = '<f8')
+    if status == ERROR:
+        extra = message.encode()
+    elif order is not None:
+        extra = np.asarray(order, dtype = '<i4').tobytes()
+    else:
+        extra = b""
+    header = REPLY.pack(status, flags, 0, len(waypoints), len(extra), plan or 0)
+    return header + waypoints.tobytes() + times.tobytes() + extra
+
+
+def decodeReply(stream):
+    """
+    Reads one reply frame.
+
+    :param stream: a binary file-like object
+    :return: status, waypoints as (n, 3) array, whether a stop follows, the
+             order of the targets or the error message, the number of the
+             plan of the path, or ``None`` if the reply carries no path, and the
+             times of the waypoints, or ``None`` if the path is not timed
+    """
+    status, flags, _, count, size, plan = REPLY.unpack(_readExactly(stream, REPLY.size))
+    waypoints = np.frombuffer(_readExactly(stream, 24 * count), dtype = '<f8').reshape(count, 3)
+    times     = np.frombuffer(_readExactly(stream, 8 * count), dtype = '<f8') if flags & TIMED else None
+    extra     = _readExactly(stream, size)
+
+    if status == ERROR:
+        extra = extra.decode()
+    else:
+        extra = np.frombuffer(extra, dtype = '<i4').tolist()
+    return status, waypoints, bool(flags & STOP), extra, (plan if flags & PATH else None), times
+
+
+class PlanningSocketHandler(socketserver.StreamRequestHandler):
+    """
+    Answers requests on one connection until the client closes it.
+    """
+    def handle(self):
+        while True:
+            try:
+                request = decodeRequest(self.rfile)
+            except EOFError:
+                return
+
+            delivered = []
+            try:
+                result = self.server.planner.submit(request, lambda *path: delivered.append(path)).result()
+                path, stop, plan, times = delivered[0] if delivered else (None, False, 0, None)
+                order = result if request["command"] == "plan_mission" else None
+                reply = encodeReply(OK, path, stop = stop, order = order, plan = plan, times = times)
+            except (CancelledError, PlanningCancelled):
+                reply = encodeReply(CANCELLED)
+            except Exception as e:
+                reply = encodeReply(ERROR, message = str(e))
+
+            self.wfile.write(reply)
+
+
+class PlanningSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves the requests of local clients with the scheduler and workers of a
+    ``PlanningHTTPServer``.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, planner):
+        self.planner = planner
+
+        # a socket file left behind by a planner that did not shut down cleanly
+        if os.path.exists(path):
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, PlanningSocketHandler)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def serve(path, planner):
+    """
+    Starts serving local clients in a background thread.
+
+    :param path: where to create the socket
+    :param planner: the ``PlanningHTTPServer``
+    :return: the ``PlanningSocketServer``
+    """
+    server = PlanningSocketServer(path, planner)
+    Thread(target = server.serve_forever, daemon = True).start()
+    return server
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+# A precomputed roadmap for static scenes. Rooms do not change between flights,
+# so we build a visibility graph over the corners (and edges) of the obstacle
+# boxes once, solve all-pairs shortest paths offline and store the
+# result next to the room specification. Online, a planning request only has to
+# connect start and target to the roadmap and look up the best pair of entry
+# and exit nodes, which does not depend on the grid resolution. The boxes are
+# the grid cells that the obstacles occupy, so that the roadmap keeps the same
+# clearance as planning on the grid.
+#
+# Usage:
+#   python -m src.roadmap build    examples/room_spec_3.yaml
+#   python -m src.roadmap validate examples/room_spec_3.yaml
+
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+import src.scene_parser as scene_parser
+from src.path import Point
+
+log = logging.getLogger(__name__)
+
+# bump whenever the file layout or the construction changes
+ROADMAP_VERSION = 2
+
+
+def roadmapPath(specPath):
+    """
+    The location of the roadmap that belongs to a room specification.
+
+    :param specPath: path to the YAML scene specification
+    :return: path to the roadmap file next to the specification
+    """
+    return os.path.splitext(specPath)[0] + '.roadmap.npz'
+
+
+def specDigest(specPath):
+    """
+    Fingerprints a room specification so that stale roadmaps can be detected.
+    """
+    digest = hashlib.sha1()
+    with open(specPath, 'rb') as fh:
+        digest.update(fh.read())
+    return digest.hexdigest()
+
+
+def segmentsBlocked(p0, p1, lower, upper):
+    """
+    Vectorised slab test of segments against (open) axis-aligned boxes.
+
+    :param p0: segment start points, shape (..., 3)
+    :param p1: segment end points, shape (..., 3), broadcast against p0
+    :param lower: lower box corners, shape (B, 3)
+    :param upper: upper box corners, shape (B, 3)
+    :return: boolean array of shape (...), True if a segment enters any box
+    """
+    if len(lower) == 0:
+        return np.zeros(np.broadcast(p0, p1).shape[:-1], dtype=bool)
+
+    # Segments parallel to a slab get infinite entry and exit parameters, which
+    # are either on the same or on opposite sides depending on whether the
+    # segment lies within the slab. fmin/fmax skip the NaNs of segments that
+    # run exactly along a box face.
+    tEnter = -np.inf
+    tExit  =  np.inf
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for axis in range(3):
+            start   = p0[..., axis, None]
+            inverse = 1.0 / (p1[..., axis, None] - start)
+            t1 = (lower[:, axis] - start) * inverse
+            t2 = (upper[:, axis] - start) * inverse
+            tEnter = np.maximum(tEnter, np.fmin(t1, t2))
+            tExit  = np.minimum(tExit,  np.fmax(t1, t2))
+
+    return ((tEnter < tExit) & (tEnter < 1) & (tExit > 0)).any(axis=-1)
+
+
+def occupiedBoxes(scene):
+    """
+    The boxes of grid cells that the obstacles of a scene occupy. A cell is
+    occupied if its centre lies within an obstacle, so the box of an obstacle
+    reaches from the first to the last cell whose centre it contains.
+
+    :param scene: the ``Scene`` with its obstacles
+    :return: the lower and upper box corners, each of shape (B, 3)
+    """
+    resolution = scene.resolution
+    cells      = np.array(scene.space.shape)
+    lower, upper = [], []
+    for obstacle in scene.obstacles:
+        lo, hi = obstacle.boundingBox()
+        first  = np.maximum(np.ceil(np.asarray(lo) / resolution - 0.5 - 1e-9), 0)
+        last   = np.minimum(np.floor(np.asarray(hi) / resolution - 0.5 + 1e-9), cells - 1)
+        if np.any(first > last):
+            continue
+        lower.append(first * resolution)
+        upper.append((last + 1) * resolution)
+    return np.array(lower, dtype=float).reshape(-1, 3), np.array(upper, dtype=float).reshape(-1, 3)
+
+
+class Roadmap():
+    """
+    A visibility roadmap over the occupied cells of a scene, together with
+    the all-pairs shortest path distances and next hops between its nodes.
+    """
+    def __init__(self, nodes, distances, nextHop, lower, upper, roomLower, roomUpper, margin, digest):
+        self.nodes     = nodes
+        self.distances = distances
+        self.nextHop   = nextHop
+        self.lower     = lower
+        self.upper     = upper
+        self.roomLower = roomLower
+        self.roomUpper = roomUpper
+        self.margin    = margin
+        self.digest    = digest
+
+    @staticmethod
+    def build(scene, margin=0.0, samples=100, spacing=0.5, digest='', seed=0):
+        """
+        Builds the roadmap for a scene.
+
+        :param scene: the ``Scene`` with its obstacles
+        :param margin: clearance in meters that paths keep to the occupied
+                       cells and walls in addition to the grid
+        :param samples: number of additional random nodes in free space
+        :param spacing: maximum distance between nodes along box edges
+        :param digest: fingerprint of the room specification
+        :param seed: seed for the random samples
+        :return: the ``Roadmap``
+        """
+        # place nodes slightly outside of the boxes so that they are neither
+        # considered to be in collision themselves nor fall into their cells
+        offset = 0.05 * scene.resolution
+
+        lower, upper = occupiedBoxes(scene)
+        lower, upper = lower - margin, upper + margin
+
+        roomLower = np.full(3, margin + offset)
+        roomUpper = np.array(scene.space.shape) * scene.resolution - margin - offset
+
+        candidates = []
+        for lo, hi in zip(lower - offset, upper + offset):
+            corners = np.array([[x, y, z] for x in (lo[0], hi[0])
+                                          for y in (lo[1], hi[1])
+                                          for z in (lo[2], hi[2])])
+            candidates.append(corners)
+
+            # shortest paths in 3D wrap around box edges rather than corners,
+            # so we also sample along the edges
+            for i in range(len(corners)):
+                for j in range(i + 1, len(corners)):
+                    if np.count_nonzero(corners[i] != corners[j]) != 1:
+                        continue
+                    steps = int(np.ceil(np.linalg.norm(corners[j] - corners[i]) / spacing))
+                    if steps > 1:
+                        fractions = np.arange(1, steps)[:, None] / steps
+                        candidates.append(corners[i] + fractions * (corners[j] - corners[i]))
+
+        if samples > 0:
+            rng = np.random.RandomState(seed)
+            candidates.append(roomLower + rng.rand(samples, 3) * (roomUpper - roomLower))
+
+        candidates = np.concatenate(candidates) if candidates else np.zeros((0, 3))
+
+        # obstacles usually stand on the floor or touch the walls, so we move
+        # their corners and edges into the room instead of dropping them
+        candidates = np.unique(np.clip(candidates, roomLower, roomUpper), axis=0)
+
+        valid = ~np.any(np.all((candidates[:, None, :] > lower[None]) & (candidates[:, None, :] < upper[None]), axis=2), axis=1)
+        nodes = candidates[valid]
+
+        # visibility edges between all pairs of nodes
+        n = len(nodes)
+        distances = np.full((n, n), np.inf)
+        np.fill_diagonal(distances, 0.0)
+        i, j = np.triu_indices(n, 1)
+        for chunk in range(0, len(i), 20000):
+            a, b    = i[chunk:chunk+20000], j[chunk:chunk+20000]
+            visible = ~segmentsBlocked(nodes[a], nodes[b], lower, upper)
+            a, b    = a[visible], b[visible]
+            lengths = np.linalg.norm(nodes[a] - nodes[b], axis=1)
+            distances[a, b] = lengths
+            distances[b, a] = lengths
+
+        # Floyd-Warshall, vectorised over one intermediate node at a time
+        nextHop = np.where(np.isfinite(distances), np.arange(n)[None, :], -1).astype(np.int32)
+        for k in range(n):
+            viaK    = distances[:, k, None] + distances[None, k, :]
+            shorter = viaK < distances
+            distances = np.where(shorter, viaK, distances)
+            nextHop   = np.where(shorter, nextHop[:, k, None], nextHop)
+
+        return Roadmap(nodes, distances, nextHop, lower, upper, roomLower, roomUpper, margin, digest)
+
+    def save(self, path):
+        """
+        Stores the roadmap in a compressed numpy archive.
+
+        :param path:
+        """
+        with open(path, 'wb') as fh:
+            np.savez_compressed( fh
+                               , version   = ROADMAP_VERSION
+                               , nodes     = self.nodes
+                               , distances = self.distances.astype(np.float32)
+                               , nextHop   = self.nextHop
+                               , lower     = self.lower
+                               , upper     = self.upper
+                               , roomLower = self.roomLower
+                               , roomUpper = self.roomUpper
+                               , margin    = self.margin
+                               , digest    = self.digest
+                               )
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a roadmap that was stored with ``save``.
+
+        :param path:
+        :return: the ``Roadmap``
+        """
+        with np.load(path) as data:
+            if int(data['version']) != ROADMAP_VERSION:
+                raise Exception("Roadmap {} has an outdated format, please rebuild it.".format(path))
+
+            return Roadmap( data['nodes']
+                          , data['distances'].astype(float)
+                          , data['nextHop']
+                          , data['lower']
+                          , data['upper']
+                          , data['roomLower']
+                          , data['roomUpper']
+                          , float(data['margin'])
+                          , str(data['digest'])
+                          )
+
+    def visibleFrom(self, points):
+        """
+        Determines which roadmap nodes can be reached on a straight line.
+
+        :param points: numpy array of shape (P, 3)
+        :return: boolean array of shape (P, nodes)
+        """
+        return ~segmentsBlocked(points[:, None, :], self.nodes[None, :, :], self.lower, self.upper)
+
+    def isFree(self, point):
+        """
+        Checks whether a point keeps the required clearance to obstacles and walls.
+        """
+        if np.any(point < self.roomLower) or np.any(point > self.roomUpper):
+            return False
+        return not np.any(np.all((point > self.lower) & (point < self.upper), axis=1))
+
+    def planPath(self, start, target):
+        """
+        Plans a path from start to target along the roadmap.
+
+        :param start: ``Point``
+        :param target: ``Point``
+        :return: list of ``Point``s, starting with start and ending with target
+        """
+        s = np.r_[start.x,  start.y,  start.z]
+        t = np.r_[target.x, target.y, target.z]
+
+        if not self.isFree(s):
+            raise Exception("Start {} is too close to an obstacle for the roadmap!".format(start))
+        if not self.isFree(t):
+            raise Exception("Target {} is too close to an obstacle for the roadmap!".format(target))
+
+        # start and target see each other, no need for the roadmap
+        if not segmentsBlocked(s, t, self.lower, self.upper):
+            return [start, target]
+
+        visible = self.visibleFrom(np.stack([s, t]))
+        entries = np.flatnonzero(visible[0])
+        exits   = np.flatnonzero(visible[1])
+        if len(entries) == 0 or len(exits) == 0:
+            raise Exception("Cannot connect {} and {} to the roadmap!".format(start, target))
+
+        costs = np.linalg.norm(self.nodes[entries] - s, axis=1)[:, None] \
+              + self.distances[np.ix_(entries, exits)] \
+              + np.linalg.norm(self.nodes[exits] - t, axis=1)[None, :]
+
+        best = np.argmin(costs)
+        if not np.isfinite(costs.flat[best]):
+            raise Exception("Cannot find a path to target on the roadmap!")
+
+        entry, exit = entries[best // len(exits)], exits[best % len(exits)]
+
+        path = [start]
+        node = entry
+        while True:
+            path.append(Point(*self.nodes[node]))
+            if node == exit:
+                break
+            node = self.nextHop[node, exit]
+        path.append(target)
+
+        return path
+
+
+def load(specPath):
+    """
+    Loads the roadmap stored next to a room specification if it exists and
+    was built from the current version of the specification.
+
+    :param specPath: path to the YAML scene specification
+    :return: the ``Roadmap`` or ``None``
+    """
+    path = roadmapPath(specPath)
+    if not os.path.exists(path):
+        return None
+
+    roadmap = Roadmap.load(path)
+    if roadmap.digest != specDigest(specPath):
+        log.warning('Roadmap %s is outdated, ignoring it.', path)
+        return None
+
+    return roadmap
+
+
+def build(specPath, margin=0.0, samples=100):
+    """
+    Builds the roadmap for a room specification and stores it next to it.
+
+    :param specPath: path to the YAML scene specification
+    :return: the ``Roadmap``
+    """
+    scene   = scene_parser.parse(specPath)
+    roadmap = Roadmap.build(scene, margin=margin, samples=samples, digest=specDigest(specPath))
+    roadmap.save(roadmapPath(specPath))
+    return roadmap
+
+
+def validate(specPath, queries=100, seed=1):
+    """
+    Checks a stored roadmap against the occupancy grid of its scene and
+    compares random queries with grid-based A*.
+
+    :return: ``True`` if the roadmap is consistent with the scene
+    """
+    roadmap = load(specPath)
+    if roadmap is None:
+        print("No up-to-date roadmap for {}.".format(specPath))
+        return False
+
+    scene = scene_parser.parse(specPath)
+    ok    = True
+
+    # every edge on a shortest path must only cross free grid cells
+    n = len(roadmap.nodes)
+    used = np.unique(np.stack([np.repeat(np.arange(n), n), roadmap.nextHop.reshape(-1)], axis=1), axis=0)
+    used = used[(used[:, 1] >= 0) & (used[:, 0] != used[:, 1])]
+    for a, b in used:
+        p, q  = roadmap.nodes[a], roadmap.nodes[b]
+        steps = max(2, int(np.ceil(np.linalg.norm(q - p) / (0.5 * scene.resolution))) + 1)
+        for point in np.linspace(p, q, steps):
+            cell = scene.getCoordinate(Point(*point))
+            if scene.space[cell]:
+                print("Edge {} -> {} crosses occupied cell {}.".format(a, b, cell))
+                ok = False
+                break
+
+    rng = np.random.RandomState(seed)
+    latencies, ratios, failures = [], [], 0
+    for _ in range(queries):
+        s, t = (roadmap.roomLower + rng.rand(2, 3) * (roadmap.roomUpper - roadmap.roomLower))
+        if not (roadmap.isFree(s) and roadmap.isFree(t)):
+            continue
+
+        start, target = Point(*s), Point(*t)
+        queryStart = time.perf_counter()
+        try:
+            path = roadmap.planPath(start, target)
+        except Exception:
+            path = None
+        latencies.append(time.perf_counter() - queryStart)
+
+        if path is None:
+            failures += 1
+            continue
+
+        try:
+            gridPath = scene.planPath(start, target)
+            ratios.append(pathLength(path) / pathLength(gridPath))
+        except Exception:
+            pass
+
+    print("Nodes: {:d}, edges on shortest paths: {:d}".format(n, len(used)))
+    if latencies:
+        print("Queries: {:d}, failures: {:d}, median latency: {:.3f}ms, max latency: {:.3f}ms"
+              .format(len(latencies), failures, 1e3 * np.median(latencies), 1e3 * np.max(latencies)))
+    if ratios:
+        print("Path length relative to grid A*: median {:.3f}, max {:.3f}".format(np.median(ratios), np.max(ratios)))
+
+    return ok
+
+
+def pathLength(path):
+    return sum(path[i-1].distanceTo(path[i]) for i in range(1, len(path)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build and validate precomputed roadmaps for room specifications')
+    parser.add_argument('action', choices=['build', 'validate'])
+    parser.add_argument('room_spec', type=str, help='Path to the room specification file')
+    parser.add_argument('-m', '--margin', type=float, default=0.0,
+                        help='Clearance to the occupied cells and walls in meters, in addition to the grid')
+    parser.add_argument('-s', '--samples', type=int, default=100,
+                        help='Number of additional random nodes in free space')
+    parser.add_argument('-q', '--queries', type=int, default=100,
+                        help='Number of random queries to run when validating')
+    args = parser.parse_args(argv)
+
+    if args.action == 'build':
+        buildStart = time.time()
+        roadmap = build(args.room_spec, margin=args.margin, samples=args.samples)
+        print("Built roadmap with {:d} nodes in {:.2f}s: {}"
+              .format(len(roadmap.nodes), time.time() - buildStart, roadmapPath(args.room_spec)))
+        return 0
+
+    return 0 if validate(args.room_spec, queries=args.queries) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+# A job scheduler for the path planning server.
+#
+# Jobs are run by priority, so that landing and stopping never wait for path
+# planning. A newer job of a drone supersedes that drone's older jobs, e.g. a
+# new plan makes older plans obsolete, which are then cancelled whether they
+# are still waiting or already running. Identical pending jobs are coalesced
+# into one, which then answers the newest of their plans, until the job is
+# closed because its result went out. Computing distance fields for hovering
+# drones is the least urgent.
+
+import heapq
+from concurrent.futures import Future
+from threading import Condition, Thread
+
+# lower numbers run first
+PRIORITIES = { "stop" : 0
+             , "land" : 1
+             , "plan"  : 2
+             , "hover" : 3
+             }
+
+# which older jobs of the same drone are made obsolete by a new job
+SUPERSEDES = { "stop"  : {"plan", "land", "hover"}
+             , "land"  : {"plan", "hover"}
+             , "plan"  : {"plan"}
+             , "hover" : {"hover"}
+             }
+
+
+class Job():
+    """
+    A scheduled job. The function is called with the job as its argument, so
+    that it can check whether it was cancelled and register ``onCancel`` to
+    interrupt work that is already running.
+    """
+    def __init__(self, sequence, drone, kind, key, function, plan = None):
+        self.sequence  = sequence
+        self.priority  = PRIORITIES[kind]
+        self.drone     = drone
+        self.kind      = kind
+        self.key       = key
+        self.function  = function
+        # the number of the newest plan that the job answers
+        self.plan      = plan
+        self.closed    = False
+        self.future    = Future()
+        self.cancelled = False
+        self.running   = False
+        self.onCancel  = None
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+    def cancel(self):
+        """
+        Cancels the job. Waiting jobs never run, running jobs are asked to stop.
+
+        :return: ``True`` if the job was not cancelled before
+        """
+        if self.cancelled:
+            return False
+
+        self.cancelled = True
+        if not self.running:
+            self.future.cancel()
+        elif self.onCancel is not None:
+            self.onCancel()
+        return True
+
+
+class Scheduler():
+    """
+    Runs jobs in a fixed number of threads. At most ``limits[kind]`` jobs of a
+    kind run at the same time, so that threads stay available for urgent jobs.
+    """
+    def __init__(self, threads, limits = None):
+        self.limits    = limits or {}
+        self.condition = Condition()
+        self.queue     = []
+        self.pending   = {}
+        self.running   = {}
+        self.sequence  = 0
+        self.counters  = { "submitted" : 0
+                         , "completed" : 0
+                         , "failed"    : 0
+                         , "cancelled" : 0
+                         , "coalesced" : 0
+                         }
+
+        for _ in range(threads):
+            Thread(target = self._work, daemon = True).start()
+
+    def submit(self, drone, kind, key, function, plan = None):
+        """
+        Schedules a job.
+
+        :param drone: identifies the drone the job belongs to
+        :param kind: "stop", "land", "plan", or "hover"
+        :param key: identifies identical jobs, which are coalesced
+        :param function: called with the ``Job`` when it runs
+        :param plan: optional number of the plan that the job answers
+        :return: a ``Future`` of the result of the function
+        """
+        with self.condition:
+            self.counters["submitted"] += 1
+
+            # an identical job is already waiting or running
+            identical = self.pending.get((drone, kind, key))
+            if identical is not None and not identical.cancelled and not identical.closed:
+                if plan is not None:
+                    identical.plan = max(identical.plan or 0, plan)
+                self.counters["coalesced"] += 1
+                return identical.future
+
+            for job in list(self.pending.values()):
+                if job.drone == drone and job.kind in SUPERSEDES[kind] and job.cancel():
+                    self.counters["cancelled"] += 1
+
+            job = Job(self.sequence, drone, kind, key, function, plan)
+            self.sequence += 1
+            self.pending[(drone, kind, key)] = job
+            heapq.heappush(self.queue, job)
+            self.condition.notify_all()
+
+        return job.future
+
+    def close(self, job):
+        """
+        Stops coalescing requests into a job, e.g. because its result was
+        sent with the number of its plan.
+
+        :return: the number of the newest plan that the job answers
+        """
+        with self.condition:
+            job.closed = True
+            return job.plan
+
+    def stats(self):
+        """
+        Queue depth, running jobs, and counters since the scheduler was started.
+        """
+        with self.condition:
+            stats = dict(self.counters)
+            stats["queued"]  = sum(1 for job in self.queue if not job.cancelled)
+            stats["running"] = sum(self.running.values())
+            return stats
+
+    def _next(self):
+        # drop cancelled jobs and find the most urgent one we may start
+        while self.queue and self.queue[0].cancelled:
+            self._forget(heapq.heappop(self.queue))
+
+        if not self.queue:
+            return None
+
+        job = self.queue[0]
+        if self.running.get(job.kind, 0) >= self.limits.get(job.kind, float('inf')):
+            return None
+
+        return heapq.heappop(self.queue)
+
+    def _forget(self, job):
+        if self.pending.get((job.drone, job.kind, job.key)) is job:
+            del self.pending[(job.drone, job.kind, job.key)]
+
+    def _work(self):
+        while True:
+            with self.condition:
+                job = self._next()
+                while job is None:
+                    self.condition.wait()
+                    job = self._next()
+
+                job.running = True
+                self.running[job.kind] = self.running.get(job.kind, 0) + 1
+
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.function(job))
+                    succeeded = True
+                except Exception as e:
+                    job.future.set_exception(e)
+                    succeeded = False
+            else:
+                succeeded = None
+
+            with self.condition:
+                self.running[job.kind] -= 1
+                self._forget(job)
+                if succeeded is True:
+                    self.counters["completed"] += 1
+                elif succeeded is False and not job.cancelled:
+                    self.counters["failed"] += 1
+                self.condition.notify_all()
@@ -0,0 +1,71 @@
+# Numpy arrays in shared memory, so that several processes can work on the
+# same data without copying or pickling it.
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedArray():
+    """
+    A numpy array backed by a ``multiprocessing.shared_memory.SharedMemory``
+    block. The process that creates the array owns the block and unlinks it,
+    other processes attach to it through its descriptor.
+    """
+    def __init__(self, memory, shape, dtype, owner):
+        self.memory = memory
+        self.owner  = owner
+        self.array  = np.ndarray(shape, dtype = dtype, buffer = memory.buf)
+
+    @staticmethod
+    def create(shape, dtype):
+        """
+        Allocates a new, zero-initialised shared array.
+
+        :param shape:
+        :param dtype:
+        :return: the ``SharedArray``
+        """
+        size   = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        memory = shared_memory.SharedMemory(create = True, size = size)
+        shared = SharedArray(memory, shape, dtype, owner = True)
+        shared.array[...] = 0
+        return shared
+
+    @staticmethod
+    def copy(array):
+        """
+        Copies an existing array into shared memory.
+
+        :param array:
+        :return: the ``SharedArray``
+        """
+        shared = SharedArray.create(array.shape, array.dtype)
+        shared.array[...] = array
+        return shared
+
+    @staticmethod
+    def attach(descriptor):
+        """
+        Attaches to a shared array that was created by another process.
+
+        :param descriptor: as returned by ``descriptor``
+        :return: the ``SharedArray``
+        """
+        name, shape, dtype = descriptor
+        return SharedArray(shared_memory.SharedMemory(name = name), shape, dtype, owner = False)
+
+    def descriptor(self):
+        """
+        A picklable description that other processes can use to attach.
+        """
+        return (self.memory.name, self.array.shape, self.array.dtype.str)
+
+    def close(self):
+        """
+        Detaches from the shared memory and frees it if we own it.
+        """
+        self.array = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
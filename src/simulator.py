@@ -0,0 +1,347 @@
+# A software-in-the-loop simulator that stands in for the crazyflie.
+#
+# SimulatedCrazyflie implements the part of the cflib API that the controller
+# uses: the connection callbacks, commander.send_setpoint, log.add_config with
+# cflib's LogConfig, and param.set_value. Behind it, a rigid-body quadrotor
+# model is integrated in a background thread and the log blocks are delivered
+# at their periods, like the radio would.
+#
+# Time comes from a SimulatedClock that can run faster than real time. Give
+# the same clock to the controller (and thereby its PeriodicScheduler and
+# StateStore), so that the whole control loop runs on simulated time, e.g. to
+# measure mission times in CI.
+#
+# The model follows the conventions of the control law: a positive pitch
+# accelerates along x, a negative roll along y, and the thrust force in Newton
+# is the thrust setpoint divided by C.
+
+import struct
+import time
+from threading import Lock, Thread
+
+import numpy as np
+
+from cflib.crazyflie.log import LogTocElement
+from cflib.utils.callbacks import Caller
+
+from src.periodic import PeriodicScheduler
+from src.telemetry import LOG_BLOCK_SIZE
+
+
+def fetch(value, fetch_as):
+    """
+    A value as it arrives when sent as the log type with the given id.
+    """
+    _, fmt, _ = LogTocElement.types[fetch_as]
+    if fmt not in ('<e', '<f'):
+        value = int(round(value))
+    return struct.unpack(fmt, struct.pack(fmt, value))[0]
+
+
+class SimulatedClock():
+    """
+    A clock that runs ``speedup`` times faster than real time. It provides the
+    functions of the ``time`` module that the control loop uses.
+    """
+    def __init__(self, speedup = 1.0):
+        self.speedup = float(speedup)
+        self.origin  = time.monotonic()
+        self.epoch   = time.time()
+
+    def monotonic(self):
+        return (time.monotonic() - self.origin) * self.speedup
+
+    def monotonic_ns(self):
+        return int(self.monotonic() * 1e9)
+
+    def perf_counter(self):
+        return self.monotonic()
+
+    def time(self):
+        return self.epoch + self.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self.speedup)
+
+
+class Quadrotor():
+    """
+    Rigid-body dynamics of any number of quadrotors at once. Roll and pitch
+    follow their setpoints with a first-order lag, yaw integrates the yaw rate,
+    and the thrust acts along the body z axis against gravity and linear drag.
+    """
+    def __init__( self
+                , count    = 1
+                , position = (0.0, 0.0, 0.0)
+                , m        = 0.0327
+                , g        = 9.82
+                , C        = 100000
+                , tau      = 0.05
+                , drag     = 0.01
+                ):
+        """
+        :param count: the number of quadrotors
+        :param position: initial position(s), broadcast to ``(count, 3)``
+        :param m: mass [kg]
+        :param g: gravity [m/s^2]
+        :param C: thrust setpoint per Newton
+        :param tau: time constant of the attitude [s]
+        :param drag: linear drag coefficient [N s/m]
+        """
+        self.count = count
+        self.m     = m
+        self.g     = g
+        self.C     = C
+        self.tau   = tau
+        self.drag  = drag
+
+        self.pos      = np.zeros((count, 3)) + position
+        self.vel      = np.zeros((count, 3))
+        # roll, pitch, yaw [rad]
+        self.att      = np.zeros((count, 3))
+        # roll [deg], pitch [deg], yaw rate [deg/s], thrust
+        self.setpoint = np.zeros((count, 4))
+        # like the crazyflie, the motors only start after a zero thrust setpoint
+        self.locked   = np.ones(count, dtype = bool)
+
+    def command(self, index, roll, pitch, yawrate, thrust):
+        """
+        Sets the setpoint of one quadrotor, as ``commander.send_setpoint`` does.
+        """
+        if thrust == 0:
+            self.locked[index] = False
+        self.setpoint[index] = roll, pitch, yawrate, thrust
+
+    def step(self, dt):
+        """
+        Integrates all quadrotors over ``dt`` seconds.
+        """
+        roll, pitch = np.radians(self.setpoint[:, 0]), np.radians(self.setpoint[:, 1])
+        thrust      = np.where(self.locked, 0.0, self.setpoint[:, 3]) / self.C
+
+        lag = min(dt / self.tau, 1.0)
+        self.att[:, 0] += (roll  - self.att[:, 0]) * lag
+        self.att[:, 1] += (pitch - self.att[:, 1]) * lag
+        self.att[:, 2] += np.radians(self.setpoint[:, 2]) * dt
+
+        # thrust along the body z axis, R e_z for R = Rz(yaw) Ry(pitch) Rx(roll)
+        (sr, sp, sy), (cr, cp, cy) = np.sin(self.att.T), np.cos(self.att.T)
+        acc = np.empty((self.count, 3))
+        acc[:, 0] = cy * sp * cr + sy * sr
+        acc[:, 1] = sy * sp * cr - cy * sr
+        acc[:, 2] = cp * cr
+        acc *= (thrust / self.m)[:, None]
+        acc[:, 2] -= self.g
+        acc -= self.vel * (self.drag / self.m)
+
+        self.vel += acc * dt
+        self.pos += self.vel * dt
+
+        # the floor stops everything that is not lifting off
+        grounded = self.pos[:, 2] <= 0.0
+        self.pos[grounded, 2] = 0.0
+        self.vel[grounded]    = np.where(self.vel[grounded, 2:3] < 0, 0.0, self.vel[grounded])
+
+    def quaternion(self):
+        """
+        The attitudes as quaternions ``(w, x, y, z)``, shape ``(count, 4)``.
+        """
+        (sr, sp, sy), (cr, cp, cy) = np.sin(self.att.T / 2), np.cos(self.att.T / 2)
+        return np.stack([ cr * cp * cy + sr * sp * sy
+                        , sr * cp * cy - cr * sp * sy
+                        , cr * sp * cy + sr * cp * sy
+                        , cr * cp * sy - sr * sp * cy
+                        ], axis = -1)
+
+    def rotation(self):
+        """
+        The attitudes as rotation matrices from body to world, shape ``(count, 3, 3)``.
+        """
+        (sr, sp, sy), (cr, cp, cy) = np.sin(self.att.T), np.cos(self.att.T)
+        return np.stack([ np.stack([cy * cp, cy * sp * sr - sy * cr, cy * sp * cr + sy * sr], axis = -1)
+                        , np.stack([sy * cp, sy * sp * sr + cy * cr, sy * sp * cr - cy * sr], axis = -1)
+                        , np.stack([    -sp,                cp * sr,                cp * cr], axis = -1)
+                        ], axis = -2)
+
+
+class SimulatedCommander():
+    def __init__(self, cf):
+        self.cf = cf
+
+    def send_setpoint(self, roll, pitch, yawrate, thrust):
+        with self.cf.lock:
+            self.cf.model.command(self.cf.index, roll, pitch, yawrate, thrust)
+            self.cf.last_setpoint = self.cf.clock.monotonic()
+
+
+class SimulatedParam():
+    def __init__(self, cf):
+        self.cf     = cf
+        self.values = {}
+
+    def set_value(self, complete_name, value):
+        self.values[complete_name] = value
+        # the estimate starts to converge again once the reset is released
+        if complete_name == 'kalman.resetEstimation' and str(value) == '0':
+            self.cf.reset_at = self.cf.clock.monotonic()
+
+
+class SimulatedLog():
+    """
+    Validates cflib ``LogConfig``s against the simulated TOC and streams the
+    started ones.
+    """
+    def __init__(self, cf):
+        self.cf         = cf
+        self.log_blocks = []
+        self.started    = []
+
+    def add_config(self, logconf):
+        size = 0
+        for var in logconf.variables:
+            if var.name not in self.cf.toc:
+                logconf.valid = False
+                raise KeyError('Variable {} not in TOC'.format(var.name))
+            size += LogTocElement.get_size_from_id(var.fetch_as)
+
+        if size > LOG_BLOCK_SIZE or not 0 < logconf.period < 0xFF:
+            logconf.valid = False
+            raise AttributeError('The log configuration is too large or has an invalid parameter')
+
+        logconf.valid = True
+        logconf.cf    = self.cf
+        logconf.id    = len(self.log_blocks)
+        # there is no link to send the block over, the simulator streams it
+        logconf.start = lambda: self.start(logconf)
+        logconf.stop  = lambda: self.stop(logconf)
+        self.log_blocks.append(logconf)
+
+    def start(self, logconf):
+        with self.cf.lock:
+            # the period is in units of 10ms
+            self.started.append([logconf, self.cf.clock.monotonic() + logconf.period / 100.0])
+
+    def stop(self, logconf):
+        with self.cf.lock:
+            self.started = [block for block in self.started if block[0] is not logconf]
+
+
+class SimulatedCrazyflie():
+    """
+    Stands in for ``cflib.crazyflie.Crazyflie``.
+    """
+    link = None
+
+    def __init__(self, position = (0.0, 0.0, 0.0), clock = None, rate = 500, noise = 0.0, timeout = 0.5, seed = 0,
+                 convergence = 0.1):
+        """
+        :param position: the initial position
+        :param clock: the ``SimulatedClock``, a real-time one by default
+        :param rate: how often the model is integrated [Hz]
+        :param noise: standard deviation of the logged position [m]
+        :param timeout: the motors stop without a new setpoint for that long [s]
+        :param seed: of the position noise
+        :param convergence: time constant of the position variance after an
+                            estimator reset [s]
+        """
+        self.clock   = clock if clock is not None else SimulatedClock()
+        self.model   = Quadrotor(position = position)
+        self.index   = 0
+        self.rate    = rate
+        self.noise   = noise
+        self.timeout = timeout
+        self.lock    = Lock()
+        self.random  = np.random.RandomState(seed)
+
+        self.convergence = convergence
+        self.reset_at    = self.clock.monotonic()
+
+        self.connected         = Caller()
+        self.disconnected      = Caller()
+        self.connection_failed = Caller()
+        self.connection_lost   = Caller()
+
+        self.commander = SimulatedCommander(self)
+        self.param     = SimulatedParam(self)
+        self.log       = SimulatedLog(self)
+
+        self.toc = { 'stabilizer.roll'  : lambda s: np.degrees(s['att'][0])
+                   , 'stabilizer.pitch' : lambda s: np.degrees(s['att'][1])
+                   , 'stabilizer.yaw'   : lambda s: np.degrees(s['att'][2])
+                   , 'kalman.stateX'    : lambda s: s['pos'][0]
+                   , 'kalman.stateY'    : lambda s: s['pos'][1]
+                   , 'kalman.stateZ'    : lambda s: s['pos'][2]
+                   , 'kalman.statePX'   : lambda s: s['vel_bf'][0]
+                   , 'kalman.statePY'   : lambda s: s['vel_bf'][1]
+                   , 'kalman.statePZ'   : lambda s: s['vel_bf'][2]
+                   , 'kalman.q0'        : lambda s: s['q'][0]
+                   , 'kalman.q1'        : lambda s: s['q'][1]
+                   , 'kalman.q2'        : lambda s: s['q'][2]
+                   , 'kalman.q3'        : lambda s: s['q'][3]
+                   , 'kalman.varPX'     : lambda s: s['var']
+                   , 'kalman.varPY'     : lambda s: s['var']
+                   , 'kalman.varPZ'     : lambda s: s['var']
+                   }
+
+        self.link_uri      = None
+        self.running       = False
+        self.thread        = None
+        self.last_setpoint = 0.0
+
+    def open_link(self, link_uri):
+        self.link_uri = link_uri
+        self.running  = True
+        self.thread   = Thread(target = self._run, daemon = True)
+        self.thread.start()
+
+    def close_link(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            self.disconnected.call(self.link_uri)
+
+    def is_connected(self):
+        return self.running
+
+    def _estimate(self):
+        i   = self.index
+        R   = self.model.rotation()[i]
+        pos = self.model.pos[i]
+        if self.noise > 0:
+            pos = pos + self.random.normal(0.0, self.noise, 3)
+        # the variance drops from 1m^2 after a reset to that of the noise
+        since = self.clock.monotonic() - self.reset_at
+        return { 'pos'    : pos
+               , 'vel_bf' : R.T.dot(self.model.vel[i])
+               , 'q'      : self.model.quaternion()[i]
+               , 'att'    : self.model.att[i]
+               , 'var'    : self.noise**2 + np.exp(-since / self.convergence)
+               }
+
+    def _run(self):
+        self.connected.call(self.link_uri)
+
+        dt    = 1.0 / self.rate
+        # sleeping only, busy-waiting would starve the control loop
+        clock = PeriodicScheduler(dt, busy_wait = 0.0, clock = self.clock)
+        clock.start()
+        while self.running:
+            now = self.clock.monotonic()
+            with self.lock:
+                if now - self.last_setpoint > self.timeout:
+                    self.model.setpoint[self.index, 3] = 0.0
+                self.model.step(dt)
+
+                due = [block for block in self.log.started if block[1] <= now]
+                if due:
+                    estimate = self._estimate()
+                for block in due:
+                    block[1] += block[0].period / 100.0
+
+            timestamp = int(now * 1e3)
+            for logconf, _ in due:
+                data = { var.name : fetch(self.toc[var.name](estimate), var.fetch_as) for var in logconf.variables }
+                logconf.data_received_cb.call(timestamp, data, logconf)
+            clock.wait()
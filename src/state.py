@@ -0,0 +1,165 @@
+# A store for the state estimate of the crazyflie that is written by the
+# cflib log callbacks and read by the control loop.
+#
+# The store keeps two buffers. A writer copies the current buffer into the
+# other one, updates it, and publishes it by switching the index, so the
+# published buffer is never written to. Readers copy the published buffer and
+# check a sequence number, like a seqlock, and retry in the rare case that two
+# updates were published while they were copying. Every field carries the
+# monotonic time it was received at and the timestamp of the crazyflie, so
+# the control loop knows how old the data it flies on is.
+#
+# SharedState is a seqlock in shared memory for one writer and readers in
+# other processes, e.g. the control loop publishing its state to the servers:
+# the writer never waits, and readers retry if the state changed while they
+# copied it.
+
+import time
+from multiprocessing import RawArray
+from threading import Lock
+
+import numpy as np
+
+
+class StateSnapshot():
+    """
+    A consistent copy of all fields of a ``StateStore``. Fields are available
+    as attributes, e.g. ``snapshot.pos``.
+    """
+    def __init__(self, store, data, sequence):
+        self.sequence  = sequence
+        self.data      = data
+        self.received  = {}
+        self.timestamp = {}
+        for name, (start, end, stamp) in store.layout.items():
+            setattr(self, name, data[start:end])
+            self.received[name]  = data[stamp]
+            self.timestamp[name] = data[stamp + 1]
+
+    def age(self, name, now = None):
+        """
+        How long ago a field was received, in seconds; ``inf`` if never.
+        """
+        if self.received[name] == 0.0:
+            return float('inf')
+        return (time.monotonic() if now is None else now) - self.received[name]
+
+
+class StateStore():
+    """
+    Double-buffered, timestamped fields of fixed size.
+    """
+    def __init__(self, fields, initial = None, clock = time):
+        """
+        :param fields: dict from field names to their number of values
+        :param initial: optional dict of initial values
+        :param clock: provides ``monotonic``, the ``time`` module by default
+        """
+        self.layout = {}
+        offset = 0
+        for name, size in fields.items():
+            # values, followed by the time of reception and the crazyflie's timestamp
+            self.layout[name] = (offset, offset + size, offset + size)
+            offset += size + 2
+
+        self.buffers  = [np.zeros(offset), np.zeros(offset)]
+        self.active   = 0
+        self.sequence = 0
+        self.lock     = Lock()
+        self.clock    = clock
+
+        for name, values in (initial or {}).items():
+            start, end, _ = self.layout[name]
+            self.buffers[0][start:end] = values
+
+    def publish(self, timestamp = 0, **fields):
+        """
+        Updates one or more fields at once.
+
+        :param timestamp: the timestamp of the crazyflie for the data
+        :param fields: new values by field name
+        """
+        received = self.clock.monotonic()
+        with self.lock:
+            back = self.buffers[1 - self.active]
+            back[:] = self.buffers[self.active]
+            for name, values in fields.items():
+                start, end, stamp = self.layout[name]
+                back[start:end]   = values
+                back[stamp]       = received
+                back[stamp + 1]   = timestamp
+
+            # odd while switching, so that readers notice
+            self.sequence += 1
+            self.active    = 1 - self.active
+            self.sequence += 1
+
+    def snapshot(self):
+        """
+        A consistent copy of all fields.
+
+        :return: the ``StateSnapshot``
+        """
+        while True:
+            sequence = self.sequence
+            data     = self.buffers[self.active].copy()
+            if sequence == self.sequence and sequence % 2 == 0:
+                return StateSnapshot(self, data, sequence)
+
+
+class SharedState():
+    """
+    Fields of fixed size in shared memory, written by one process and read by
+    any. Pass it to the reading processes when they are started.
+    """
+    def __init__(self, fields):
+        """
+        :param fields: dict from field names to their number of values
+        """
+        self.layout = {}
+        # the sequence number comes first
+        offset = 1
+        for name, size in fields.items():
+            self.layout[name] = (offset, offset + size)
+            offset += size
+
+        self.array = RawArray('d', offset)
+        self.data  = np.frombuffer(self.array)
+
+    def __getstate__(self):
+        return { 'layout' : self.layout, 'array' : self.array }
+
+    def __setstate__(self, state):
+        self.layout = state['layout']
+        self.array  = state['array']
+        self.data   = np.frombuffer(self.array)
+
+    def write(self, **fields):
+        """
+        Updates one or more fields at once. Only one process may write.
+        """
+        data     = self.data
+        sequence = data[0]
+        # odd while writing, so that readers notice
+        data[0] = sequence + 1
+        for name, values in fields.items():
+            start, end = self.layout[name]
+            data[start:end] = values
+        data[0] = sequence + 2
+
+    def read(self):
+        """
+        A consistent copy of all fields.
+
+        :return: the sequence number, which changes with every write, and a
+                 dict from field names to their values; ``(0, None)`` if
+                 nothing was written yet
+        """
+        data = self.data
+        while True:
+            sequence = data[0]
+            if sequence == 0:
+                return 0, None
+            copy = data.copy()
+            if sequence % 2 == 0 and data[0] == sequence:
+                return int(sequence), { name : copy[start:end] for name, (start, end) in self.layout.items() }
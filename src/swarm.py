@@ -0,0 +1,210 @@
+# A simulation engine for many crazyflies at once.
+#
+# The swarm steps the quadrotor models of all drones and their control laws in
+# single batched updates, so simulating twenty drones costs little more than
+# simulating one. Every drone consumes its own stream of commands like the
+# controller does: the next command is taken once the current reference
+# position has been reached. The streams take the controller's commands, which
+# call the methods of ``SwarmDrone``, or plain waypoints ``(x, y, z)``.
+#
+# The engine runs in simulated time as fast as it can, without threads, so
+# runs are deterministic and can be used to test scenarios in the rooms of
+# ``examples/``.
+
+from collections import deque
+
+import numpy as np
+
+from src.control_law import ControlGains, ControlState, control_step
+from src.simulator import Quadrotor
+
+
+class SwarmDrone():
+    """
+    One drone of the swarm, with the methods of the controller that commands
+    call.
+    """
+    def __init__(self, swarm, index):
+        self.swarm = swarm
+        self.index = index
+
+    @property
+    def pos(self):
+        return self.swarm.model.pos[self.index]
+
+    @property
+    def pos_ref(self):
+        return self.swarm.control.pos_ref[self.index]
+
+    def setAbsoluteTarget(self, x, y, z):
+        self.pos_ref[:] = x, y, z
+
+    def setRelativeTarget(self, dx, dy, dz):
+        target = self.pos_ref + np.r_[dx, dy, dz]
+        if self.swarm.planner is None:
+            self.pos_ref[:] = target
+        else:
+            # fly the planned path before the rest of the stream
+            path = self.swarm.planner(tuple(self.pos_ref), tuple(target))
+            self.swarm.streams[self.index].extendleft(reversed(path))
+
+    def setRelativeMission(self, distances, reorder = False):
+        for dx, dy, dz in reversed(distances):
+            self.swarm.streams[self.index].appendleft(RelativeTarget(dx, dy, dz))
+
+    def startMotors(self):
+        self.swarm.enable(self.index)
+
+    def stopMotors(self):
+        self.swarm.disable(self.index)
+
+    def land(self):
+        self.swarm.land(self.index)
+
+    def hover(self):
+        pass
+
+
+class RelativeTarget():
+    """
+    A relative move within a stream, taken when the previous one was reached.
+    """
+    def __init__(self, dx, dy, dz):
+        self.move = (dx, dy, dz)
+
+    def execute(self, drone):
+        drone.setRelativeTarget(*self.move)
+
+
+class Swarm():
+    """
+    Simulates ``count`` drones that start at the given positions.
+    """
+    def __init__(self, starts, rate = 50, substeps = 10, tolerance = 0.2, planner = None, gains = None,
+                 separation = True, **model):
+        """
+        :param starts: the start positions, shape ``(count, 3)``
+        :param rate: the rate of the control laws [Hz]
+        :param substeps: how many times the models are integrated per control period
+        :param tolerance: how close a drone has to get to its reference before it takes the next command [m]
+        :param planner: optional function from a start and a target to a list of waypoints,
+                        used for relative targets
+        :param gains: the ``ControlGains``, the controller's by default
+        :param separation: whether to keep track of the smallest distance between two drones,
+                           which costs quadratic time in the number of drones
+        :param model: further arguments for the ``Quadrotor`` model
+        """
+        starts = np.atleast_2d(np.asarray(starts, dtype = float))
+        self.count     = len(starts)
+        self.dt        = 1.0 / rate
+        self.substeps  = substeps
+        self.tolerance = tolerance
+        self.planner   = planner
+        self.time      = 0.0
+
+        self.model   = Quadrotor(count = self.count, position = starts, **model)
+        self.model.locked[:] = False
+        self.gains   = gains if gains is not None else ControlGains()
+        self.control = ControlState(self.count)
+        self.control.pos_ref[:] = starts
+
+        self.drones   = [SwarmDrone(self, i) for i in range(self.count)]
+        self.streams  = [deque() for _ in range(self.count)]
+        self.enabled  = np.zeros(self.count, dtype = bool)
+        self.landing  = np.zeros(self.count, dtype = bool)
+        # when each drone finished its stream, nan while it is busy
+        self.finished = np.full(self.count, np.nan)
+        self.separation     = separation
+        self.min_separation = float('inf')
+
+    def send(self, index, *commands):
+        """
+        Appends commands or waypoints to the stream of a drone.
+        """
+        self.streams[index].extend(commands)
+        self.finished[index] = np.nan
+
+    def enable(self, index):
+        # take off to 30cm above the current position, like the controller
+        self.control.pos_ref[index] = self.model.pos[index] + np.r_[0.0, 0.0, 0.3]
+        self.control.integral[index] = 0.0
+        self.enabled[index] = True
+
+    def disable(self, index):
+        self.enabled[index] = False
+        self.landing[index] = False
+
+    def land(self, index):
+        self.control.pos_ref[index, 2] = 0.0
+        self.landing[index] = True
+
+    def reached(self):
+        """
+        Which drones are within the tolerance of their reference position.
+        """
+        error = self.control.pos_ref - self.model.pos
+        return np.einsum('ij,ij->i', error, error) < self.tolerance**2
+
+    def dispatch(self, reached):
+        # landed drones stop their motors
+        landed = self.landing & (self.model.pos[:, 2] < 0.05)
+        for i in np.flatnonzero(landed):
+            self.disable(i)
+
+        # landing drones take their next command once they are on the floor
+        for i in np.flatnonzero((reached & ~self.landing) | ~self.enabled):
+            stream = self.streams[i]
+            if not stream:
+                if np.isnan(self.finished[i]):
+                    self.finished[i] = self.time
+                continue
+            command = stream.popleft()
+            if hasattr(command, 'execute'):
+                command.execute(self.drones[i])
+            else:
+                self.drones[i].setAbsoluteTarget(*command)
+
+    def step(self):
+        """
+        Advances all drones by one control period.
+        """
+        self.dispatch(self.reached())
+
+        control = self.control
+        control.pos[:] = self.model.pos
+        control.vel[:] = self.model.vel
+        out = control_step(self.gains, control, self.dt)
+
+        # the motors of disabled drones are off
+        out[~self.enabled] = 0.0
+        control.integral[~self.enabled] = 0.0
+        self.model.setpoint[:] = out
+        for _ in range(self.substeps):
+            self.model.step(self.dt / self.substeps)
+        self.time += self.dt
+
+        if self.separation and self.count > 1:
+            offsets    = self.model.pos[:, None, :] - self.model.pos[None, :, :]
+            distances  = np.einsum('ijk,ijk->ij', offsets, offsets)
+            np.fill_diagonal(distances, np.inf)
+            self.min_separation = min(self.min_separation, float(np.sqrt(distances.min())))
+
+    def busy(self):
+        """
+        Which drones have not finished their streams yet.
+        """
+        return np.isnan(self.finished)
+
+    def run(self, timeout = 600.0):
+        """
+        Steps until all drones have finished their streams.
+
+        :param timeout: in simulated seconds
+        :return: the simulated time it took
+        """
+        start = self.time
+        while self.busy().any():
+            if self.time - start > timeout:
+                raise Exception("{:d} drones did not finish within {:.0f}s!".format(int(self.busy().sum()), timeout))
+            self.step()
+        return self.time - start
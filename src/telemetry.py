@@ -0,0 +1,177 @@
+# Telemetry from the crazyflie over the radio link.
+#
+# The crazyflie streams log variables in log blocks of at most 26 bytes, one
+# radio packet and one callback per block and period. Instead of a log block
+# per group of variables, the variables are packed into as few blocks as fit,
+# and the variables of a block are published to the ``StateStore`` in one
+# update, so that fields that arrive together are also read together. With
+# ``fp16``, floats are sent as half-precision floats, which halves their size.
+#
+# Variables are grouped into fields that always go into the same block. Every
+# field can have its own period; only fields with the same period share a
+# block. Frames are timestamped when they arrive, and the intervals between
+# them are recorded per block.
+
+import logging
+import time
+
+from cflib.crazyflie.log import LogConfig, LogTocElement
+
+from src.metrics import Histogram
+
+log = logging.getLogger(__name__)
+
+# the largest log block that fits into a radio packet, in bytes
+LOG_BLOCK_SIZE = 26
+
+
+class TelemetryField():
+    """
+    Log variables that are always delivered together.
+    """
+    def __init__(self, name, variables, fetch_as = 'float', period_in_ms = None, convert = None):
+        """
+        :param name: the name of the field in the ``StateStore``
+        :param variables: the names of the log variables, e.g. ``'kalman.stateX'``
+        :param fetch_as: the type the variables are sent as
+        :param period_in_ms: the period of the field, the telemetry's by default
+        :param convert: optional function from the list of values to a dict of
+                        ``StateStore`` fields, ``{name : values}`` by default
+        """
+        self.name         = name
+        self.variables    = list(variables)
+        self.fetch_as     = fetch_as
+        self.period_in_ms = period_in_ms
+        self.convert      = convert
+
+    def values(self, data):
+        values = [data[variable] for variable in self.variables]
+        if self.convert is None:
+            return { self.name : values }
+        return self.convert(values)
+
+
+class Telemetry():
+    """
+    Packs fields into log blocks and publishes the blocks that arrive.
+    """
+    def __init__(self, fields, period_in_ms, periods = None, fp16 = False, block_size = LOG_BLOCK_SIZE, clock = time):
+        """
+        :param fields: the ``TelemetryField``s
+        :param period_in_ms: the period of fields without their own
+        :param periods: optional dict from field names to their periods [ms]
+        :param fp16: whether floats are sent as half-precision floats
+        :param block_size: the largest log block [bytes]
+        :param clock: provides ``monotonic``, the ``time`` module by default
+        """
+        self.fields     = fields
+        self.fp16       = fp16
+        self.block_size = block_size
+        self.clock      = clock
+        self.periods    = { field.name : (periods or {}).get(field.name, field.period_in_ms or period_in_ms)
+                            for field in fields
+                          }
+
+        for name in (periods or {}):
+            if name not in self.periods:
+                raise Exception("Unknown telemetry field: {}".format(name))
+
+        self.blocks   = self.pack()
+        self.ofBlock  = { logconf.name : fields for logconf, fields in self.blocks }
+
+        # arrival of the last frame and intervals between frames [ms], per block
+        self.arrived   = {}
+        self.intervals = { logconf.name : Histogram.exponential(0.5, 2, 12) for logconf, _ in self.blocks }
+        self.frames    = { logconf.name : 0 for logconf, _ in self.blocks }
+        self.publish   = None
+
+    def fetch_as(self, field):
+        return 'FP16' if self.fp16 and field.fetch_as == 'float' else field.fetch_as
+
+    def size(self, field):
+        """
+        The size of a field in a log block [bytes].
+        """
+        return len(field.variables) * LogTocElement.get_size_from_id(LogTocElement.get_id_from_cstring(self.fetch_as(field)))
+
+    def pack(self):
+        """
+        Packs the fields of every period into as few log blocks as possible,
+        largest fields first, each into the first block it fits into.
+
+        :return: list of (``LogConfig``, its fields)
+        """
+        byPeriod = {}
+        for field in self.fields:
+            if self.size(field) > self.block_size:
+                raise Exception("Telemetry field {} does not fit into a log block!".format(field.name))
+            byPeriod.setdefault(self.periods[field.name], []).append(field)
+
+        blocks = []
+        for period, fields in sorted(byPeriod.items()):
+            bins = []
+            for field in sorted(fields, key = self.size, reverse = True):
+                for fieldsOfBin in bins:
+                    if sum(map(self.size, fieldsOfBin)) + self.size(field) <= self.block_size:
+                        fieldsOfBin.append(field)
+                        break
+                else:
+                    bins.append([field])
+
+            for fieldsOfBin in bins:
+                logconf = LogConfig(name = '+'.join(field.name for field in fieldsOfBin), period_in_ms = period)
+                for field in fieldsOfBin:
+                    for variable in field.variables:
+                        logconf.add_variable(variable, self.fetch_as(field))
+                blocks.append((logconf, fieldsOfBin))
+        return blocks
+
+    def start(self, cf, publish):
+        """
+        Adds the log blocks to a crazyflie and starts them.
+
+        :param cf: the ``Crazyflie``
+        :param publish: called with the crazyflie's timestamp and the fields of
+                        a block, e.g. ``StateStore.publish``
+        """
+        self.publish = publish
+        for logconf, _ in self.blocks:
+            cf.log.add_config(logconf)
+
+        if not all(logconf.valid for logconf, _ in self.blocks):
+            raise RuntimeError('One or more of the variables in the configuration was not'
+                               'found in log TOC. Will not get any position data.')
+
+        for logconf, _ in self.blocks:
+            logconf.data_received_cb.add_callback(self._received)
+            logconf.error_cb.add_callback(self._error)
+            logconf.start()
+
+    def _received(self, timestamp, data, logconf):
+        now  = self.clock.monotonic()
+        last = self.arrived.get(logconf.name)
+        if last is not None:
+            self.intervals[logconf.name].observe((now - last) * 1e3)
+        self.arrived[logconf.name] = now
+        self.frames[logconf.name] += 1
+
+        values = {}
+        for field in self.ofBlock[logconf.name]:
+            values.update(field.values(data))
+        self.publish(timestamp, **values)
+
+    def _error(self, logconf, msg):
+        log.error('Error when logging %s: %s', logconf.name, msg)
+
+    def stats(self):
+        """
+        Per log block, its size, the number of frames received, and the
+        intervals between them.
+        """
+        return { logconf.name : { "bytes"     : sum(self.size(field) for field in fields)
+                                , "period"    : self.periods[fields[0].name]
+                                , "frames"    : self.frames[logconf.name]
+                                , "intervals" : self.intervals[logconf.name].snapshot()
+                                }
+                 for logconf, fields in self.blocks
+               }
@@ -1,11 +1,19 @@
 import json
+import logging
 import Levenshtein
 from num2words import num2words
 import operator
+import queue
 import requests
 import speech_recognition as sr
+import time
+from threading import Event, Thread
 from word2number import w2n
 
+from src.metrics import Histogram, REGISTRY
+
+log = logging.getLogger(__name__)
+
 """
 This module implements the voice control functionality.
 """
@@ -27,6 +35,123 @@ directions = [
     land_word
 ]
 
+# how long the speech recognition takes per utterance, and how long it takes
+# from the end of an utterance until it is recognized, in ms
+recognition_latency = REGISTRY.histogram('voice_recognition_latency_milliseconds',
+                                         'Time to recognize an utterance',
+                                         Histogram.exponential(10, 2, 12))
+command_latency = REGISTRY.histogram('voice_command_latency_milliseconds',
+                                     'Time from the end of an utterance until it was recognized',
+                                     Histogram.exponential(10, 2, 12))
+dropped_utterances = REGISTRY.counter('voice_dropped_utterances_total',
+                                      'Utterances dropped because recognition fell behind',
+                                      lambda: VoiceCapture.dropped)
+
+
+class VoiceCapture():
+    """
+    Listens to the microphone in a background thread and queues every
+    utterance as it ends, so that nothing is missed while the previous one is
+    recognized. The microphone stays open, the energy threshold that separates
+    speech from silence is calibrated once, and then follows the ambient noise
+    during the pauses between utterances.
+    """
+    # utterances dropped by all captures, for the metrics
+    dropped = 0
+
+    def __init__(self, recognizer, mic, calibration = 1.0, phrase_time_limit = 5.0, backlog = 4):
+        """
+        :param recognizer: speech_recognition Recognizer object
+        :param mic: speech_recognition Microphone object
+        :param calibration: how long to listen to the ambient noise at the start [s]
+        :param phrase_time_limit: the longest utterance [s]
+        :param backlog: how many utterances wait for recognition at most; the
+                        oldest one is dropped when another one ends
+        """
+        self.recognizer        = recognizer
+        self.mic               = mic
+        self.calibration       = calibration
+        self.phrase_time_limit = phrase_time_limit
+        self.utterances        = queue.Queue(maxsize = backlog)
+        self.ready             = Event()
+        self.running           = False
+        self.thread            = None
+        self.error             = None
+
+    def start(self):
+        """
+        Starts listening and returns once the threshold is calibrated.
+
+        :raises: what opening the microphone raised
+        """
+        self.recognizer.dynamic_energy_threshold = True
+        self.running = True
+        self.thread  = Thread(target = self._listen, daemon = True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def stop(self):
+        """
+        Stops listening, within a second.
+        """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def get(self, timeout = None):
+        """
+        The next utterance.
+
+        :param timeout: how long to wait for one [s], forever by default
+        :return: the ``AudioData`` and when it ended, from ``time.monotonic``
+        :raises queue.Empty: if there was none within the timeout
+        :raises RuntimeError: if the capture stopped listening
+        """
+        utterance = self.utterances.get(timeout = timeout)
+        if utterance is None:
+            # for the next call
+            self.utterances.put(None)
+            raise RuntimeError('Stopped listening to the microphone') from self.error
+        return utterance
+
+    def _listen(self):
+        try:
+            with self.mic as source:
+                self.recognizer.adjust_for_ambient_noise(source, self.calibration)
+                log.info('Calibrated the energy threshold to %.0f', self.recognizer.energy_threshold)
+                self.ready.set()
+                while self.running:
+                    try:
+                        # return every second without speech to check whether we should stop
+                        audio = self.recognizer.listen(source, timeout = 1, phrase_time_limit = self.phrase_time_limit)
+                    except sr.WaitTimeoutError:
+                        continue
+                    self._put((audio, time.monotonic()))
+        except Exception as e:
+            self.error = e
+            log.error('Listening failed: %s', e)
+        finally:
+            self.running = False
+            self._put(None)
+            self.ready.set()
+
+    def _put(self, utterance):
+        while True:
+            try:
+                self.utterances.put_nowait(utterance)
+                return
+            except queue.Full:
+                pass
+            try:
+                self.utterances.get_nowait()
+                VoiceCapture.dropped += 1
+                log.warning('Recognition fell behind, dropped an utterance')
+            except queue.Empty:
+                pass
+
 
 def generate_protocol_data(direction, distance):
     """
@@ -77,20 +202,20 @@ def get_best_direction_match(direction_input):
     return None
 
 
-def listen(recognizer, mic, keywords, uses_google_api):
+def listen(capture, keywords, uses_google_api):
     """
-    Listens for a set of (keyword, priority) tuples and returns the response
+    Waits for the next utterance, listens for a set of (keyword, priority)
+    tuples in it, and returns the response
 
-    :param recognizer: speech_recognition Recognizer object
-    :param mic: speech_recognition Microphone object
+    :param capture: the started VoiceCapture
     :param keywords: Iterable of (keyword, priority) tuples
     :param uses_google_api: True if Google API should be used
     :return: response string
     """
     response = None
-    with mic as source:
-        recognizer.adjust_for_ambient_noise(source)
-        audio = recognizer.listen(source)
+    recognizer = capture.recognizer
+    audio, ended = capture.get()
+    recognitionStart = time.monotonic()
     try:
         if uses_google_api:
             response = recognizer.recognize_google(audio)
@@ -98,9 +223,11 @@ def listen(recognizer, mic, keywords, uses_google_api):
             response = recognizer.recognize_sphinx(audio,
                                                     keyword_entries=keywords)
     except sr.RequestError:
-        print('Voice control setup missing or not working.')
+        log.error('Voice control setup missing or not working.')
     except sr.UnknownValueError:
-        print('Could not recognize speech')
+        log.info('Could not recognize speech')
+    recognition_latency.observe((time.monotonic() - recognitionStart) * 1e3)
+    command_latency.observe((time.monotonic() - ended) * 1e3)
     return response
 
 
@@ -114,6 +241,8 @@ def start_command_loop(server_url, voice_api):
 
     recognizer = sr.Recognizer()
     mic = sr.Microphone()
+    # calibrates once, then keeps listening while we recognize
+    capture = VoiceCapture(recognizer, mic)
 
     if voice_api == 'google' or voice_api is None:
         uses_google_api = True
@@ -142,16 +271,17 @@ def start_command_loop(server_url, voice_api):
         'distance': ''
     }
 
+    capture.start()
     while True:
-        print('Waiting for code word...')
-        term = listen(recognizer, mic, keyword_entries['code_word'],
+        log.info('Waiting for code word...')
+        term = listen(capture, keyword_entries['code_word'],
                       uses_google_api)
-        print(term)
+        log.debug('Heard: %s', term)
         if term:
             first_word = term.split()[0]
             if len(term.split()) > 1 and code_word in first_word.lower():
-                print(f'Code word received.')
-                print('Getting direction...')
+                log.info('Code word received.')
+                log.info('Getting direction...')
                 direction_term = term.split()[1]
                 if direction_term == '*':
                     direction_term = start_word
@@ -159,16 +289,16 @@ def start_command_loop(server_url, voice_api):
                     get_best_direction_match(direction_term)
                 if best_direction_match:
                     responses['direction'] = best_direction_match
-                    print(f'Direction received: {responses["direction"]}')
+                    log.info('Direction received: %s', responses['direction'])
                     if len(term.split()) > 2:
-                        print('Getting distance...')
+                        log.info('Getting distance...')
                         direction_term = term.split()[2]
                         distance = None
                         if uses_google_api:
                             try:
                                 distance = int(direction_term)
                             except (ValueError, TypeError):
-                                print(f'{direction_term} is not a number')
+                                log.warning('%s is not a number', direction_term)
                             if distance and distance in distances:
                                 responses['distance'] = distance
                         else:
@@ -176,7 +306,7 @@ def start_command_loop(server_url, voice_api):
                                 distance = w2n.word_to_num(direction_term)
                                 responses['distance'] = distance
                         if distance:
-                            print(f'Distance received: {responses["distance"]}')
+                            log.info('Distance received: %s', responses['distance'])
                             data = generate_protocol_data(
                                 responses['direction'],
                                 responses['distance']
@@ -185,9 +315,9 @@ def start_command_loop(server_url, voice_api):
                                 command_request = requests.post(
                                     server_url, data=json.dumps(data))
                                 res_content = command_request.content
-                                print(f'Send data to server with result: {res_content}')
+                                log.info('Send data to server with result: %s', res_content)
                             except Exception as e:
-                                print(f'Failed to send request: {e}')
+                                log.error('Failed to send request: %s', e)
                             # break
                     else:
                         try:
@@ -198,7 +328,6 @@ def start_command_loop(server_url, voice_api):
                             command_request = requests.post(
                                 server_url, data=json.dumps(data))
                             res_content = command_request.content
-                            print(
-                                f'Send data to server with result: {res_content}')
+                            log.info('Send data to server with result: %s', res_content)
                         except Exception as e:
-                            print(f'Failed to send request: {e}')
+                            log.error('Failed to send request: %s', e)
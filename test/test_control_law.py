@@ -0,0 +1,44 @@
+import numpy as np
+
+from src.control_law import ControlGains, ControlState, control_step
+
+
+def reference(pos, vel, pos_ref, integral, dt):
+    # the control law as written out in the controller before
+    ex, ey, ez = pos_ref - pos
+    vx, vy, vz = vel
+    ix, iy, iz = integral + (pos_ref - pos) * dt
+
+    phi_ref    =      15 * ex - 15 * vx + 0 * ix
+    theta_ref  =   - (15 * ey - 15 * vy + 0 * iy)
+    thrust_ref = 100000 * (0.25 * ez - 0.15 * vz + 0.075 * iz + 0.0327 * 9.82)
+
+    return [np.clip(theta_ref, -30, 30), np.clip(phi_ref, -30, 30), 0.0, np.clip(thrust_ref, 0, 65535)]
+
+
+def test_single_state_matches_reference():
+    rng   = np.random.RandomState(0)
+    gains = ControlGains()
+    state = ControlState()
+
+    for _ in range(10):
+        state.pos[:], state.vel[:], state.pos_ref[:] = rng.randn(3, 3) * 0.5
+        integral = state.integral.copy()
+        expected = reference(state.pos, state.vel, state.pos_ref, integral, 0.02)
+
+        assert np.allclose(control_step(gains, state, 0.02), expected)
+
+
+def test_batch_matches_single_states():
+    rng   = np.random.RandomState(1)
+    gains = ControlGains(height_proportional = np.linspace(0.25, 0.5, 100))
+    batch = ControlState(100)
+    batch.pos[:], batch.vel[:], batch.pos_ref[:] = rng.randn(3, 100, 3) * 0.5
+    control_step(gains, batch, 0.02)
+
+    for i in [0, 42, 99]:
+        single = ControlState()
+        single.pos[:], single.vel[:], single.pos_ref[:] = batch.pos[i], batch.vel[i], batch.pos_ref[i]
+        out = control_step(ControlGains(height_proportional = 0.25 + 0.25 * i / 99), single, 0.02)
+
+        assert np.allclose(out, batch.out[i])
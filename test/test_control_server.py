@@ -0,0 +1,43 @@
+import queue
+from json import dumps
+from threading import Thread
+
+import pytest
+import requests
+
+pytest.importorskip("tf")
+
+from src.ControlServer import make_server
+
+
+@pytest.fixture
+def server():
+    server = make_server("127.0.0.1", 0, [queue.Queue(), queue.Queue()], [queue.Queue(), queue.Queue()])
+    Thread(target = server.serve_forever, daemon = True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, request):
+    return requests.post("http://127.0.0.1:{}".format(server.server_address[1]), data = dumps(request)).json()
+
+
+def test_commands_are_routed_by_drone(server):
+    assert "ok" in post(server, { "drone" : 1, "distance" : [1, 0, 0] })
+    assert "ok" in post(server, { "distance" : [0, 2, 0] })
+
+    assert server.commandQueues[0].get_nowait().dy == 2
+    assert server.commandQueues[1].get_nowait().dx == 1
+    assert server.commandQueues[0].empty() and server.commandQueues[1].empty()
+
+    for drone in [2, -1, True, "1"]:
+        assert "error" in post(server, { "drone" : drone, "distance" : [1, 0, 0] })
+
+
+def test_stop_goes_to_the_control_queue_of_the_drone(server):
+    assert "ok" in post(server, { "drone" : 1, "command" : "stop" })
+
+    assert server.controlQueues[1].qsize() == 1
+    assert server.controlQueues[0].empty()
+    assert server.commandQueues[0].empty() and server.commandQueues[1].empty()
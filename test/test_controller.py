@@ -0,0 +1,60 @@
+import queue
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("tf")
+
+from src.controller import ControllerThread, HoldCommand, PathCommand, StopCommand
+from src.simulator import SimulatedClock, SimulatedCrazyflie
+
+
+@pytest.fixture
+def control():
+    cf = SimulatedCrazyflie(position = (0.5, 0.5, 0.5), clock = SimulatedClock(10))
+    control = ControllerThread(cf, queue.Queue(), control_queue = queue.Queue(), time_source = cf.clock)
+    control.pos = np.r_[0.5, 0.5, 0.5]
+    control.enable()
+    return control
+
+
+def tick(control):
+    """Handles the commands like one tick of the control loop"""
+    urgent = control.receive_control_commands()
+    control.receive_commands()
+    control.next_target()
+    control.observe_control_latency(urgent)
+
+
+def send(control, command, delay = 0.005):
+    command.received = time.monotonic() - delay
+    control.controlQueue.put(command)
+
+
+def test_hold_preempts_the_path_within_one_tick(control):
+    control.commandQueue.put(PathCommand([(0.6, 0.5, 0.5), (0.7, 0.5, 0.5), (0.8, 0.5, 0.5)]))
+    tick(control)
+    assert control.pos_ref.tolist() == [0.6, 0.5, 0.5] and len(control.waypoints) == 2
+
+    send(control, HoldCommand())
+    tick(control)
+    assert control.pos_ref.tolist() == [0.5, 0.5, 0.5] and not control.waypoints
+    assert control.enabled
+
+    latency = control.control_latency.snapshot()
+    assert latency["count"] == 1 and latency["min"] >= 5
+
+
+def test_stop_preempts_the_path_within_one_tick(control):
+    control.commandQueue.put(PathCommand([(0.6, 0.5, 0.5), (0.7, 0.5, 0.5)]))
+    tick(control)
+
+    # the path of a plan that was requested before the stop arrives with it
+    plan = control.planner.lastPlan = next(control.planner.plans)
+    control.commandQueue.put(PathCommand([(0.5, 0.6, 0.5), (0.5, 0.7, 0.5)], plan = plan))
+    send(control, StopCommand())
+    tick(control)
+    assert not control.enabled and not control.waypoints
+    assert control.commandQueue.empty()
+    assert control.control_latency.snapshot()["count"] == 1
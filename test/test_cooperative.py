@@ -0,0 +1,53 @@
+from src.cooperative import CooperativePlanner
+from src.path import Cube, Point, Scale, Scene, Translate
+
+
+def make_scene():
+    # a corridor along y > 1.6 behind a wall
+    wall = Translate(Scale(Cube(), 0.2, 1.6, 1.0), 0.9, 0.0, 0.0)
+    return Scene(2.0, 2.0, 1.0, 0.1, [wall])
+
+
+def test_drones_swapping_through_a_corridor_keep_clear():
+    scene = make_scene()
+    left, right = Point(0.45, 1.75, 0.45), Point(1.55, 1.75, 0.45)
+
+    independent = [CooperativePlanner(scene).planPath(0, left, right)[:-1],
+                   CooperativePlanner(scene).planPath(1, right, left)[:-1]]
+
+    planner = CooperativePlanner(scene)
+    cooperative = [planner.planPath(0, left, right), planner.planPath(1, right, left)]
+
+    assert planner.conflicts(independent) > 0
+    assert planner.conflicts([path[:-1] for path in cooperative]) == 0
+    assert cooperative[0][-1] == right and cooperative[1][-1] == left
+    for path in cooperative:
+        for point in path:
+            assert not scene.space[scene.getCoordinate(point)]
+
+
+def test_reservations_are_bounded_by_the_window():
+    scene   = make_scene()
+    planner = CooperativePlanner(scene, window = 5)
+    planner.planPath(0, Point(0.45, 1.75, 0.45), Point(1.55, 1.75, 0.45))
+
+    table = planner.table
+    assert max(table.slots) < 5 + table.slack
+    # every step reserves the cells around the drone in 2 * slack + 1 slots
+    assert table.size() <= 5 * (2 * table.slack + 1) * len(table.offsets) + len(table.offsets)
+
+    table.expire(10)
+    assert table.slots == {}
+
+
+def test_replanning_releases_the_old_trajectory():
+    scene   = make_scene()
+    planner = CooperativePlanner(scene)
+    planner.planPath(0, Point(0.45, 1.75, 0.45), Point(1.55, 1.75, 0.45))
+    first = planner.table.size()
+
+    planner.planPath(0, Point(0.45, 0.45, 0.45), Point(0.45, 1.05, 0.45))
+    assert planner.table.size() < first
+
+    planner.table.release(0)
+    assert planner.table.size() == 0
@@ -0,0 +1,39 @@
+import pytest
+
+from src.estimator import reset_estimator
+from src.simulator import SimulatedClock, SimulatedCrazyflie
+
+
+def test_returns_once_the_estimate_converged():
+    clock = SimulatedClock(10)
+    cf    = SimulatedCrazyflie(clock = clock, convergence = 0.1)
+    cf.open_link('sim://0')
+    try:
+        seconds = reset_estimator(cf, clock)
+    finally:
+        cf.close_link()
+
+    assert 0.3 < seconds < 1.5
+    assert cf.param.values['kalman.resetEstimation'] == '0'
+
+
+def test_times_out_if_the_estimate_does_not_converge():
+    clock = SimulatedClock(10)
+    cf    = SimulatedCrazyflie(clock = clock, convergence = 10.0)
+    cf.open_link('sim://0')
+    try:
+        with pytest.raises(RuntimeError):
+            reset_estimator(cf, clock, timeout = 1.0)
+    finally:
+        cf.close_link()
+
+
+def test_times_out_if_the_variances_are_flat_but_high():
+    clock = SimulatedClock(10)
+    cf    = SimulatedCrazyflie(clock = clock, convergence = 1e6)
+    cf.open_link('sim://0')
+    try:
+        with pytest.raises(RuntimeError):
+            reset_estimator(cf, clock, timeout = 1.0)
+    finally:
+        cf.close_link()
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+
+from src.control_law import ControlGains, ControlState, control_step
+from src.flight_log import FlightLog, analyze, replay
+from src.flight_recorder import FLIGHT_COLUMNS, FlightRecorder, export_csv
+
+
+def record(path, period = 0.02):
+    """
+    Flies two waypoints with the control law and a point mass, recording like
+    the controller does, with the motors disabled for a second in between.
+    """
+    gains, control = ControlGains(), ControlState()
+    pos, vel = np.zeros(3), np.zeros(3)
+    t = 0.0
+    with FlightRecorder(path, FLIGHT_COLUMNS, capacity = 1024, block = 64, metadata = { "period" : period }) as recorder:
+        for target in [(0.0, 0.0, 0.5), (1.0, 0.0, 0.5)]:
+            control.reset()
+            for _ in range(500):
+                control.pos[:], control.vel[:], control.pos_ref[:] = pos, vel, target
+                out = control_step(gains, control, period).copy()
+                row = np.zeros(len(FLIGHT_COLUMNS))
+                row[0], row[1:5], row[5:8], row[9:12], row[12:15] = t, out, target, pos, vel
+                row[4] = int(out[3])
+                recorder.record(row)
+
+                acceleration = np.r_[9.82 * np.radians([out[1], -out[0]]), out[3] / gains.C / 0.0327 - 9.82]
+                vel = vel + acceleration * period
+                pos = pos + vel * period
+                t  += period
+            t += 1.0
+    assert recorder.dropped == 0
+
+
+def test_flight_log_is_analyzed_and_replayed(tmp_path):
+    path = str(tmp_path / 'flightlog.bin')
+    record(path)
+
+    log = FlightLog(path)
+    assert len(log) == 1000 and os.path.exists(log.cache)
+    assert log.metadata["period"] == 0.02
+    assert list(log.segments()) == [0, 500]
+
+    report = analyze(log)
+    assert report["segments"] == 2
+    assert len(report["waypoints"]["settle"]) == 2 and not np.isnan(report["waypoints"]["settle"]).any()
+    assert report["deadlines"]["missed"] == 0 and report["deadlines"]["intervals"] == 998
+    assert 0 <= report["saturation"]["pitch_r"] < 1
+
+    # the recorded control signals follow from the recorded states
+    differences = replay(log, chunk = 300)
+    assert all(difference["max"] < 1e-6 for difference in differences.values())
+    assert replay(log, ControlGains(height_integral = 1.0))["thrust_r"]["max"] > 1
+
+    # the CSV export has the same columns and is cached on its own
+    export_csv(path, str(tmp_path / 'flightlog.csv'))
+    exported = FlightLog(str(tmp_path / 'flightlog.csv'))
+    assert exported.columns == log.columns
+    assert np.allclose(exported['z'], log['z'])
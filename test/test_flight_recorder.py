@@ -0,0 +1,25 @@
+import numpy as np
+
+from src.flight_recorder import FlightRecorder, export_csv, read
+
+
+def test_recorded_rows_are_read_back(tmp_path):
+    path = str(tmp_path / 'flightlog.bin')
+
+    with FlightRecorder(path, ['t', 'x', 'y'], capacity = 8, block = 4) as recorder:
+        for i in range(20):
+            row = recorder.claim()
+            if row is not None:
+                row[0], row[1:3] = i, (2 * i, 3 * i)
+                recorder.commit()
+
+    # rows are only dropped when the writer falls behind
+    columns, rows = read(path)
+    assert columns == ['t', 'x', 'y']
+    assert len(rows) == 20 - recorder.dropped
+    assert (rows[:, 1] == 2 * rows[:, 0]).all()
+    assert (np.diff(rows[:, 0]) > 0).all()
+
+    assert export_csv(path, str(tmp_path / 'flightlog.csv')) == len(rows)
+    assert open(str(tmp_path / 'flightlog.csv')).readline().strip() == 't,x,y'
+    assert np.allclose(np.loadtxt(str(tmp_path / 'flightlog.csv'), delimiter = ',', skiprows = 1), rows)
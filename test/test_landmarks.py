@@ -0,0 +1,36 @@
+from src.landmarks import Landmarks
+from src.path import Cube, Point, Scale, Scene, SearchState, Translate
+
+
+def make_scene():
+    wall = Translate(Scale(Cube(), 0.2, 1.6, 1.0), 0.9, 0.0, 0.0)
+    return Scene(2.0, 2.0, 1.0, 0.1, [wall])
+
+
+def test_landmarks_keep_paths_optimal():
+    scene = make_scene()
+    start, target = Point(0.45, 0.45, 0.45), Point(1.55, 0.45, 0.45)
+    startCell, targetCell = scene.getCoordinate(start), scene.getCoordinate(target)
+    length = lambda path: sum(a.distanceTo(b) for a, b in zip(path, path[1:]))
+
+    state     = SearchState(scene)
+    euclidean = length(scene.search(startCell, targetCell, target, state))
+    before    = state.expansions
+
+    scene.landmarks = Landmarks.select(scene, count = 4)
+    assert len(scene.landmarks.cells) == 4
+
+    assert abs(length(scene.search(startCell, targetCell, target, state)) - euclidean) < 1e-9
+    assert state.expansions < before
+
+
+def test_landmarks_save_load(tmp_path):
+    scene     = make_scene()
+    landmarks = Landmarks.select(scene, count = 2, digest = 'abc')
+    landmarks.save(str(tmp_path / 'room.landmarks.npz'))
+
+    loaded = Landmarks.load(str(tmp_path / 'room.landmarks.npz'))
+    assert loaded.cells == landmarks.cells
+    assert loaded.digest == 'abc'
+    assert loaded.matches(scene)
+    assert (loaded.lowerBounds(100) == landmarks.lowerBounds(100)).all()
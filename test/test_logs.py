@@ -0,0 +1,77 @@
+import io
+import logging
+
+import src.logs as logs
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+def record(line, **extra):
+    record = logging.LogRecord('src.test', logging.DEBUG, 'test.py', line, 'tick', None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_call_sites_are_rate_limited():
+    clock = Clock()
+    limit = logs.RateLimit(clock)
+
+    passed = []
+    for tick in range(10):
+        clock.now = tick * 0.5
+        passed.append(limit.filter(record(1, every = 2.0)))
+        # call sites are limited on their own, records without an interval not at all
+        assert limit.filter(record(2, every = 100.0)) == (tick == 0)
+        assert limit.filter(record(1))
+    assert passed == [True, False, False, False] * 2 + [True, False]
+
+    clock.now = 100.0
+    last = record(1, every = 2.0)
+    assert limit.filter(last) and last.suppressed == 1
+    assert logs.Formatter().format(last) == '[DEBUG] src.test: tick (1 similar messages suppressed)'
+
+
+def test_throttled_call_sites_skip_computing():
+    clock    = Clock()
+    throttle = logs.Throttle(2.0, clock)
+
+    due = []
+    for tick in range(6):
+        clock.now = tick * 0.5
+        due.append(throttle.due())
+    assert due == [True, False, False, False, True, False]
+    assert throttle.extra() == { "suppressed" : 4 } and throttle.extra() == { "suppressed" : 0 }
+
+    last = record(1, **throttle.extra())
+    assert logs.Formatter().format(last) == '[DEBUG] src.test: tick'
+
+
+def test_records_go_through_the_listener_with_levels_per_logger():
+    stream   = io.StringIO()
+    root     = logging.getLogger()
+    handlers = root.handlers[:]
+    level    = root.level
+    try:
+        logs.setup(*logs.parse_levels(['WARN', 'src.test.verbose=debug']), stream = stream)
+
+        values = [1, 2]
+        logging.getLogger('src.test').info('hidden %s', values)
+        logging.getLogger('src.test').warning('values %s', values)
+        logging.getLogger('src.test.verbose').debug('shown %s', values)
+        # the arguments are merged when the record is logged, not when it is written
+        values.append(3)
+    finally:
+        logs.stop()
+        root.handlers[:] = handlers
+        root.setLevel(level)
+        logging.getLogger('src.test.verbose').setLevel(logging.NOTSET)
+
+    assert stream.getvalue().splitlines() == [ '[WARN ] src.test: values [1, 2]'
+                                             , '[DEBUG] src.test.verbose: shown [1, 2]'
+                                             ]
@@ -0,0 +1,39 @@
+from src.metrics import Histogram, Registry, queue_depth
+
+
+def test_quantiles_of_a_histogram():
+    histogram = Histogram.linear(1, 1, 10)
+    for value in range(1, 101):
+        histogram.observe(value / 10.0)
+
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == 5
+    assert histogram.quantile(0.99) == 10
+    assert histogram.snapshot()["max"] == 10.0
+
+
+def test_prometheus_text_format():
+    registry  = Registry()
+    histogram = registry.histogram('latency_milliseconds', 'Latency', Histogram([1, 10]), drone = "0")
+    registry.gauge('queue_depth', 'Queue depth', lambda: 3)
+    for value in [0.5, 5, 50]:
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE latency_milliseconds histogram' in lines
+    assert 'latency_milliseconds_bucket{drone="0",le="1.0"} 1' in lines
+    assert 'latency_milliseconds_bucket{drone="0",le="10.0"} 2' in lines
+    assert 'latency_milliseconds_bucket{drone="0",le="+Inf"} 3' in lines
+    assert 'latency_milliseconds_sum{drone="0"} 55.5' in lines
+    assert 'latency_milliseconds_count{drone="0"} 3' in lines
+    assert 'queue_depth 3.0' in lines
+
+
+def test_queues_without_a_size_report_nan():
+    class Queue():
+        def qsize(self):
+            raise NotImplementedError()
+
+    registry = Registry()
+    registry.gauge('queue_depth', 'Queue depth', queue_depth(Queue()))
+    assert 'queue_depth NaN' in registry.render().splitlines()
@@ -0,0 +1,67 @@
+from src.path import Cube, Point, Scale, Scene, SearchState, Translate, orderTargets
+
+
+def make_scene():
+    wall = Translate(Scale(Cube(), 0.2, 1.6, 1.0), 0.9, 0.0, 0.0)
+    return Scene(2.0, 2.0, 1.0, 0.1, [wall])
+
+
+def test_plan_path_avoids_obstacles():
+    scene = make_scene()
+    start, target = Point(0.45, 0.45, 0.45), Point(1.55, 0.45, 0.45)
+    path = scene.planPath(start, target)
+
+    assert path[-1] == target
+    assert any(point.y > 1.6 for point in path)
+    for point in path:
+        cell = scene.getCoordinate(point)
+        assert not scene.space[cell]
+
+
+def test_order_targets():
+    start   = Point(0, 0, 0)
+    targets = [Point(3, 0, 0), Point(1, 0, 0), Point(2, 0, 0)]
+
+    assert orderTargets(start, targets) == [1, 2, 0]
+
+
+def test_plan_mission_visits_all_targets():
+    scene   = make_scene()
+    start   = Point(0.45, 0.45, 0.45)
+    targets = [Point(1.55, 0.45, 0.45), Point(0.45, 1.05, 0.45)]
+
+    path, order = scene.planMission(start, targets, reorder = True)
+
+    assert order == [1, 0]
+    assert path[-1] == targets[0]
+    assert any(point == targets[1] for point in path)
+
+
+def test_search_state_is_reused():
+    scene = make_scene()
+    state = SearchState(scene)
+    cell  = scene.getCoordinate(Point(0.45, 0.45, 0.45))
+
+    scene.search(cell, cell, Point(0.45, 0.45, 0.45), state)
+    scene.search(cell, cell, Point(0.45, 0.45, 0.45), state)
+
+    assert state.generation == 2
+
+
+def test_distance_field_matches_search():
+    scene  = make_scene()
+    start  = Point(0.45, 0.45, 0.45)
+    target = Point(1.55, 0.45, 0.45)
+
+    field      = scene.distanceField(start)
+    targetCell = scene.checkPoint(target, "Target")
+    path       = scene.search(scene.checkPoint(start, "Start"), targetCell, target, SearchState(scene))
+    walked     = field.pathTo(targetCell, target)
+
+    length = lambda path: sum(a.distanceTo(b) for a, b in zip(path, path[1:]))
+    assert walked[-1] == target
+    assert abs(length(walked) - length(path)) < 1e-9
+    assert scene.distanceField(start) is field
+
+    scene.updateSpace(scene.space)
+    assert scene.distanceField(start) is not field
@@ -0,0 +1,36 @@
+import time
+
+from src.metrics import Histogram
+from src.periodic import CATCH_UP, SKIP, PeriodicScheduler
+
+
+def test_histogram_quantiles():
+    histogram = Histogram.linear(1, 1, 10)
+    for value in range(1, 101):
+        histogram.observe(value / 10)
+
+    assert histogram.count == 100
+    assert histogram.quantile(0.5) == 5
+    assert histogram.snapshot()["max"] == 10
+
+
+def test_deadlines_do_not_drift():
+    clock = PeriodicScheduler(0.005)
+    clock.start()
+    start = time.monotonic()
+    for _ in range(20):
+        clock.wait()
+
+    assert abs(time.monotonic() - start - 0.1) < 0.002
+    assert clock.stats()["ticks"] == 20
+
+
+def test_missed_deadlines():
+    for policy, skipped in [(SKIP, 2), (CATCH_UP, 0)]:
+        clock = PeriodicScheduler(0.05, policy = policy)
+        clock.start()
+        time.sleep(0.175)
+        clock.wait()
+
+        assert clock.missed == 1
+        assert clock.skipped == skipped
@@ -0,0 +1,92 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from threading import Thread
+import time
+
+import pytest
+
+from src.planning_client import PlanningClient, PlanningError
+
+
+class FakePlanner(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        request = loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        self.server.clients.add(self.client_address)
+        time.sleep(self.server.delays.get(request["command"], 0))
+
+        if request.get("data", {}).get("start", [0, 0, 0])[2] < 0:
+            reply = { "error" : "Start is out of bounds!" }
+        else:
+            reply = { "ok" : request }
+
+        body = dumps(reply).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def planner():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakePlanner)
+    server.clients = set()
+    server.delays  = {}
+    Thread(target = server.serve_forever, daemon = True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_requests_reuse_connections(planner):
+    client  = PlanningClient("http://127.0.0.1:{}".format(planner.server_address[1]), drone = 3, workers = 2)
+    replies = []
+
+    for _ in range(2):
+        futures = [client.plan((0, 0, 0), (1, 0, i), callback = replies.append) for i in range(5)]
+        for future in futures:
+            assert future.result(timeout = 5)["ok"]["drone"] == 3
+
+    client.close()
+    assert len(replies) == 10
+    assert len(planner.clients) <= 2
+
+
+def test_landing_is_not_held_up_by_a_slow_plan(planner):
+    client = PlanningClient("http://127.0.0.1:{}".format(planner.server_address[1]))
+    planner.delays["plan"] = 1.0
+
+    plan = client.plan((0, 0, 0), (1, 0, 0))
+    land = client.land((1, 0, 0))
+
+    assert land.result(timeout = 0.5)["ok"]["command"] == "land"
+    assert not plan.done()
+    plan.result(timeout = 5)
+    client.close()
+
+
+def test_errors_are_surfaced(planner):
+    client = PlanningClient("http://127.0.0.1:{}".format(planner.server_address[1]))
+
+    with pytest.raises(PlanningError):
+        client.land((0, 0, -1)).result(timeout = 5)
+
+    client.close()
+    assert client.stats()["failed"] == 1
+
+
+def test_paths_are_numbered(planner):
+    client = PlanningClient("http://127.0.0.1:{}".format(planner.server_address[1]))
+
+    first  = client.plan((0, 0, 0), (1, 0, 0)).result(timeout = 5)["ok"]
+    second = client.stop().result(timeout = 5)["ok"]
+    hover  = client.hover((0, 0, 0)).result(timeout = 5)["ok"]
+
+    client.close()
+    assert first["plan"] < second["plan"] == client.lastPlan
+    assert "plan" not in hover
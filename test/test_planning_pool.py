@@ -0,0 +1,28 @@
+from src.path import Cube, Point, Scale, Scene, Translate
+from src.planning_pool import PlanningPool
+from src.shared import SharedArray
+
+
+def test_shared_array_attach():
+    shared = SharedArray.create((2, 3), 'f8')
+    attached = SharedArray.attach(shared.descriptor())
+    attached.array[1, 2] = 4.0
+
+    assert shared.array[1, 2] == 4.0
+
+    attached.close()
+    shared.close()
+
+
+def test_pool_plans_on_shared_grid():
+    pillar = Translate(Scale(Cube(), 0.4, 0.4, 1.0), 0.8, 0.8, 0.0)
+    scene  = Scene(2.0, 2.0, 1.0, 0.1, [pillar])
+    pool   = PlanningPool(scene, workers = 1)
+
+    start, target = Point(0.45, 1.05, 0.45), Point(1.55, 1.05, 0.45)
+    try:
+        path = pool.planPath(start, target).result()
+    finally:
+        pool.shutdown()
+
+    assert path == scene.planPath(start, target)
@@ -0,0 +1,224 @@
+import queue
+import time
+from collections import deque
+from json import dumps
+from threading import Event, Thread
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import requests
+
+pytest.importorskip("tf")
+
+import src.planning_socket as planning_socket
+from src.PlanningServer import PlanningHTTPServer
+from src.controller import ControllerThread
+from src.path import Cube, PlanningCancelled, Point, Scale, Scene, Translate
+from src.planning_client import SocketPlanningClient
+from src.roadmap import Roadmap
+from src.scheduler import Job
+
+
+def make_scene():
+    pillar = Translate(Scale(Cube(), 0.4, 0.4, 1.0), 0.8, 0.8, 0.0)
+    return Scene(2.0, 2.0, 1.0, 0.1, [pillar])
+
+
+@pytest.fixture
+def server():
+    scene  = make_scene()
+    server = PlanningHTTPServer(("127.0.0.1", 0), [queue.Queue()], scene, workers = 1)
+    yield server
+    server.server_close()
+
+
+def plan(start, target, drone = 0, number = None):
+    request = { "command" : "plan", "drone" : drone, "data" : { "start" : start, "target" : target } }
+    if number is not None:
+        request["plan"] = number
+    return request
+
+
+def test_roadmap_paths_keep_to_the_grid(server):
+    server.roadmap = Roadmap.build(server.scene, samples = 20)
+    server.pool.planPath = lambda start, target: pytest.fail("planned on the grid")
+
+    server.submit(plan([0.5, 1.0, 0.5], [1.5, 1.0, 0.5])).result(timeout = 5)
+    waypoints = server.commandQueues[0].get_nowait().waypoints
+
+    assert waypoints[0].tolist() == [0.5, 1.0, 0.5] and waypoints[-1].tolist() == [1.5, 1.0, 0.5]
+    path = [Point(*waypoint) for waypoint in waypoints]
+    assert server.scene.postprocessPath(path) == path
+
+    # no waypoint and no point in between lies in an occupied cell
+    for p, q in zip(waypoints[:-1], waypoints[1:]):
+        for point in np.linspace(p, q, 50):
+            assert not server.scene.space[server.scene.getCoordinate(Point(*point))]
+
+
+def test_paths_are_stamped_with_the_plan_they_answer(server):
+    # the drone asks for a plan while its landing is being planned
+    planned, planLanding = Event(), server.scene.planLanding
+    server.scene.planLanding = lambda start: planned.wait(5) and planLanding(start)
+
+    land = server.submit({ "command" : "land", "drone" : 0, "plan" : 1, "data" : { "start" : [0.5, 0.5, 0.5] } })
+    server.submit(plan([0.5, 0.5, 0.5], [1.5, 0.5, 0.5], number = 2)).result(timeout = 5)
+    planned.set()
+    land.result(timeout = 5)
+
+    commands = [server.commandQueues[0].get_nowait() for _ in range(2)]
+    assert [command.plan for command in commands] == [2, 1]
+
+    # so it does not land
+    drone = SimpleNamespace(planner = SimpleNamespace(lastPlan = 2), waypoints = deque(), waypoint_times = deque(),
+                            stop_after_path = False)
+    for command in commands:
+        ControllerThread.followPath(drone, command)
+    assert drone.waypoints[-1] == (1.5, 0.5, 0.5) and not drone.stop_after_path
+
+
+def test_identical_requests_run_one_search(server):
+    searching, planPath = Event(), server.pool.planPath
+    searches = []
+    def search(start, target):
+        searches.append(target)
+        searching.set()
+        time.sleep(0.2)
+        return planPath(start, target)
+    server.pool.planPath = search
+
+    first = server.submit(plan([0.5, 0.5, 0.5], [1.5, 0.5, 0.5], number = 1))
+    searching.wait(5)
+    second = server.submit(plan([0.5, 0.5, 0.5], [1.5, 0.5, 0.5], number = 2))
+    first.result(timeout = 5)
+    second.result(timeout = 5)
+
+    assert len(searches) == 1
+    assert server.scheduler.stats()["coalesced"] == 1 and server.scheduler.stats()["cancelled"] == 0
+    # the path answers the newer request, so the drone flies it
+    assert server.commandQueues[0].get_nowait().plan == 2 and server.commandQueues[0].empty()
+
+
+def test_coalesced_socket_requests_deliver_one_path(server, tmp_path):
+    searching, planPath = Event(), server.pool.planPath
+    def search(start, target):
+        searching.set()
+        time.sleep(0.2)
+        return planPath(start, target)
+    server.pool.planPath = search
+
+    local     = planning_socket.serve(str(tmp_path / "planner.sock"), server)
+    delivered = []
+    client    = SocketPlanningClient(str(tmp_path / "planner.sock"), lambda *path: delivered.append(path), drone = 0)
+    try:
+        first = client.plan((0.5, 0.5, 0.5), (1.5, 0.5, 0.5))
+        searching.wait(5)
+        second = client.plan((0.5, 0.5, 0.5), (1.5, 0.5, 0.5))
+        first.result(timeout = 5)
+        second.result(timeout = 5)
+    finally:
+        client.close()
+        local.shutdown()
+        local.server_close()
+
+    assert [(plan, stop) for _, stop, plan, _ in delivered] == [(client.lastPlan, False)]
+    assert delivered[0][0][-1].tolist() == [1.5, 0.5, 0.5]
+
+
+def test_requests_that_arrive_after_newer_ones_are_cancelled(server):
+    server.submit(plan([0.5, 0.5, 0.5], [1.5, 0.5, 0.5], number = 2)).result(timeout = 5)
+    assert server.submit(plan([0.5, 0.5, 0.5], [1.5, 1.5, 0.5], number = 1)).cancelled()
+    assert server.commandQueues[0].qsize() == 1
+
+
+def test_paths_are_routed_by_drone():
+    server = PlanningHTTPServer(("127.0.0.1", 0), [queue.Queue(), queue.Queue()], make_scene(), workers = 1)
+    Thread(target = server.serve_forever, daemon = True).start()
+    url = "http://127.0.0.1:{}".format(server.server_address[1])
+    try:
+        assert "ok" in requests.post(url, data = dumps(plan([0.5, 0.5, 0.5], [1.5, 0.5, 0.5], drone = 1))).json()
+        assert "ok" in requests.post(url, data = dumps(plan([0.5, 1.5, 0.5], [1.5, 1.5, 0.5]))).json()
+        for drone in [2, True]:
+            assert "error" in requests.post(url, data = dumps(plan([0.5, 0.5, 0.5], [1.5, 0.5, 0.5], drone = drone))).json()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert server.commandQueues[1].get_nowait().waypoints[-1].tolist() == [1.5, 0.5, 0.5]
+    assert server.commandQueues[0].get_nowait().waypoints[-1].tolist() == [1.5, 1.5, 0.5]
+    assert server.commandQueues[0].empty() and server.commandQueues[1].empty()
+
+
+def test_dropped_paths_release_their_reservations():
+    server = PlanningHTTPServer(("127.0.0.1", 0), [queue.Queue(), queue.Queue()], make_scene(), workers = 1)
+    start, target = Point(0.5, 0.5, 0.5), Point(1.5, 0.5, 0.5)
+    try:
+        # superseded while the other drones plan
+        job = Job(0, 0, "plan", None, None)
+        job.cancel()
+        with pytest.raises(PlanningCancelled):
+            server.plan(job, start, target)
+        assert server.cooperative.table.size() == 0
+
+        # superseded after the trajectory was reserved
+        job      = Job(1, 0, "plan", None, None)
+        planPath = server.cooperative.planPath
+        def planAndCancel(*args):
+            path = planPath(*args)
+            job.cancel()
+            return path
+        server.cooperative.planPath = planAndCancel
+        with pytest.raises(PlanningCancelled):
+            server.plan(job, start, target)
+        assert server.cooperative.table.size() == 0
+        assert server.commandQueues[0].empty()
+    finally:
+        server.server_close()
+
+
+def test_drones_keep_to_their_reserved_time_steps():
+    server = PlanningHTTPServer(("127.0.0.1", 0), [queue.Queue(), queue.Queue()], make_scene(), workers = 1)
+    reserved, reserve = {}, server.cooperative.table.reserve
+    def record(drone, cells, startStep):
+        reserved[drone] = (cells, startStep)
+        reserve(drone, cells, startStep)
+    server.cooperative.table.reserve = record
+    try:
+        # drone 0 crosses the path of drone 1
+        server.submit(plan([0.25, 0.55, 0.5], [1.55, 0.55, 0.5], drone = 1)).result(timeout = 5)
+        server.submit(plan([0.55, 0.25, 0.5], [0.55, 1.55, 0.5], drone = 0)).result(timeout = 5)
+    finally:
+        server.server_close()
+
+    # fly both paths on the clock of the server, starting when they were sent
+    now, drones, sent = [0.0], {}, {}
+    for drone in [1, 0]:
+        command = server.commandQueues[drone].get_nowait()
+        cells, startStep = reserved[drone]
+        assert len(command.waypoints) == len(command.times) == len(cells) + 1
+        sent[drone]   = server.origin + startStep * server.stepTime - command.times[0]
+        drones[drone] = SimpleNamespace(planner = SimpleNamespace(lastPlan = 0), waypoints = deque(), waypoint_times = deque(),
+                                        stop_after_path = False, commands = deque(), reference = None,
+                                        time = SimpleNamespace(monotonic = lambda: now[0]))
+        drones[drone].setAbsoluteTarget = lambda x, y, z, drone = drones[drone]: setattr(drone, "reference", Point(x, y, z))
+        now[0] = sent[drone]
+        ControllerThread.followPath(drones[drone], command)
+
+    # the reference of each drone is in the cell it reserved for every time step
+    grid  = server.cooperative.grid
+    first = int((max(sent.values()) - server.origin) / server.stepTime) + 1
+    last  = max(startStep + len(cells) for cells, startStep in reserved.values()) + 2
+    flown = { drone : [] for drone in drones }
+    now[0] = max(sent.values())
+    for step in range(first, last):
+        while now[0] < server.origin + (step + 0.5) * server.stepTime:
+            for drone in drones.values():
+                ControllerThread.next_target(drone)
+            now[0] += 0.01
+        for drone, (cells, startStep) in reserved.items():
+            reference = drones[drone].reference
+            assert grid.index(server.scene.checkPoint(reference, "Reference")) == cells[min(step - startStep, len(cells) - 1)]
+            flown[drone].append(reference)
+
+    assert server.cooperative.conflicts(list(flown.values())) == 0
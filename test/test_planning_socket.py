@@ -0,0 +1,38 @@
+from io import BytesIO
+
+import src.planning_socket as planning_socket
+from src.path import Point
+
+
+def test_request_round_trip():
+    request = { "command" : "plan_mission"
+              , "drone"   : 2
+              , "data"    : { "start" : [0.5, 0.5, 1.0], "targets" : [[1.0, 2.0, 1.0], [3.0, 1.0, 0.5]], "reorder" : True }
+              }
+
+    assert planning_socket.decodeRequest(BytesIO(planning_socket.encodeRequest(request))) == request
+
+    request = { "command" : "land", "drone" : 0, "plan" : 7, "data" : { "start" : [0.5, 0.5, 1.0] } }
+    assert planning_socket.decodeRequest(BytesIO(planning_socket.encodeRequest(request))) == request
+
+
+def test_reply_round_trip():
+    path  = [Point(0.5, 0.5, 1.0), Point(1.0, 2.0, 1.0)]
+    frame = planning_socket.encodeReply(planning_socket.OK, path, stop = True, order = [1, 0], plan = 7, times = [-0.1, 0.1])
+
+    status, waypoints, stop, order, plan, times = planning_socket.decodeReply(BytesIO(frame))
+    assert status == planning_socket.OK
+    assert waypoints.tolist() == [[0.5, 0.5, 1.0], [1.0, 2.0, 1.0]]
+    assert stop
+    assert order == [1, 0]
+    assert plan == 7
+    assert times.tolist() == [-0.1, 0.1]
+
+    frame = planning_socket.encodeReply(planning_socket.ERROR, message = "Target is out of bounds!")
+    assert planning_socket.decodeReply(BytesIO(frame))[3] == "Target is out of bounds!"
+
+    frame = planning_socket.encodeReply(planning_socket.OK)
+    assert planning_socket.decodeReply(BytesIO(frame))[4] is None
+
+    frame = planning_socket.encodeReply(planning_socket.OK, path)
+    assert planning_socket.decodeReply(BytesIO(frame))[5] is None
@@ -0,0 +1,49 @@
+import numpy as np
+
+from src.path import Cube, Point, Scale, Scene, Translate
+import src.roadmap as roadmaps
+from src.roadmap import Roadmap, segmentsBlocked
+
+
+def make_scene():
+    pillar = Translate(Scale(Cube(), 0.4, 0.4, 1.0), 0.8, 0.8, 0.0)
+    return Scene(2.0, 2.0, 1.0, 0.1, [pillar])
+
+
+def test_segments_blocked():
+    lower = np.array([[1.0, 1.0, 1.0]])
+    upper = np.array([[2.0, 2.0, 2.0]])
+    p0 = np.array([[0.0, 1.5, 1.5], [0.0, 0.5, 1.5], [0.0, 1.0, 1.5], [1.5, 1.5, 0.0]])
+    p1 = np.array([[3.0, 1.5, 1.5], [3.0, 0.5, 1.5], [3.0, 1.0, 1.5], [1.5, 1.5, 0.5]])
+    assert list(segmentsBlocked(p0, p1, lower, upper)) == [True, False, False, False]
+
+
+def test_plan_around_obstacle():
+    roadmap = Roadmap.build(make_scene(), samples=20)
+    start, target = Point(0.5, 1.0, 0.5), Point(1.5, 1.0, 0.5)
+    path = roadmap.planPath(start, target)
+
+    assert path[0] == start and path[-1] == target
+    assert len(path) > 2
+
+    points = np.array([[p.x, p.y, p.z] for p in path])
+    assert not segmentsBlocked(points[:-1], points[1:], roadmap.lower, roadmap.upper).any()
+
+
+def test_save_and_load(tmp_path):
+    roadmap = Roadmap.build(make_scene(), samples=0, digest='abc')
+    roadmap.save(str(tmp_path / 'room.roadmap.npz'))
+    loaded = Roadmap.load(str(tmp_path / 'room.roadmap.npz'))
+
+    assert loaded.digest == 'abc'
+    assert np.allclose(loaded.nodes, roadmap.nodes)
+    assert np.array_equal(loaded.nextHop, roadmap.nextHop)
+
+
+def test_outdated_roadmaps_are_ignored(tmp_path, caplog):
+    spec = tmp_path / 'room.yaml'
+    spec.write_text('dimensions: {}\n')
+    Roadmap.build(make_scene(), samples=0, digest='abc').save(roadmaps.roadmapPath(str(spec)))
+
+    assert roadmaps.load(str(spec)) is None
+    assert 'outdated' in caplog.text
@@ -0,0 +1,84 @@
+from concurrent.futures import CancelledError
+from threading import Event
+
+import pytest
+
+from src.scheduler import Scheduler
+
+
+def blocker(started, release):
+    def run(job):
+        started.set()
+        release.wait(5)
+        return "blocked"
+    return run
+
+
+def test_urgent_jobs_run_first():
+    scheduler = Scheduler(1)
+    started, release = Event(), Event()
+    order = []
+
+    scheduler.submit(0, "plan", "a", blocker(started, release))
+    started.wait(5)
+    plan = scheduler.submit(1, "plan", "b", lambda job: order.append("plan"))
+    land = scheduler.submit(2, "land", None, lambda job: order.append("land"))
+    release.set()
+    plan.result(5)
+    land.result(5)
+
+    assert order == ["land", "plan"]
+
+
+def test_newer_plan_cancels_older_and_identical_are_coalesced():
+    scheduler = Scheduler(1)
+    started, release = Event(), Event()
+
+    running = scheduler.submit(0, "plan", "a", blocker(started, release))
+    started.wait(5)
+    interrupted = []
+    scheduler.pending[(0, "plan", "a")].onCancel = lambda: interrupted.append(True) or release.set()
+
+    older = scheduler.submit(0, "plan", "b", lambda job: "b")
+    assert scheduler.submit(0, "plan", "b", lambda job: "other") is older
+    newer = scheduler.submit(0, "plan", "c", lambda job: "c")
+
+    assert newer.result(5) == "c"
+    assert running.result(5) == "blocked"
+    assert interrupted == [True]
+    with pytest.raises(CancelledError):
+        older.result(5)
+
+    stats = scheduler.stats()
+    assert stats["cancelled"] == 2
+    assert stats["coalesced"] == 1
+    assert stats["queued"] == 0
+
+
+def test_identical_jobs_answer_the_newest_plan():
+    scheduler = Scheduler(1)
+    started, release, closed, finish = Event(), Event(), Event(), Event()
+    runs = []
+
+    def run(job):
+        runs.append(job.plan)
+        started.set()
+        release.wait(5)
+        plan = scheduler.close(job)
+        closed.set()
+        finish.wait(5)
+        return plan
+
+    # coalesced while it runs, until its result went out
+    first  = scheduler.submit(0, "plan", "a", run, plan = 1)
+    started.wait(5)
+    second = scheduler.submit(0, "plan", "a", run, plan = 2)
+    release.set()
+    closed.wait(5)
+    third  = scheduler.submit(0, "plan", "a", run, plan = 3)
+    finish.set()
+
+    assert second is first and third is not first
+    assert first.result(5) == 2 and third.result(5) == 3
+    assert runs == [1, 3]
+    assert scheduler.stats()["coalesced"] == 1
@@ -0,0 +1,95 @@
+import time
+
+import numpy as np
+import pytest
+from cflib.crazyflie.log import LogConfig
+
+from src.control_law import ControlGains, ControlState, control_step
+from src.simulator import Quadrotor, SimulatedClock, SimulatedCrazyflie
+
+
+def test_control_law_flies_the_model_to_the_target():
+    model   = Quadrotor(position = (0.5, 0.5, 0.0))
+    gains   = ControlGains()
+    control = ControlState()
+    control.pos_ref[:] = (1.5, 0.0, 1.0)
+
+    model.command(0, 0.0, 0.0, 0.0, 0)
+    for _ in range(500):
+        control.pos[:], control.vel[:] = model.pos[0], model.vel[0]
+        model.command(0, *control_step(gains, control, 0.02))
+        for _ in range(10):
+            model.step(0.002)
+
+    assert np.allclose(model.pos[0], control.pos_ref, atol = 0.05)
+
+
+def test_motors_are_locked_until_a_zero_setpoint():
+    model = Quadrotor()
+    model.command(0, 0.0, 0.0, 0.0, 60000)
+    model.step(0.1)
+    assert model.pos[0, 2] == 0.0
+
+    model.command(0, 0.0, 0.0, 0.0, 0)
+    model.command(0, 0.0, 0.0, 0.0, 60000)
+    model.step(0.1)
+    assert model.pos[0, 2] > 0.0
+
+
+def test_quaternion_matches_rotation():
+    model = Quadrotor(count = 2)
+    model.att[:] = [(0.3, -0.2, 1.0), (-0.1, 0.4, -2.0)]
+
+    for (w, x, y, z), R in zip(model.quaternion(), model.rotation()):
+        expected = [ [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)]
+                   , [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)]
+                   , [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)]
+                   ]
+        assert np.allclose(R, expected)
+
+
+def test_log_blocks_are_streamed_once_started():
+    cf = SimulatedCrazyflie(position = (1.0, 2.0, 0.0), clock = SimulatedClock(10))
+
+    received = []
+    connected = []
+    cf.connected.add_callback(connected.append)
+
+    log = LogConfig(name = 'Kalman Position', period_in_ms = 20)
+    for name in ['kalman.stateX', 'kalman.stateY', 'kalman.stateZ']:
+        log.add_variable(name, 'float')
+    log.data_received_cb.add_callback(lambda timestamp, data, logconf: received.append(data))
+
+    cf.open_link('sim://0')
+    try:
+        cf.log.add_config(log)
+        assert log.valid
+        time.sleep(0.05)
+        assert received == []
+
+        log.start()
+        time.sleep(0.1)
+    finally:
+        cf.close_link()
+
+    assert connected == ['sim://0']
+    # 1s of simulated time at 50Hz
+    assert len(received) > 10
+    assert received[-1] == {'kalman.stateX': 1.0, 'kalman.stateY': 2.0, 'kalman.stateZ': 0.0}
+
+
+def test_log_config_is_validated():
+    cf = SimulatedCrazyflie()
+
+    unknown = LogConfig(name = 'Unknown', period_in_ms = 10)
+    unknown.add_variable('kalman.unknown', 'float')
+    with pytest.raises(KeyError):
+        cf.log.add_config(unknown)
+
+    # 28 bytes do not fit into a radio packet
+    large = LogConfig(name = 'Large', period_in_ms = 10)
+    for name in ['kalman.stateX', 'kalman.stateY', 'kalman.stateZ', 'kalman.q0', 'kalman.q1', 'kalman.q2', 'kalman.q3']:
+        large.add_variable(name, 'float')
+    with pytest.raises(AttributeError):
+        cf.log.add_config(large)
+    assert not large.valid
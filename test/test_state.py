@@ -0,0 +1,73 @@
+import multiprocessing
+import time
+from threading import Thread
+
+import numpy as np
+
+from src.state import SharedState, StateStore
+
+
+def test_snapshots_are_consistent():
+    store = StateStore({ 'pos' : 3, 'attq' : 4 })
+    done  = False
+
+    def publish():
+        i = 0
+        while not done:
+            i += 1
+            store.publish(i, pos = (i, i, i), attq = (i, i, i, i))
+
+    writer = Thread(target = publish)
+    writer.start()
+    try:
+        for _ in range(2000):
+            state = store.snapshot()
+            assert (state.pos == state.attq[0]).all() and (state.attq == state.attq[0]).all()
+            assert state.timestamp['pos'] == state.pos[0]
+    finally:
+        done = True
+        writer.join()
+
+
+def test_age_of_fields():
+    store = StateStore({ 'pos' : 3, 'vel' : 3 }, initial = { 'vel' : (1, 2, 3) })
+    store.publish(pos = (1, 2, 3))
+
+    state = store.snapshot()
+    assert state.age('pos') < 1.0
+    assert state.age('vel') == float('inf')
+    assert state.vel.tolist() == [1, 2, 3]
+
+
+def test_shared_state_is_read_consistently_by_other_processes():
+    shared = SharedState({ 'pos' : 3, 'ref' : 3 })
+    assert shared.read() == (0, None)
+
+    context = multiprocessing.get_context('spawn')
+    ready   = context.Event()
+    done    = context.Event()
+    reader  = context.Process(target = _read_shared, args = (shared, ready, done))
+    reader.start()
+    try:
+        assert ready.wait(30)
+        i   = 0
+        end = time.monotonic() + 0.5
+        while time.monotonic() < end:
+            i += 1
+            shared.write(pos = (i, i, i), ref = (i, i, i))
+    finally:
+        done.set()
+        reader.join()
+
+    assert reader.exitcode == 0
+    sequence, fields = shared.read()
+    assert sequence == 2 * i and (fields['ref'] == i).all()
+
+
+def _read_shared(shared, ready, done):
+    ready.set()
+    while not done.is_set():
+        sequence, fields = shared.read()
+        if fields is not None:
+            values = np.r_[fields['pos'], fields['ref']]
+            assert (values == values[0]).all()
@@ -0,0 +1,65 @@
+import numpy as np
+
+from src.swarm import Swarm
+
+
+class Start():
+    def execute(self, drone):
+        drone.startMotors()
+
+
+class Land():
+    def execute(self, drone):
+        drone.land()
+
+
+def test_drones_follow_their_streams_and_land():
+    swarm = Swarm([(0.5, 0.5, 0.0), (1.5, 0.5, 0.0), (2.5, 0.5, 0.0)])
+    for i in range(3):
+        swarm.send(i, Start(), (0.5 + i, 1.5, 1.0), (0.5 + i, 1.0, 0.5), Land())
+
+    swarm.run(timeout = 30)
+
+    assert not swarm.enabled.any()
+    assert np.allclose(swarm.model.pos[:, :2], [(0.5, 1.0), (1.5, 1.0), (2.5, 1.0)], atol = 0.2)
+    assert (swarm.model.pos[:, 2] < 0.05).all()
+    assert swarm.min_separation > 0.9
+
+
+def test_batch_matches_single_drones():
+    starts = [(0.5, 0.5, 0.0), (2.0, 3.0, 0.0)]
+    paths  = [[(1.0, 1.0, 1.0), (2.0, 1.0, 1.5)], [(2.0, 2.0, 0.5)]]
+
+    swarm = Swarm(starts)
+    for i, path in enumerate(paths):
+        swarm.send(i, Start(), *path)
+    swarm.run(timeout = 30)
+
+    for i, path in enumerate(paths):
+        single = Swarm(starts[i])
+        single.send(0, Start(), *path)
+        single.run(timeout = 30)
+        assert np.isclose(single.finished[0], swarm.finished[i])
+
+        # the swarm went on until its last drone finished
+        while single.time < swarm.time - single.dt / 2:
+            single.step()
+        assert np.allclose(single.model.pos[0], swarm.model.pos[i])
+
+
+def test_relative_targets_are_planned():
+    planned = []
+    def planner(start, target):
+        planned.append((start, target))
+        return [(start[0], start[1], target[2]), target]
+
+    class Move():
+        def execute(self, drone):
+            drone.setRelativeTarget(1.0, 0.0, 0.5)
+
+    swarm = Swarm([(0.5, 0.5, 0.0)], planner = planner)
+    swarm.send(0, Start(), Move())
+    swarm.run(timeout = 30)
+
+    assert np.allclose(planned[0][1], (1.5, 0.5, 0.8))
+    assert np.allclose(swarm.control.pos_ref[0], (1.5, 0.5, 0.8))
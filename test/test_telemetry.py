@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+
+from src.simulator import SimulatedClock, SimulatedCrazyflie
+from src.state import StateStore
+from src.telemetry import LOG_BLOCK_SIZE, Telemetry, TelemetryField
+
+
+FIELDS = [ TelemetryField('stab_att', ['stabilizer.roll', 'stabilizer.pitch', 'stabilizer.yaw'])
+         , TelemetryField('pos',      ['kalman.stateX', 'kalman.stateY', 'kalman.stateZ'])
+         , TelemetryField('vel_bf',   ['kalman.statePX', 'kalman.statePY', 'kalman.statePZ'])
+         , TelemetryField('attq',     ['kalman.q0', 'kalman.q1', 'kalman.q2', 'kalman.q3'])
+         ]
+
+
+def test_fields_are_packed_into_few_blocks():
+    for fp16, blocks in [(False, 3), (True, 1)]:
+        telemetry = Telemetry(FIELDS, 20, fp16 = fp16)
+        assert len(telemetry.blocks) == blocks
+        assert all(block["bytes"] <= LOG_BLOCK_SIZE for block in telemetry.stats().values())
+
+    # only fields with the same period share a block
+    telemetry = Telemetry(FIELDS, 20, periods = { 'stab_att' : 100 }, fp16 = True)
+    assert sorted(logconf.name for logconf, _ in telemetry.blocks) == ['attq+pos+vel_bf', 'stab_att']
+
+
+def test_a_block_is_published_at_once():
+    clock     = SimulatedClock(10)
+    cf        = SimulatedCrazyflie(position = (1.0, 2.0, 0.0), clock = clock)
+    store     = StateStore({ 'stab_att' : 3, 'pos' : 3, 'vel_bf' : 3, 'attq' : 4 }, clock = clock)
+    telemetry = Telemetry(FIELDS, 20, fp16 = True, clock = clock)
+
+    cf.open_link('sim://0')
+    try:
+        telemetry.start(cf, store.publish)
+        time.sleep(0.1)
+    finally:
+        cf.close_link()
+
+    state = store.snapshot()
+    assert np.allclose(state.pos, (1.0, 2.0, 0.0))
+    assert np.allclose(state.attq, (1.0, 0.0, 0.0, 0.0))
+    assert len(set(state.received.values())) == 1
+    [block] = telemetry.stats().values()
+    assert block['frames'] > 10
@@ -1,4 +1,9 @@
-from src.voice_control_loop import generate_protocol_data, get_best_direction_match
+import time
+
+import pytest
+import speech_recognition as sr
+
+from src.voice_control_loop import VoiceCapture, generate_protocol_data, get_best_direction_match
 
 
 def test_generate_protocol_data():
@@ -18,4 +23,42 @@ def test_get_best_direction_match():
     assert get_best_direction_match('town') == 'down'
 
 
+class Microphone():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class Recognizer():
+    """Hears the given utterances, one per call of ``listen``, and then silence."""
+    def __init__(self, utterances):
+        self.utterances       = list(utterances)
+        self.calibrated       = 0
+        self.energy_threshold = 300
+
+    def adjust_for_ambient_noise(self, source, duration):
+        self.calibrated += 1
+
+    def listen(self, source, timeout, phrase_time_limit):
+        if not self.utterances:
+            time.sleep(0.01)
+            raise sr.WaitTimeoutError()
+        return self.utterances.pop(0)
+
+
+def test_voice_capture_calibrates_once_and_queues_utterances():
+    dropped    = VoiceCapture.dropped
+    recognizer = Recognizer(['crazy', 'up', 'ten', 'twenty'])
+    capture    = VoiceCapture(recognizer, Microphone(), backlog = 3).start()
+
+    # the oldest utterance is dropped when recognition falls behind
+    while VoiceCapture.dropped == dropped:
+        time.sleep(0.01)
+    assert [capture.get(timeout = 1)[0] for _ in range(3)] == ['up', 'ten', 'twenty']
+    assert recognizer.calibrated == 1 and recognizer.dynamic_energy_threshold
 
+    capture.stop()
+    with pytest.raises(RuntimeError):
+        capture.get(timeout = 1)